@@ -0,0 +1,93 @@
+import asyncio
+from collections import deque
+
+
+class Admission:
+    """Caps the number of concurrent call sessions on this process.
+
+    Up to `max_sessions` calls run at once. Beyond that, up to `queue_size`
+    callers wait at most `queue_timeout` seconds for a slot to free up, in
+    arrival order; everyone else is turned away straight away. Once
+    `start_drain()` is called no new session is admitted and `wait_idle()`
+    lets shutdown wait for the calls in flight.
+    """
+
+    def __init__(self, max_sessions, queue_size=0, queue_timeout=2.0):
+        self.max_sessions = max_sessions
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.rejected = 0
+        self.draining = False
+        self._waiters = deque()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def ready(self):
+        """Readiness: a new call would start right away."""
+        return not self.draining and self.active < self.max_sessions
+
+    def accepting(self):
+        """A new call would at least get a place in the wait queue."""
+        if self.draining:
+            return False
+        return self.active < self.max_sessions or self.waiting < self.queue_size
+
+    async def acquire(self):
+        if self.draining:
+            return self._reject()
+        if self.active < self.max_sessions and not self._waiters:
+            self._take()
+            return True
+        if self.waiting >= self.queue_size:
+            return self._reject()
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # release() hands its slot straight to the waiter, so a True
+            # result means `active` already accounts for this session.
+            if await asyncio.wait_for(waiter, self.queue_timeout):
+                return True
+            return self._reject()
+        except asyncio.TimeoutError:
+            return self._reject()
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.active -= 1
+        if self.active == 0:
+            self._idle.set()
+
+    def start_drain(self):
+        self.draining = True
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(False)
+
+    async def wait_idle(self, timeout):
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _take(self):
+        self.active += 1
+        self._idle.clear()
+
+    def _reject(self):
+        self.rejected += 1
+        return False
@@ -0,0 +1,228 @@
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from google.genai import types
+
+import tools
+import usage
+from prompts import prompts, tool_config
+
+log = logging.getLogger(__name__)
+
+# Which assistant a call talks to is picked per connection, so one fleet can
+# serve every clinic: `?assistant=<name>` on the connect URL, or the path
+# (`/<name>`, `/twilio/<name>` for phone calls), else DEFAULT_ASSISTANT.
+#
+# Built-in assistants come from prompts.py. More are defined as JSON files in
+# ASSISTANTS_DIR, one per assistant, named after the file (`clinic_a.json`):
+#
+#   {
+#     "extends": "yoda_diagnostics",        prompt and tools to start from
+#     "prompt": "...",                      or "prompt_file": "clinic_a.md"
+#     "tools": ["get_test_details"],        declarations kept, by name
+#     "function_declarations": [{...}],     added or overriding declarations
+#     "voice": "Kore",
+#     "model": "gemini-2.0-flash-live-001",
+#     "budget": {"hard_tokens": 200000}     usage limits, see usage.py
+#   }
+#
+# The directory is polled every ASSISTANTS_RELOAD_INTERVAL seconds; changed
+# files are rebuilt and swapped in for new calls, calls in progress keep the
+# version they started with. A file that fails to load leaves the previous
+# version in place.
+ASSISTANTS_DIR = os.getenv("ASSISTANTS_DIR")
+RELOAD_INTERVAL = float(os.getenv("ASSISTANTS_RELOAD_INTERVAL", "5"))
+DEFAULT_ASSISTANT = os.getenv("DEFAULT_ASSISTANT", "yoda_diagnostics")
+TWILIO_SEGMENT = "twilio"
+
+
+class UnknownAssistant(KeyError):
+    pass
+
+
+class Assistant:
+    """One tenant, with the LiveConnectConfig built for it once at load.
+
+    `functions` are the tool implementations it was built with; a call runs
+    its tools from there, so a reload that drops a tool leaves calls already
+    in progress able to use it.
+    """
+
+    def __init__(self, name, model, config, tool_names, budget=usage.DEFAULT_BUDGET):
+        self.name = name
+        self.model = model
+        self.config = config
+        self.tool_names = tool_names
+        self.functions = tools.functions(tool_names)
+        self.budget = budget
+
+
+def name_from_path(path):
+    url = urlsplit(path or "")
+    if name := parse_qs(url.query).get("assistant", [None])[0]:
+        return name
+    segments = [segment for segment in url.path.split("/") if segment]
+    if segments and segments[0] == TWILIO_SEGMENT:
+        segments = segments[1:]
+    return segments[0] if segments else None
+
+
+def _declaration_index():
+    return {
+        declaration.name: declaration
+        for tool in tool_config.values()
+        for declaration in tool.function_declarations
+    }
+
+
+class Registry:
+    """Assistants by name, built-ins plus the files in `directory`.
+
+    `on_change(name, assistant)` is called whenever an assistant is added or
+    rebuilt, and with `assistant=None` when its file goes away.
+    """
+
+    def __init__(self, base_config, model, directory=None, on_change=None):
+        self.base_config = base_config
+        self.model = model
+        self.directory = Path(directory) if directory else None
+        self.on_change = on_change
+        self.assistants = {}
+        self.builtin = {}
+        self.signatures = {}
+        self.sources = {}
+        for name in prompts:
+            assistant = self.build(
+                name, prompts[name], tool_config[name].function_declarations
+            )
+            self.builtin[name] = assistant
+            self._set(assistant)
+        self.reload()
+
+    def build(self, name, prompt, declarations, voice=None, model=None, budget=None):
+        update = {
+            "system_instruction": prompt,
+            "tools": [types.Tool(function_declarations=declarations)],
+        }
+        if voice:
+            update["speech_config"] = types.SpeechConfig(
+                voice_config=types.VoiceConfig(
+                    prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name=voice)
+                )
+            )
+        return Assistant(
+            name,
+            model or self.model,
+            self.base_config.model_copy(update=update),
+            [declaration.name for declaration in declarations],
+            budget or usage.DEFAULT_BUDGET,
+        )
+
+    def load(self, path):
+        spec = json.loads(path.read_text())
+        name = path.stem
+        base = self.assistants.get(spec.get("extends", DEFAULT_ASSISTANT))
+        if base is None:
+            raise UnknownAssistant(spec.get("extends"))
+        sources = [path]
+        if "prompt_file" in spec:
+            sources.append(path.parent / spec["prompt_file"])
+            prompt = sources[-1].read_text()
+        else:
+            prompt = spec.get("prompt", base.config.system_instruction)
+
+        declarations = _declaration_index()
+        for raw in spec.get("function_declarations", []):
+            declaration = types.FunctionDeclaration.model_validate(raw)
+            declarations[declaration.name] = declaration
+        names = list(spec.get("tools", base.tool_names))
+        names += [
+            raw["name"]
+            for raw in spec.get("function_declarations", [])
+            if raw["name"] not in names
+        ]
+        unknown = [name for name in names if name not in declarations]
+        if unknown:
+            raise KeyError(f"no declaration for tools {unknown}")
+        unknown = [name for name in names if name not in tools.implementations]
+        if unknown:
+            raise KeyError(f"no implementation for tools {unknown}")
+        assistant = self.build(
+            name,
+            prompt,
+            [declarations[name] for name in names],
+            voice=spec.get("voice"),
+            model=spec.get("model"),
+            budget=usage.Budget.from_spec(spec.get("budget"), base.budget),
+        )
+        self.sources[name] = sources
+        return assistant
+
+    def _signature(self, name, path):
+        # A prompt_file edit has to trigger a reload too, so every file the
+        # assistant was last read from counts.
+        signature = []
+        for source in self.sources.get(name, [path]):
+            stat = source.stat()
+            signature.append((str(source), stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def reload(self):
+        if self.directory is None or not self.directory.is_dir():
+            return
+        seen = set()
+        for path in sorted(self.directory.glob("*.json")):
+            name = path.stem
+            seen.add(name)
+            try:
+                signature = self._signature(name, path)
+                if self.signatures.get(name) == signature:
+                    continue
+                # Recorded before loading so a broken file is reported once.
+                self.signatures[name] = signature
+                assistant = self.load(path)
+                self.signatures[name] = self._signature(name, path)
+            except Exception as e:
+                log.warning("could not load assistant %s from %s: %r", name, path, e)
+                continue
+            log.info("loaded assistant %s", name)
+            self._set(assistant)
+        for name in set(self.signatures) - seen:
+            del self.signatures[name]
+            self.sources.pop(name, None)
+            self._remove(name)
+
+    def _set(self, assistant):
+        tools.register(assistant.name, assistant.tool_names)
+        self.assistants[assistant.name] = assistant
+        if self.on_change is not None:
+            self.on_change(assistant.name, assistant)
+
+    def _remove(self, name):
+        # A built-in shadowed by a file comes back when the file goes.
+        if name in self.builtin:
+            self._set(self.builtin[name])
+            return
+        log.info("removed assistant %s", name)
+        self.assistants.pop(name, None)
+        tools.unregister(name)
+        if self.on_change is not None:
+            self.on_change(name, None)
+
+    def get(self, name):
+        try:
+            return self.assistants[name]
+        except KeyError:
+            raise UnknownAssistant(name) from None
+
+    def resolve(self, path):
+        return self.get(name_from_path(path) or DEFAULT_ASSISTANT)
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(RELOAD_INTERVAL)
+            self.reload()
@@ -0,0 +1,171 @@
+import asyncio
+import contextlib
+from collections import defaultdict, deque
+
+# What to do when a put would take the queue past its byte limit.
+DROP_OLDEST = "drop_oldest"  # discard whole chunks from the head
+COALESCE = "coalesce"  # merge into one buffer and trim the oldest bytes
+DISCONNECT = "disconnect"  # raise QueueOverflow and end the session
+POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+SAMPLE_WIDTH = 2  # 16-bit PCM, trimming never splits a sample
+
+
+class QueueOverflow(Exception):
+    pass
+
+
+class AudioQueue:
+    """Single-consumer queue of PCM chunks bounded by total bytes.
+
+    Unlike `asyncio.Queue(maxsize=n)` the limit is in bytes, so the memory a
+    session can hold is predictable whatever the chunk sizes, and `put` never
+    blocks the producer; overflow is resolved by `policy` instead. Every
+    queue keeps its own counters, the class attributes sum them over all
+    queues of the same name in the process.
+    """
+
+    buffered_by_name = defaultdict(int)
+    dropped_by_name = defaultdict(int)
+
+    def __init__(self, max_bytes, policy=DROP_OLDEST, name="audio"):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown overflow policy {policy!r}")
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.name = name
+        self.buffered_bytes = 0
+        self.peak_bytes = 0
+        self.dropped_bytes = 0
+        self.dropped_chunks = 0
+        self._chunks = deque()
+        self._not_empty = asyncio.Event()
+        self._clears = 0
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def empty(self):
+        return not self._chunks
+
+    def put_nowait(self, chunk):
+        size = len(chunk)
+        if self.buffered_bytes + size > self.max_bytes:
+            self._overflow(size)
+        self._chunks.append(chunk)
+        self._account(size)
+        self.peak_bytes = max(self.peak_bytes, self.buffered_bytes)
+        self._not_empty.set()
+
+    async def get(self):
+        while not self._chunks:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        chunk = self._chunks.popleft()
+        self._account(-len(chunk))
+        return chunk
+
+    async def coalesce(self, chunk, buffer, max_hold):
+        """Join `chunk`, just taken from the queue, with the chunks after it.
+
+        Waits up to `max_hold` seconds for enough audio to fill `buffer`,
+        then copies as many whole chunks into it as fit. A chunk that would
+        not fit ends the frame, and an empty chunk (end of stream) or one
+        that fills the buffer alone is returned as it is. A coalesced frame
+        is a memoryview of `buffer`, valid until the next call. Returns None
+        if the queue was cleared while waiting, e.g. on barge-in.
+        """
+        size = len(buffer)
+        if not chunk or len(chunk) >= size:
+            return chunk
+        clears = self._clears
+        if max_hold > 0:
+            with contextlib.suppress(TimeoutError):
+                async with asyncio.timeout(max_hold):
+                    while self.buffered_bytes + len(chunk) < size and not (
+                        self._chunks and not self._chunks[-1]
+                    ):
+                        self._not_empty.clear()
+                        await self._not_empty.wait()
+            if clears != self._clears:
+                return None
+        if not self._chunks or len(chunk) + len(self._chunks[0]) > size:
+            return chunk
+        view = memoryview(buffer)
+        filled = len(chunk)
+        view[:filled] = chunk
+        while self._chunks and 0 < len(self._chunks[0]) <= size - filled:
+            chunk = self._chunks.popleft()
+            self._account(-len(chunk))
+            view[filled : filled + len(chunk)] = chunk
+            filled += len(chunk)
+        return view[:filled]
+
+    def get_nowait(self):
+        if not self._chunks:
+            raise asyncio.QueueEmpty
+        chunk = self._chunks.popleft()
+        self._account(-len(chunk))
+        return chunk
+
+    def requeue(self, chunk):
+        """Put a chunk back at the head, e.g. one whose send failed.
+
+        Skips the byte limit: the chunk was already admitted once.
+        """
+        self._chunks.appendleft(chunk)
+        self._account(len(chunk))
+        self._not_empty.set()
+
+    def clear(self):
+        self._account(-self.buffered_bytes)
+        self._chunks.clear()
+        self._clears += 1
+
+    def _account(self, delta):
+        self.buffered_bytes += delta
+        AudioQueue.buffered_by_name[self.name] += delta
+
+    def _overflow(self, incoming):
+        if self.policy == DISCONNECT:
+            raise QueueOverflow(
+                f"{self.name} queue over {self.max_bytes} bytes"
+                f" ({self.buffered_bytes} buffered, {incoming} incoming)"
+            )
+
+        excess = self.buffered_bytes + incoming - self.max_bytes
+        if self.policy == DROP_OLDEST:
+            while self._chunks and excess > 0:
+                chunk = self._chunks.popleft()
+                excess -= len(chunk)
+                self._drop(len(chunk), chunks=1)
+            return
+
+        # COALESCE: keep the newest audio as one contiguous buffer so the loss
+        # is exactly the overflow rather than a whole chunk.
+        merged = b"".join(self._chunks)
+        dropped_chunks = len(self._chunks)
+        self._chunks.clear()
+        self._account(-len(merged))
+        trim = min(len(merged), excess + (-excess % SAMPLE_WIDTH))
+        if trim < len(merged):
+            self._chunks.append(merged[trim:])
+            self._account(len(merged) - trim)
+            dropped_chunks -= 1
+        self.dropped_bytes += trim
+        self.dropped_chunks += dropped_chunks
+        AudioQueue.dropped_by_name[self.name] += trim
+
+    def _drop(self, size, chunks):
+        self._account(-size)
+        self.dropped_bytes += size
+        self.dropped_chunks += chunks
+        AudioQueue.dropped_by_name[self.name] += size
+
+    def stats(self):
+        # For the session log, read once the session has ended.
+        return {
+            "peak_bytes": self.peak_bytes,
+            "dropped_bytes": self.dropped_bytes,
+            "dropped_chunks": self.dropped_chunks,
+        }
@@ -0,0 +1,158 @@
+import difflib
+import re
+from datetime import datetime, timedelta, timezone
+
+# Collection slots are one hour long, from OPEN_HOUR up to CLOSE_HOUR.
+OPEN_HOUR = 8
+CLOSE_HOUR = 18
+DATE_FORMATS = ("%d-%m-%Y", "%d/%m/%Y", "%d.%m.%Y", "%d-%m-%y", "%d/%m/%y", "%Y-%m-%d")
+RELATIVE_DAYS = {"today": 0, "tomorrow": 1, "day after tomorrow": 2}
+_time = re.compile(r"^(\d{1,2})(?:[:.](\d{2}))?(am|pm)?$")
+
+
+class InvalidSlot(ValueError):
+    """A date, time or location the patient cannot be booked for."""
+
+
+def normalise_location(name):
+    return "-".join(str(name or "").lower().replace("_", " ").split())
+
+
+def parse_date(text, today):
+    text = " ".join(str(text or "").lower().split())
+    if text in RELATIVE_DAYS:
+        return today + timedelta(days=RELATIVE_DAYS[text])
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    raise InvalidSlot(f"could not read the date {text!r}, use DD-MM-YYYY")
+
+
+def parse_hour(text):
+    text = "".join(str(text or "").lower().split())
+    match = _time.match(text.replace("a.m", "am").replace("p.m", "pm").rstrip("."))
+    if not match:
+        raise InvalidSlot(f"could not read the time {text!r}, use e.g. 10am or 2pm")
+    hour, _, meridiem = match.groups()
+    hour = int(hour)
+    if meridiem == "pm" and hour < 12:
+        hour += 12
+    elif meridiem == "am" and hour == 12:
+        hour = 0
+    elif meridiem is None and hour < OPEN_HOUR:
+        hour += 12  # "at 2" during opening hours means 2pm
+    return hour
+
+
+def format_hour(hour):
+    return f"{(hour - 1) % 12 + 1}{'am' if hour < 12 else 'pm'}"
+
+
+def format_date(day):
+    return day.strftime("%d-%m-%Y")
+
+
+def slot_prefix(location):
+    return f"{location}|"
+
+
+def slot_id(location, date, hour):
+    """The outbox slot bookings for one collection hour count against."""
+    return f"{slot_prefix(location)}{date}|{hour:02d}"
+
+
+class Snapshot:
+    """Slot capacity and bookings as the booking system last reported them.
+
+    Keys are (location, iso date, hour). Slots missing from `capacity` get
+    `default_capacity`. Bookings queued before `fetched_at` are assumed to
+    be included in `booked`; a snapshot that does not know about queued
+    bookings has `fetched_at=0`, so all of them count.
+    """
+
+    def __init__(self, capacity=None, booked=None, default_capacity=0, fetched_at=0.0):
+        self.capacity = capacity or {}
+        self.booked = booked or {}
+        self.default_capacity = default_capacity
+        self.fetched_at = fetched_at
+
+    def free(self, key):
+        return self.capacity.get(key, self.default_capacity) - self.booked.get(key, 0)
+
+
+class AvailabilityIndex:
+    """Free collection slots per location and day.
+
+    Capacity comes in bulk as a Snapshot. Bookings queued since it was
+    fetched are passed in as `held`, counts per slot_id read from the
+    booking outbox, which every worker shares.
+    """
+
+    def __init__(self, locations, horizon_days=14, utc_offset_minutes=330):
+        self.locations = tuple(normalise_location(name) for name in locations)
+        self.horizon_days = horizon_days
+        self.tz = timezone(timedelta(minutes=utc_offset_minutes))
+
+    def now(self):
+        return datetime.now(self.tz)
+
+    def location(self, name):
+        location = normalise_location(name)
+        if not location:
+            raise InvalidSlot("no location given, ask which lab is nearest the patient")
+        if location in self.locations:
+            return location
+        close = difflib.get_close_matches(location, self.locations, n=3, cutoff=0.6)
+        if len(close) == 1:
+            return close[0]
+        suggestion = f", did you mean {' or '.join(close)}" if close else ""
+        raise InvalidSlot(f"there is no lab at {name!r}{suggestion}")
+
+    def day(self, text):
+        today = self.now().date()
+        day = parse_date(text, today)
+        if day < today:
+            raise InvalidSlot(f"{format_date(day)} is in the past")
+        if day > today + timedelta(days=self.horizon_days):
+            raise InvalidSlot(
+                f"bookings open {self.horizon_days} days ahead, {format_date(day)} is too far out"
+            )
+        return day
+
+    def hours(self, day):
+        now = self.now()
+        first = OPEN_HOUR
+        if day == now.date():
+            first = max(first, now.hour + 1)
+        return range(first, CLOSE_HOUR)
+
+    def free_hours(self, snapshot, location, day, held):
+        date = day.isoformat()
+        return [
+            hour
+            for hour in self.hours(day)
+            if snapshot.free((location, date, hour))
+            - held.get(slot_id(location, date, hour), 0)
+            > 0
+        ]
+
+    def upcoming(self, snapshot, location, held, days=3):
+        """The next `days` days with a free slot, as (day, hours) pairs."""
+        found = []
+        today = self.now().date()
+        for offset in range(self.horizon_days + 1):
+            day = today + timedelta(days=offset)
+            if hours := self.free_hours(snapshot, location, day, held):
+                found.append((day, hours))
+                if len(found) == days:
+                    break
+        return found
+
+    def check_hour(self, day, hour):
+        if hour not in self.hours(day):
+            raise InvalidSlot(
+                f"collections run from {format_hour(OPEN_HOUR)} to {format_hour(CLOSE_HOUR)},"
+                f" {format_hour(hour)} on {format_date(day)} is not available"
+            )
@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class _Entry:
+    __slots__ = ("value", "fresh_until", "stale_until")
+
+    def __init__(self, value, ttl, stale_ttl):
+        now = time.monotonic()
+        self.value = value
+        self.fresh_until = now + ttl
+        self.stale_until = now + ttl + stale_ttl
+
+
+class TTLCache:
+    """Process-wide, thread-safe cache for upstream lookups.
+
+    * fresh entries are served straight from memory,
+    * stale entries (past `ttl` but within `stale_ttl`) are served immediately
+      while one background refresh is scheduled (stale-while-revalidate),
+    * concurrent misses on the same key are coalesced so only one caller
+      runs the loader and the rest wait for its result (single-flight),
+    * at most `max_entries` keys are kept, least recently used go first.
+    """
+
+    def __init__(self, ttl, stale_ttl=0.0, max_entries=128, refresh_workers=2):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._refresher = ThreadPoolExecutor(
+            max_workers=refresh_workers, thread_name_prefix="cache-refresh"
+        )
+
+    def get(self, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now < entry.fresh_until:
+                    self._entries.move_to_end(key)
+                    return entry.value
+                if now < entry.stale_until:
+                    self._entries.move_to_end(key)
+                    if key not in self._inflight:
+                        future = self._inflight[key] = Future()
+                        self._refresher.submit(self._load, key, loader, future)
+                    return entry.value
+                del self._entries[key]
+
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+
+        if owner:
+            self._load(key, loader, future)
+        return future.result()
+
+    def _load(self, key, loader, future):
+        try:
+            value = loader()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            return
+        with self._lock:
+            self._entries[key] = _Entry(value, self.ttl, self.stale_ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._inflight.pop(key, None)
+        future.set_result(value)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
@@ -0,0 +1,24 @@
+import contextvars
+
+# Per-call state visible to everything working on behalf of one call: the
+# session's tasks inherit it, and `run_tool` carries it into the tool thread.
+# The value is mutable so a new turn is seen by every task of the call.
+
+
+class CallInfo:
+    __slots__ = ("session_id", "assistant", "turn", "memory")
+
+    def __init__(self, session_id, assistant=None):
+        self.session_id = session_id
+        self.assistant = assistant
+        self.turn = 0
+        # memory.CallerMemory, collects what the call learns about the caller.
+        self.memory = None
+
+
+current = contextvars.ContextVar("current_call", default=None)
+
+
+def session_id():
+    call = current.get()
+    return call.session_id if call is not None else None
@@ -0,0 +1,138 @@
+import difflib
+import re
+from bisect import bisect_left
+from collections import defaultdict
+
+# Field names vary between catalog endpoints, so each attribute is read from
+# the first key present.
+NAME_KEYS = ("name", "testName", "title", "packageName")
+PRICE_KEYS = ("offerPrice", "discountedPrice", "price", "mrp", "amount")
+SYNONYM_KEYS = ("synonyms", "synonym", "aliases", "alias", "otherNames", "keywords")
+DESCRIPTION_KEYS = ("shortDescription", "description", "about", "details")
+EXTRA_KEYS = ("sampleType", "reportingTime", "tat", "preparation", "testCount")
+
+DESCRIPTION_CHARS = 160
+_token = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return _token.findall(text.lower())
+
+
+def _first(doc, keys):
+    for key in keys:
+        value = doc.get(key)
+        if value not in (None, "", []):
+            return value
+    return None
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [part.strip() for part in re.split(r"[,;|]", value) if part.strip()]
+    return [str(part) for part in value]
+
+
+def _price(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def compact(doc):
+    """The few fields the agent needs to talk about a test or package."""
+    record = {"name": str(_first(doc, NAME_KEYS) or "").strip()}
+    price = _price(_first(doc, PRICE_KEYS))
+    if price is not None:
+        record["price"] = int(price) if price.is_integer() else price
+    synonyms = _as_list(_first(doc, SYNONYM_KEYS))
+    if synonyms:
+        record["also_known_as"] = synonyms[:5]
+    description = _first(doc, DESCRIPTION_KEYS)
+    if isinstance(description, str):
+        description = re.sub(r"<[^>]+>|\s+", " ", description).strip()
+        if len(description) > DESCRIPTION_CHARS:
+            description = description[: DESCRIPTION_CHARS - 3].rstrip() + "..."
+        record["description"] = description
+    for key in EXTRA_KEYS:
+        if doc.get(key) not in (None, "", []):
+            record[key] = doc[key]
+    return record
+
+
+class Catalog:
+    """In-memory search index over catalog records.
+
+    Names and synonyms are tokenised into an inverted index; a sorted
+    vocabulary supports prefix lookups by bisection and difflib covers
+    misheard or misspelt words, so "thyro", "thyroid profile" and "tyroid"
+    all find the thyroid tests. Results can be narrowed by price.
+    """
+
+    def __init__(self, docs):
+        self.records = [compact(doc) for doc in docs]
+        self.records = [record for record in self.records if record["name"]]
+        self.postings = defaultdict(set)
+        for index, record in enumerate(self.records):
+            text = " ".join([record["name"], *record.get("also_known_as", [])])
+            for token in tokenize(text):
+                self.postings[token].add(index)
+        self.vocabulary = sorted(self.postings)
+
+    def __len__(self):
+        return len(self.records)
+
+    def _prefixed(self, token):
+        start = bisect_left(self.vocabulary, token)
+        for word in self.vocabulary[start:]:
+            if not word.startswith(token):
+                break
+            yield word
+
+    def _score(self, query):
+        scores = defaultdict(float)
+        for token in tokenize(query):
+            matched = False
+            if token in self.postings:
+                matched = True
+                for index in self.postings[token]:
+                    scores[index] += 3
+            if len(token) >= 3:
+                for word in self._prefixed(token):
+                    if word != token:
+                        matched = True
+                        for index in self.postings[word]:
+                            scores[index] += 2
+            if not matched and len(token) >= 4:
+                for word in difflib.get_close_matches(
+                    token, self.vocabulary, n=3, cutoff=0.8
+                ):
+                    for index in self.postings[word]:
+                        scores[index] += 1
+
+        phrase = " ".join(tokenize(query))
+        for index in scores:
+            if phrase and phrase in " ".join(tokenize(self.records[index]["name"])):
+                scores[index] += 5
+        return scores
+
+    def search(self, query=None, min_price=None, max_price=None, limit=5):
+        if query and query.strip():
+            scores = self._score(query)
+            candidates = sorted(scores, key=lambda index: (-scores[index], index))
+        else:
+            candidates = range(len(self.records))
+
+        matches = []
+        for index in candidates:
+            record = self.records[index]
+            price = record.get("price")
+            if min_price is not None and (price is None or price < min_price):
+                continue
+            if max_price is not None and (price is None or price > max_price):
+                continue
+            matches.append(record)
+        return {"total_matches": len(matches), "results": matches[:limit]}
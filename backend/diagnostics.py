@@ -0,0 +1,198 @@
+import asyncio
+import hmac
+import http
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from urllib.parse import parse_qs, urlsplit
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+# Every call shares one event loop, so anything that blocks it (a synchronous
+# HTTP request, a large json.dumps) is heard as a stutter on every call.
+#
+# LoopMonitor wakes up every LOOP_LAG_INTERVAL seconds and records how late
+# it was (vaani_loop_lag_seconds). A watchdog thread notices when the loop
+# has not come back for LOOP_STALL_THRESHOLD seconds and logs the stack the
+# loop thread is stuck in, while it is still stuck; the last LOOP_STALLS_KEPT
+# stalls are kept for /debug/stalls.
+#
+# With ADMIN_TOKEN set, these routes answer requests carrying
+# `Authorization: Bearer <ADMIN_TOKEN>`. Under the supervisor add
+# `worker=N` to the query to pick the worker they describe:
+#
+#   /debug/stalls                  recent stalls and their stacks
+#   /debug/tasks                   every asyncio task and where it waits
+#   /debug/profile?seconds=5       sampling profile of all threads, in the
+#                                  folded format flamegraph.pl and
+#                                  speedscope read
+#
+# A profile has to finish within the WebSocket handshake timeout (10 s), so
+# it is capped at PROFILE_MAX_SECONDS; take several for longer stalls.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.05"))
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "0.1"))
+LOOP_STALLS_KEPT = int(os.getenv("LOOP_STALLS_KEPT", "20"))
+PROFILE_HZ = float(os.getenv("PROFILE_HZ", "100"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "8"))
+
+
+class LoopMonitor:
+    """Measures event loop lag and catches the stack of each stall."""
+
+    def __init__(self, interval=0.05, threshold=0.1, keep=20):
+        self.interval = interval
+        self.threshold = threshold
+        self.stalls = deque(maxlen=keep)
+        self._beat = None
+        self._loop_thread = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    async def run(self):
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._thread = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._thread.start()
+        try:
+            while True:
+                beat = self._beat = time.monotonic()
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, time.monotonic() - beat - self.interval)
+                metrics.loop_lag.observe(lag)
+                if self.stalls and self.stalls[-1]["beat"] == beat:
+                    self.stalls[-1]["seconds"] = round(lag, 3)
+        finally:
+            self._stopping.set()
+
+    def _watch(self):
+        stalled = None
+        while not self._stopping.wait(self.threshold / 2):
+            beat = self._beat
+            late = time.monotonic() - beat - self.interval
+            if late < self.threshold or beat == stalled:
+                continue
+            # Still blocked: this is the code holding the loop up.
+            stalled = beat
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            self.stalls.append(
+                {"beat": beat, "at": time.time(), "seconds": None, "stack": stack}
+            )
+            metrics.loop_stalls.inc()
+            log.warning(
+                "event loop blocked",
+                extra={"blocked_ms": round(late * 1000), "stack": stack},
+            )
+
+    def report(self):
+        lines = []
+        for stall in reversed(self.stalls):
+            at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stall["at"]))
+            seconds = stall["seconds"]
+            took = f"{seconds}s" if seconds is not None else "still blocked"
+            lines.append(f"{at} blocked {took}\n{stall['stack']}")
+        return "\n".join(lines) or "no stalls\n"
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def profile(seconds, hz=PROFILE_HZ):
+    """Sample every thread's stack for `seconds`, as folded stacks."""
+    me = threading.get_ident()
+    samples = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            samples[";".join(reversed(stack))] += 1
+        time.sleep(1 / hz)
+    return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+
+def _awaiting(coro):
+    # The chain of coroutines a task is suspended in, outermost first.
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "ag_frame", None)
+        frame = frame or getattr(coro, "gi_frame", None)
+        if frame is None:
+            return
+        yield frame
+        coro = (
+            getattr(coro, "cr_await", None)
+            or getattr(coro, "ag_await", None)
+            or getattr(coro, "gi_yieldfrom", None)
+        )
+
+
+def task_dump():
+    """Every task on the running loop and the line each one waits on."""
+    lines = []
+    tasks = sorted(asyncio.all_tasks(), key=lambda task: task.get_name())
+    for task in tasks:
+        coro = task.get_coro()
+        lines.append(f"{task.get_name()} {getattr(coro, '__qualname__', coro)}")
+        for frame in _awaiting(coro):
+            code = frame.f_code
+            filename = os.path.basename(code.co_filename)
+            lines.append(f"    {filename}:{frame.f_lineno} in {code.co_name}")
+    lines.append(f"{len(tasks)} tasks, pid {os.getpid()}")
+    return "\n".join(lines) + "\n"
+
+
+_profiling = threading.Lock()
+
+
+def _authorised(request):
+    header = request.headers.get("Authorization", "")
+    return hmac.compare_digest(header.encode(), f"Bearer {ADMIN_TOKEN}".encode())
+
+
+async def handle(connection, request, monitor):
+    """Answer a /debug/ request, see the routes above."""
+    if not ADMIN_TOKEN:
+        return connection.respond(http.HTTPStatus.NOT_FOUND, "Not found\n")
+    if not _authorised(request):
+        log.warning("unauthorised debug request", extra={"path": request.path})
+        return connection.respond(http.HTTPStatus.UNAUTHORIZED, "Unauthorized\n")
+    url = urlsplit(request.path)
+    if url.path == "/debug/stalls":
+        return connection.respond(http.HTTPStatus.OK, monitor.report())
+    if url.path == "/debug/tasks":
+        return connection.respond(http.HTTPStatus.OK, task_dump())
+    if url.path == "/debug/profile":
+        try:
+            seconds = float(parse_qs(url.query).get("seconds", ["5"])[0])
+        except ValueError:
+            return connection.respond(http.HTTPStatus.BAD_REQUEST, "Bad seconds\n")
+        seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+        if not _profiling.acquire(blocking=False):
+            return connection.respond(
+                http.HTTPStatus.CONFLICT, "A profile is already running\n"
+            )
+        try:
+            log.info("profiling", extra={"seconds": seconds})
+            folded = await asyncio.to_thread(profile, seconds)
+        finally:
+            _profiling.release()
+        return connection.respond(http.HTTPStatus.OK, folded)
+    return connection.respond(http.HTTPStatus.NOT_FOUND, "Not found\n")
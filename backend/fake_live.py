@@ -0,0 +1,230 @@
+import asyncio
+import contextlib
+import itertools
+import os
+import time
+
+from google.genai import types
+
+# Offline stand-in for `client.aio.live.connect`, enabled with GEMINI_FAKE=1.
+# It speaks the part of the Live session contract AudioLoop relies on:
+# `send_realtime_input`, `receive`, `send_tool_response` and
+# `send_client_content`, yielding real `types.LiveServerMessage` objects.
+#
+# Turn taking is deliberately simple: caller audio that is not all zero bytes
+# counts as speech, and once FAKE_ENDPOINT_MS of silence (or no audio at all)
+# follows speech the model "thinks" for FAKE_RESPONSE_MS and then speaks
+# FAKE_REPLY_MS of audio, delivered FAKE_OUTPUT_RATE times faster than real
+# time like the real service does. Speech during a reply interrupts it.
+CONNECT_MS = float(os.getenv("FAKE_CONNECT_MS", "300"))
+ENDPOINT_MS = float(os.getenv("FAKE_ENDPOINT_MS", "300"))
+RESPONSE_MS = float(os.getenv("FAKE_RESPONSE_MS", "400"))
+REPLY_MS = float(os.getenv("FAKE_REPLY_MS", "3000"))
+OUTPUT_RATE = float(os.getenv("FAKE_OUTPUT_RATE", "4"))
+CHUNK_MS = float(os.getenv("FAKE_CHUNK_MS", "40"))
+# Every Nth turn starts with a tool call, 0 disables them. The tools run for
+# real, so leave this off for fully offline runs.
+TOOL_EVERY = int(os.getenv("FAKE_TOOL_EVERY", "0"))
+TOOL_NAME = os.getenv("FAKE_TOOL_NAME", "get_health_packages")
+# Greet as soon as audio from the caller arrives, the way the assistant
+# prompt opens the call, so time-to-greeting can be measured.
+GREETING = os.getenv("FAKE_GREETING") == "1"
+# Drop the connection after this many seconds (0 never), sending go_away
+# first when FAKE_GO_AWAY=1, to exercise session resumption. Sessions opened
+# with resumption enabled get a new handle after every turn, and honour the
+# context window compression settings.
+DROP_AFTER_S = float(os.getenv("FAKE_DROP_AFTER_S", "0"))
+GO_AWAY = os.getenv("FAKE_GO_AWAY") == "1"
+
+OUTPUT_BYTES_PER_MS = 48  # 24 kHz, 16-bit mono
+_ids = itertools.count(1)
+_handles = {}
+
+
+def _audio(pcm):
+    return types.LiveServerMessage(
+        server_content=types.LiveServerContent(
+            model_turn=types.Content(
+                role="model",
+                parts=[
+                    types.Part(
+                        inline_data=types.Blob(
+                            data=pcm, mime_type="audio/pcm;rate=24000"
+                        )
+                    )
+                ],
+            )
+        )
+    )
+
+
+def _turn_complete(prompt_tokens, response_tokens):
+    return types.LiveServerMessage(
+        server_content=types.LiveServerContent(turn_complete=True),
+        usage_metadata=types.UsageMetadata(
+            prompt_token_count=prompt_tokens,
+            response_token_count=response_tokens,
+            total_token_count=prompt_tokens + response_tokens,
+        ),
+    )
+
+
+def _interrupted():
+    return types.LiveServerMessage(
+        server_content=types.LiveServerContent(interrupted=True, turn_complete=True)
+    )
+
+
+class FakeUpstreamClosed(Exception):
+    pass
+
+
+class FakeLiveSession:
+    def __init__(self, config=None):
+        self.config = config
+        self.session_id = f"fake-{next(_ids)}"
+        self.turns = 0
+        self.context_tokens = 0
+        resumption = config and config.session_resumption
+        if resumption and resumption.handle:
+            if resumption.handle not in _handles:
+                raise FakeUpstreamClosed(f"unknown handle {resumption.handle}")
+            self.turns, self.context_tokens = _handles[resumption.handle]
+        self._closed = False
+        self._drop = None
+        if DROP_AFTER_S:
+            self._drop = asyncio.create_task(self._drop_later())
+        self._messages = asyncio.Queue()
+        self._speaking = False
+        self._last_speech_at = None
+        self._reply = None
+        self._tool_response = None
+        self._watcher = asyncio.create_task(self._watch_endpoint())
+        # A tone-free, low-level waveform is enough to exercise the relay.
+        self._pcm = bytes(range(256)) * (int(CHUNK_MS * OUTPUT_BYTES_PER_MS) // 256)
+
+    async def send_realtime_input(self, *, audio=None, audio_stream_end=None, **kwargs):
+        if self._closed:
+            raise FakeUpstreamClosed("connection closed")
+        if audio is None:
+            return
+        if GREETING and self.turns == 0 and self._reply is None:
+            self._reply = asyncio.create_task(self._respond())
+        data = audio.data if isinstance(audio, types.Blob) else audio["data"]
+        if not data.strip(b"\x00"):
+            return  # silence
+        self._last_speech_at = time.monotonic()
+        self.context_tokens += len(data) // 640  # ~25 tokens per second at 16 kHz
+        if self._reply is not None and not self._reply.done():
+            self._reply.cancel()
+            self._messages.put_nowait(_interrupted())
+        self._speaking = True
+
+    async def send_client_content(self, *, turns=None, turn_complete=True):
+        self.context_tokens += 50
+
+    async def send_tool_response(self, *, function_responses):
+        if self._tool_response is not None and not self._tool_response.done():
+            self._tool_response.set_result(function_responses)
+
+    async def receive(self):
+        while True:
+            message = await self._messages.get()
+            if message is None:
+                raise FakeUpstreamClosed("connection closed")
+            yield message
+            if message.server_content and message.server_content.turn_complete:
+                return
+
+    async def _watch_endpoint(self):
+        while True:
+            await asyncio.sleep(ENDPOINT_MS / 4000)
+            if not self._speaking:
+                continue
+            if time.monotonic() - self._last_speech_at >= ENDPOINT_MS / 1000:
+                self._speaking = False
+                self._reply = asyncio.create_task(self._respond())
+
+    async def _respond(self):
+        self.turns += 1
+        await asyncio.sleep(RESPONSE_MS / 1000)
+        if TOOL_EVERY and self.turns % TOOL_EVERY == 0:
+            self._tool_response = asyncio.get_running_loop().create_future()
+            self._messages.put_nowait(
+                types.LiveServerMessage(
+                    tool_call=types.LiveServerToolCall(
+                        function_calls=[
+                            types.FunctionCall(
+                                id=f"call-{next(_ids)}", name=TOOL_NAME, args={}
+                            )
+                        ]
+                    )
+                )
+            )
+            await self._tool_response
+            self.context_tokens += 200
+
+        chunks = max(1, int(REPLY_MS / CHUNK_MS))
+        for _ in range(chunks):
+            self._messages.put_nowait(_audio(self._pcm))
+            await asyncio.sleep(CHUNK_MS / OUTPUT_RATE / 1000)
+        response_tokens = int(REPLY_MS / 40)
+        self.context_tokens += response_tokens
+        self._compress()
+        self._messages.put_nowait(_turn_complete(self.context_tokens, response_tokens))
+        if self.config and self.config.session_resumption:
+            handle = f"{self.session_id}-{self.turns}"
+            _handles[handle] = (self.turns, self.context_tokens)
+            self._messages.put_nowait(
+                types.LiveServerMessage(
+                    session_resumption_update=types.LiveServerSessionResumptionUpdate(
+                        new_handle=handle, resumable=True
+                    )
+                )
+            )
+
+    def _compress(self):
+        compression = self.config and self.config.context_window_compression
+        if compression and self.context_tokens > compression.trigger_tokens:
+            self.context_tokens = compression.sliding_window.target_tokens
+
+    async def _drop_later(self):
+        await asyncio.sleep(DROP_AFTER_S)
+        if GO_AWAY:
+            self._messages.put_nowait(
+                types.LiveServerMessage(go_away=types.LiveServerGoAway(time_left="2s"))
+            )
+            await asyncio.sleep(2)
+        self._closed = True
+        self._messages.put_nowait(None)
+
+    async def close(self):
+        self._closed = True
+        self._watcher.cancel()
+        if self._drop is not None:
+            self._drop.cancel()
+        if self._reply is not None:
+            self._reply.cancel()
+
+
+class _FakeLive:
+    @contextlib.asynccontextmanager
+    async def connect(self, *, model, config=None):
+        await asyncio.sleep(CONNECT_MS / 1000)
+        session = FakeLiveSession(config)
+        try:
+            yield session
+        finally:
+            await session.close()
+
+
+class _FakeAio:
+    def __init__(self):
+        self.live = _FakeLive()
+
+
+class FakeClient:
+    """Drop-in for `genai.Client` exposing only `aio.live.connect`."""
+
+    def __init__(self, *args, **kwargs):
+        self.aio = _FakeAio()
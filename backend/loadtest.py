@@ -0,0 +1,336 @@
+import argparse
+import asyncio
+import base64
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+import wave
+from pathlib import Path
+
+import websockets
+
+# Synthetic callers for benchmarking server.py, typically against the
+# offline Live API stand-in:
+#
+#   python loadtest.py --spawn-server --callers 200 --turns 5
+#
+# Each caller streams "speech" (noise) in real time, then silence until the
+# reply starts, measures the gap between its last speech chunk and the first
+# audio frame back, listens until the reply ends, and repeats. Server CPU and
+# RSS come from the /metrics endpoint, scraped before and after the run.
+# With --greeting each call first times how long the assistant takes to
+# start talking, e.g. to compare SESSION_POOL_SIZE=0 against a warm pool.
+# With --replay <recording dir> callers say what the recorded caller said,
+# one utterance per recorded reply (see recording.py), instead of noise.
+
+INPUT_BYTES_PER_MS = 32  # 16 kHz, 16-bit mono
+SPEECH = os.urandom(INPUT_BYTES_PER_MS * 1000) or b"\x01"
+
+
+def load_replay(directory):
+    """Caller audio from a recorded call, cut into one utterance per turn.
+
+    An utterance runs from the end of the previous reply up to the start of
+    the next, less trailing digital silence; silent ones (e.g. before a
+    greeting) are left out.
+    """
+    directory = Path(directory)
+    segments = []
+    for path in sorted(directory.glob("caller-*.wav")):
+        with wave.open(str(path)) as segment:
+            segments.append(segment.readframes(segment.getnframes()))
+    pcm = b"".join(segments)
+    utterances = []
+    start = 0
+    for line in (directory / "events.jsonl").read_text().splitlines():
+        event = json.loads(line)
+        if event["event"] == "reply":
+            speech = pcm[start : event["caller_bytes"]].rstrip(b"\x00")
+            utterances.append(speech + b"\x00" * (len(speech) % 2))
+        elif event["event"] == "turn_complete":
+            start = event["caller_bytes"]
+    utterances = [speech for speech in utterances if speech]
+    if not utterances:
+        raise SystemExit(f"no caller speech recorded in {directory}")
+    return utterances
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+class Stats:
+    def __init__(self):
+        self.connect = []
+        self.greeting = []
+        self.first_audio = []
+        self.turns = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.failed = 0
+        self.completed = 0
+        self.errors = {}
+
+
+class Caller:
+    def __init__(self, args, stats):
+        self.args = args
+        self.stats = stats
+        self.chunk = INPUT_BYTES_PER_MS * args.chunk_ms
+        self.audio_at = None
+        self.reply_started = asyncio.Event()
+
+    def encode(self, pcm):
+        if self.args.protocol == "binary":
+            return pcm
+        return json.dumps(
+            {
+                "realtime_input": {
+                    "media_chunks": [
+                        {
+                            "mime_type": "audio/pcm",
+                            "data": base64.b64encode(pcm).decode(),
+                        }
+                    ]
+                }
+            }
+        )
+
+    async def receive(self, ws):
+        async for message in ws:
+            if isinstance(message, bytes):
+                size = len(message)
+            else:
+                data = json.loads(message)
+                if "model_error" in data:
+                    raise RuntimeError(data["model_error"])
+                if "audio" not in data:
+                    continue
+                size = len(data["audio"]) * 3 // 4
+            self.stats.bytes_in += size
+            self.audio_at = time.monotonic()
+            self.reply_started.set()
+
+    async def stream(self, ws, pcm_source, until):
+        period = self.args.chunk_ms / 1000
+        next_at = time.monotonic()
+        offset = 0
+        while not until():
+            pcm = pcm_source(offset)
+            offset += len(pcm)
+            await ws.send(self.encode(pcm))
+            self.stats.bytes_out += len(pcm)
+            next_at += period
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+
+    async def run(self):
+        args = self.args
+        url = args.url + ("?protocol=binary" if args.protocol == "binary" else "")
+        started = time.monotonic()
+        async with websockets.connect(url, max_size=None) as ws:
+            self.stats.connect.append(time.monotonic() - started)
+            receiver = asyncio.create_task(self.receive(ws))
+            silence = bytes(self.chunk)
+            try:
+                if args.greeting:
+                    deadline = started + args.turn_timeout
+                    await self.stream(
+                        ws,
+                        lambda o: silence,
+                        lambda: self.reply_started.is_set()
+                        or receiver.done()
+                        or time.monotonic() > deadline,
+                    )
+                    if not self.reply_started.is_set():
+                        raise TimeoutError("no greeting")
+                    self.stats.greeting.append(self.audio_at - started)
+                    await self.stream(
+                        ws,
+                        lambda o: silence,
+                        lambda: time.monotonic() - self.audio_at > args.quiet_ms / 1000
+                        or time.monotonic() > deadline,
+                    )
+                for turn in range(args.turns):
+                    if args.utterances:
+                        speech = args.utterances[turn % len(args.utterances)]
+                        speech_ms = len(speech) / INPUT_BYTES_PER_MS
+                        filler = b"\x00"
+                    else:
+                        speech, speech_ms, filler = SPEECH, args.utterance_ms, b"\x01"
+                    speech_end = time.monotonic() + speech_ms / 1000
+                    await self.stream(
+                        ws,
+                        lambda o: speech[o % len(speech) :][: self.chunk].ljust(
+                            self.chunk, filler
+                        ),
+                        lambda: time.monotonic() >= speech_end,
+                    )
+                    spoke_at = time.monotonic()
+                    self.reply_started.clear()
+                    deadline = spoke_at + args.turn_timeout
+                    await self.stream(
+                        ws,
+                        lambda o: silence,
+                        lambda: self.reply_started.is_set()
+                        or receiver.done()
+                        or time.monotonic() > deadline,
+                    )
+                    if receiver.done():
+                        receiver.result()
+                    if not self.reply_started.is_set():
+                        raise TimeoutError("no reply")
+                    self.stats.first_audio.append(self.audio_at - spoke_at)
+                    # listen until the reply has been quiet for a while
+                    await self.stream(
+                        ws,
+                        lambda o: silence,
+                        lambda: time.monotonic() - self.audio_at > args.quiet_ms / 1000
+                        or time.monotonic() > deadline,
+                    )
+                    self.stats.turns += 1
+            finally:
+                receiver.cancel()
+        self.stats.completed += 1
+
+
+async def caller_task(args, stats):
+    try:
+        await Caller(args, stats).run()
+    except Exception as e:
+        stats.failed += 1
+        key = f"{type(e).__name__}: {e}"[:120]
+        stats.errors[key] = stats.errors.get(key, 0) + 1
+
+
+def scrape(url):
+    metrics_url = re.sub(r"^ws", "http", url.split("?")[0]).rstrip("/") + "/metrics"
+    try:
+        with urllib.request.urlopen(metrics_url, timeout=5) as response:
+            text = response.read().decode()
+    except OSError:
+        return None
+    # Summed over the worker label when running under the supervisor.
+    values = {}
+    for line in text.splitlines():
+        if line.startswith(("process_", "vaani_active_sessions")):
+            name, value = line.rsplit(" ", 1)
+            name = name.split("{")[0]
+            values[name] = values.get(name, 0.0) + float(value)
+    return values
+
+
+def wait_ready(url, timeout=30):
+    ready_url = re.sub(r"^ws", "http", url).rstrip("/") + "/readyz"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(ready_url, timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit("server did not become ready")
+
+
+async def main(args):
+    stats = Stats()
+    before = scrape(args.url)
+    started = time.monotonic()
+    tasks = []
+    for i in range(args.callers):
+        tasks.append(asyncio.create_task(caller_task(args, stats)))
+        if args.ramp:
+            await asyncio.sleep(args.ramp / args.callers)
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+    after = scrape(args.url)
+
+    ms = 1000
+    print(f"callers       {args.callers} ({stats.completed} ok, {stats.failed} failed)")
+    print(f"duration      {elapsed:.1f} s")
+    print(f"turns         {stats.turns} ({stats.turns / elapsed:.1f}/s)")
+    print(
+        f"audio         out {stats.bytes_out / elapsed / 1024:.0f} KiB/s,"
+        f" in {stats.bytes_in / elapsed / 1024:.0f} KiB/s"
+    )
+    print(
+        f"connect       p50 {percentile(stats.connect, 50) * ms:.0f} ms,"
+        f" p99 {percentile(stats.connect, 99) * ms:.0f} ms"
+    )
+    if stats.greeting:
+        print(
+            f"greeting      p50 {percentile(stats.greeting, 50) * ms:.0f} ms,"
+            f" p99 {percentile(stats.greeting, 99) * ms:.0f} ms"
+        )
+    if stats.first_audio:
+        print(
+            f"first audio   p50 {percentile(stats.first_audio, 50) * ms:.0f} ms,"
+            f" p99 {percentile(stats.first_audio, 99) * ms:.0f} ms,"
+            f" mean {statistics.mean(stats.first_audio) * ms:.0f} ms"
+        )
+    if before and after:
+        cpu = after["process_cpu_seconds_total"] - before["process_cpu_seconds_total"]
+        print(
+            f"server        cpu {cpu / elapsed * 100:.0f}%,"
+            f" rss {after['process_resident_memory_bytes'] / (1 << 20):.0f} MiB"
+        )
+    for error, count in stats.errors.items():
+        print(f"error x{count}  {error}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="ws://localhost:9082")
+    parser.add_argument("--callers", type=int, default=100)
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds")
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--protocol", choices=("json", "binary"), default="json")
+    parser.add_argument("--chunk-ms", type=int, default=40)
+    parser.add_argument("--utterance-ms", type=int, default=1500)
+    parser.add_argument("--quiet-ms", type=int, default=600)
+    parser.add_argument("--turn-timeout", type=float, default=20.0)
+    parser.add_argument(
+        "--greeting",
+        action="store_true",
+        help="wait for the assistant to greet before speaking and time it"
+        " (use FAKE_GREETING=1 with the fake)",
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="DIR",
+        help="speak the caller audio of a call recorded with RECORD_CALLS",
+    )
+    parser.add_argument(
+        "--spawn-server",
+        action="store_true",
+        help="start server.py against the fake Live API for the run",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.utterances = load_replay(args.replay) if args.replay else None
+    server = None
+    if args.spawn_server:
+        env = dict(os.environ, GEMINI_FAKE="1", WARM_TOOL_CACHE="0")
+        env.setdefault("MAX_SESSIONS", str(max(args.callers, 100)))
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(os.path.dirname(__file__), "server.py")],
+            env=env,
+            stdout=subprocess.DEVNULL,
+        )
+        wait_ready(args.url)
+    try:
+        asyncio.run(main(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
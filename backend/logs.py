@@ -0,0 +1,178 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+import callcontext
+
+# Logging for the relay. Records are handed to a bounded queue and written by
+# a listener thread, so a slow stdout (a full pipe, a busy log shipper) never
+# stalls the event loop; when the queue is full records are dropped and
+# counted instead. Every record carries the call it belongs to (session,
+# assistant, turn), and repeated records below ERROR are rate limited per
+# message template. LOG_FORMAT=json writes one JSON object per line.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Per message template: LOG_RATE_BURST records at once, then LOG_RATE_LIMIT
+# a second.
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", "50"))
+LOG_RATE_BURST = float(os.getenv("LOG_RATE_BURST", "200"))
+
+# Counters of records not written, read by the metrics endpoint.
+dropped = {"queue_full": 0, "rate_limited": 0}
+
+_STANDARD = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message",
+    "asctime",
+    "session",
+    "assistant",
+    "turn",
+    "suppressed",
+}
+
+
+class CallContextFilter(logging.Filter):
+    def filter(self, record):
+        call = callcontext.current.get()
+        record.session = call.session_id if call is not None else None
+        record.assistant = call.assistant if call is not None else None
+        record.turn = call.turn if call is not None else None
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per (logger, message template) for records below ERROR.
+
+    The first record let through after some were dropped carries the number
+    dropped as `suppressed`.
+    """
+
+    def __init__(self, rate, burst):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR or self.rate <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, suppressed = self.buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self.buckets[key] = (tokens, now, suppressed + 1)
+                dropped["rate_limited"] += 1
+                return False
+            self.buckets[key] = (tokens - 1, now, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Merge the arguments now, they may change once the caller moves on,
+        # but leave layout and traceback rendering to the writer thread.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped["queue_full"] += 1
+
+
+def _fields(record):
+    return {k: v for k, v in vars(record).items() if k not in _STANDARD}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key in ("session", "assistant", "turn", "suppressed"):
+            if getattr(record, key, None) is not None:
+                entry[key] = getattr(record, key)
+        entry.update(_fields(record))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s%(call)s %(message)s")
+
+    def format(self, record):
+        call = ""
+        if getattr(record, "session", None):
+            call = f" [{record.session[:8]} {record.assistant} t{record.turn}]"
+        record.call = call
+        fields = _fields(record)
+        fields.pop("call", None)
+        if getattr(record, "suppressed", None):
+            fields["suppressed"] = record.suppressed
+        text = super().format(record)
+        if fields:
+            text += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return text
+
+
+_listener = None
+_pid = None
+
+
+def setup():
+    """Route the root logger through the queue, once per process.
+
+    Safe to call again after fork: the child gets its own queue and writer
+    thread, the parent's do not survive the fork.
+    """
+    global _listener, _pid
+    if _pid == os.getpid():
+        return
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    records = queue.Queue(LOG_QUEUE_SIZE)
+    handler = DroppingQueueHandler(records)
+    handler.addFilter(CallContextFilter())
+    handler.addFilter(RateLimitFilter(LOG_RATE_LIMIT, LOG_RATE_BURST))
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    # Our own records already cover connections, skip the library's.
+    logging.getLogger("websockets").setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(records, stream)
+    _listener.start()
+    if _pid is None:
+        atexit.register(shutdown)
+    _pid = os.getpid()
+
+
+def shutdown():
+    """Flush queued records, called at exit."""
+    global _listener
+    if _listener is not None and _pid == os.getpid():
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,352 @@
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import date
+from urllib.parse import parse_qs, urlsplit
+
+from sqlitestore import SQLiteStore
+
+from availability import format_date, format_hour
+
+log = logging.getLogger(__name__)
+
+# What earlier calls learned about a caller, so a repeat caller does not
+# have to explain everything again. Off by default. The connect URL is public,
+# so callers are only ever recognised from something the server can check:
+#
+#   web and app calls   `?caller_token=`, a caller id signed with
+#                       CALLER_MEMORY_SECRET by the backend that logged the
+#                       user in (see sign_caller_token)
+#   phone calls         the `From` stream parameter, only when the stream's
+#                       X-Twilio-Signature checks out against
+#                       TWILIO_AUTH_TOKEN
+#
+# Each caller row keeps the name last given and a compact summary, rendered
+# when the call ends, so a lookup at connect time is one indexed row. The
+# summary goes to the model as context before the caller speaks; it leaves
+# out phone numbers and addresses, the model asks for those as usual.
+# Calls hand what they learned over when they end; a background thread
+# writes them in batches, one transaction every CALLER_MEMORY_FLUSH_INTERVAL
+# seconds, and deletes callers not heard from in CALLER_MEMORY_RETENTION_DAYS.
+CALLER_MEMORY = os.getenv("CALLER_MEMORY", "0") == "1"
+CALLER_MEMORY_PATH = os.getenv("CALLER_MEMORY_PATH", "caller_memory.db")
+CALLER_MEMORY_FLUSH_INTERVAL = float(os.getenv("CALLER_MEMORY_FLUSH_INTERVAL", "1"))
+# Past bookings mentioned in the summary, most recent first.
+CALLER_MEMORY_BOOKINGS = int(os.getenv("CALLER_MEMORY_BOOKINGS", "3"))
+CALLER_MEMORY_RETENTION_DAYS = float(os.getenv("CALLER_MEMORY_RETENTION_DAYS", "90"))
+CALLER_MEMORY_SECRET = os.getenv("CALLER_MEMORY_SECRET", "")
+TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN", "")
+# The wss:// URL Twilio connects to, scheme and host, when a proxy in front
+# changes the Host header; otherwise wss://<Host>.
+TWILIO_STREAM_BASE_URL = os.getenv("TWILIO_STREAM_BASE_URL", "")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS callers (
+    id INTEGER PRIMARY KEY,
+    caller_id TEXT UNIQUE,
+    phone TEXT UNIQUE,
+    name TEXT,
+    calls INTEGER NOT NULL DEFAULT 0,
+    last_call_at REAL NOT NULL,
+    summary TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS bookings (
+    id INTEGER PRIMARY KEY,
+    caller INTEGER NOT NULL REFERENCES callers (id),
+    reference TEXT NOT NULL UNIQUE,
+    test TEXT,
+    location TEXT,
+    slot_date TEXT,
+    slot_hour INTEGER,
+    home_collection INTEGER,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bookings_by_caller ON bookings (caller, created_at);
+CREATE INDEX IF NOT EXISTS callers_by_last_call ON callers (last_call_at);
+"""
+
+
+def normalise_phone(phone):
+    # Numbers are matched on their last ten digits, with or without +91.
+    digits = re.sub(r"\D", "", str(phone or ""))
+    return digits[-10:] or None
+
+
+def _signature(secret, message):
+    digest = hmac.new(secret.encode(), message.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def sign_caller_token(caller_id, ttl=3600, secret=CALLER_MEMORY_SECRET):
+    """A `caller_token` for `caller_id`, valid for `ttl` seconds."""
+    message = f"{caller_id}.{int(time.time() + ttl)}"
+    return f"{message}.{_signature(secret, message)}"
+
+
+def verify_caller_token(token, secret=CALLER_MEMORY_SECRET):
+    """The caller id in a valid, unexpired token, else None."""
+    if not token or not secret:
+        return None
+    try:
+        caller_id, expires, signature = token.rsplit(".", 2)
+        expired = int(expires) < time.time()
+    except ValueError:
+        return None
+    expected = _signature(secret, f"{caller_id}.{expires}")
+    if expired or not hmac.compare_digest(signature, expected):
+        return None
+    return caller_id or None
+
+
+def twilio_request_valid(request, auth_token=TWILIO_AUTH_TOKEN):
+    """Whether a stream's upgrade request carries Twilio's signature.
+
+    Twilio signs the full wss:// URL it connects to with the account's auth
+    token, HMAC-SHA1, base64.
+    """
+    signature = request.headers.get("X-Twilio-Signature")
+    if not signature or not auth_token:
+        return False
+    base = TWILIO_STREAM_BASE_URL or f"wss://{request.headers.get('Host', '')}"
+    url = base.rstrip("/") + request.path
+    digest = hmac.new(auth_token.encode(), url.encode(), hashlib.sha1).digest()
+    return hmac.compare_digest(signature, base64.b64encode(digest).decode())
+
+
+class CallerMemory:
+    """What one call knows and learns about its caller."""
+
+    def __init__(self, caller_id=None, phone=None, twilio=False):
+        self.caller_id = caller_id or None
+        self.phone = normalise_phone(phone)
+        # A stream Twilio signed, its start message names the caller.
+        self.twilio = twilio
+        self.name = None
+        self.bookings = []
+        self.recalled = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_request(cls, request):
+        query = parse_qs(urlsplit(request.path or "").query)
+        caller_id = verify_caller_token(query.get("caller_token", [None])[0])
+        return cls(caller_id, twilio=twilio_request_valid(request))
+
+    def identify(self, parameters):
+        """Pick up the caller from signed Twilio stream parameters, True if new."""
+        if self.known() or not self.twilio:
+            return False
+        self.phone = normalise_phone(parameters.get("From"))
+        return self.known()
+
+    def known(self):
+        return bool(self.caller_id or self.phone)
+
+    def booked(self, reference, booking):
+        # Called from the tool thread. The phone number given for the booking
+        # is what the caller said, it does not identify them.
+        with self._lock:
+            self.name = booking.get("name") or self.name
+            self.bookings.append((reference, booking))
+
+
+def summarise(row, bookings):
+    name, calls, last_call_at = row
+    lines = [
+        "Notes from earlier calls, not said by the caller:",
+        f"Returning caller, {calls} earlier call{'s' * (calls != 1)},"
+        f" last on {format_date(date.fromtimestamp(last_call_at))}.",
+    ]
+    if name:
+        lines.append(f"Name: {name}.")
+    for reference, test, location, slot_date, slot_hour, home in bookings:
+        place = "home collection" if home else f"at {location or 'a lab'}"
+        when = ""
+        if slot_date:
+            when = f" on {format_date(date.fromisoformat(slot_date))}"
+            if slot_hour is not None:
+                when += f" {format_hour(slot_hour)}"
+        lines.append(
+            f"Booked {test or 'a test'}, {place}{when}, reference {reference}."
+        )
+    return "\n".join(lines)
+
+
+class CallerStore(SQLiteStore):
+    """Caller rows in SQLite: read at connect, written in batches after calls.
+
+    `recall` runs on a worker thread at connect time. `save` only queues;
+    the flush thread writes everything queued in one transaction.
+    """
+
+    schema = SCHEMA
+
+    def __init__(self, path, flush_interval=1.0, bookings_shown=3, retention_days=90):
+        super().__init__(path)
+        self.flush_interval = flush_interval
+        self.bookings_shown = bookings_shown
+        self.retention = retention_days * 86400
+        self.counts = {"recalled": 0, "unknown": 0, "saved": 0, "expired": 0}
+        # Separate from the database lock, `save` runs on the event loop.
+        self._pending_lock = threading.Lock()
+        self._pending = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pruned_at = 0.0
+
+    def _find(self, caller_id, phone):
+        for column, value in (("caller_id", caller_id), ("phone", phone)):
+            if value:
+                row = self.db.execute(
+                    f"SELECT id FROM callers WHERE {column} = ?", (value,)
+                ).fetchone()
+                if row:
+                    return row[0]
+        return None
+
+    def recall(self, memory):
+        """The summary saved for the caller, or None for a new caller."""
+        with self._lock:
+            caller = self._find(memory.caller_id, memory.phone)
+            summary = None
+            if caller is not None:
+                # Rows past retention may not have been pruned yet.
+                row = self.db.execute(
+                    "SELECT summary FROM callers WHERE id = ? AND last_call_at >= ?",
+                    (caller, time.time() - self.retention),
+                ).fetchone()
+                summary = row[0] if row else None
+            self.counts["recalled" if summary else "unknown"] += 1
+        memory.recalled = bool(summary)
+        return summary
+
+    def save(self, memory):
+        if memory.known():
+            with self._pending_lock:
+                self._pending.append(memory)
+            self._wakeup.set()
+
+    def _write(self, memory, now):
+        caller = self._find(memory.caller_id, memory.phone)
+        if caller is None:
+            caller = self.db.execute(
+                "INSERT INTO callers (caller_id, phone, name, last_call_at)"
+                " VALUES (?, ?, ?, ?)",
+                (memory.caller_id, memory.phone, memory.name, now),
+            ).lastrowid
+        # A phone number already filed under another caller stays there.
+        phone = memory.phone
+        if phone and self._find(None, phone) not in (None, caller):
+            phone = None
+        row = self.db.execute(
+            "SELECT name, phone, calls FROM callers WHERE id = ?",
+            (caller,),
+        ).fetchone()
+        self.db.executemany(
+            "INSERT INTO bookings (caller, reference, test, location, slot_date,"
+            " slot_hour, home_collection, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (reference) DO NOTHING",
+            [
+                (
+                    caller,
+                    reference,
+                    booking.get("testName"),
+                    booking.get("location"),
+                    booking.get("slotDate"),
+                    booking.get("slotHour"),
+                    bool(booking.get("isSampleCollectionAtHome")),
+                    now,
+                )
+                for reference, booking in memory.bookings
+            ],
+        )
+        bookings = self.db.execute(
+            "SELECT reference, test, location, slot_date, slot_hour, home_collection"
+            " FROM bookings WHERE caller = ?"
+            " ORDER BY created_at DESC, id DESC LIMIT ?",
+            (caller, self.bookings_shown),
+        ).fetchall()
+        name, saved_phone, calls = row
+        name = memory.name or name
+        phone = phone or saved_phone
+        summary = summarise((name, calls + 1, now), bookings)
+        self.db.execute(
+            "UPDATE callers SET caller_id = coalesce(caller_id, ?), phone = ?,"
+            " name = ?, calls = calls + 1, last_call_at = ?, summary = ?"
+            " WHERE id = ?",
+            (memory.caller_id, phone, name, now, summary, caller),
+        )
+
+    def prune(self, now=None):
+        """Delete callers not heard from within the retention period."""
+        cutoff = (now or time.time()) - self.retention
+        with self._lock, self._transaction():
+            self.db.execute(
+                "DELETE FROM bookings WHERE caller IN"
+                " (SELECT id FROM callers WHERE last_call_at < ?)",
+                (cutoff,),
+            )
+            deleted = self.db.execute(
+                "DELETE FROM callers WHERE last_call_at < ?", (cutoff,)
+            ).rowcount
+        self.counts["expired"] += deleted
+        self._pruned_at = time.monotonic()
+
+    def flush(self):
+        # Nothing to write or prune in a database that was never opened.
+        if self._db is None and not self._pending:
+            return
+        if time.monotonic() - self._pruned_at > 3600:
+            self.prune()
+        with self._pending_lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        now = time.time()
+        try:
+            with self._lock, self._transaction():
+                for memory in batch:
+                    with memory._lock:
+                        self._write(memory, now)
+        except sqlite3.Error:
+            with self._pending_lock:
+                self._pending[:0] = batch  # retried on the next flush
+            raise
+        self.counts["saved"] += len(batch)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            # Woken by calls ending, and hourly to prune old callers.
+            self._wakeup.wait(3600)
+            # Let more calls end before writing, one transaction covers them.
+            self._stopping.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                log.warning("saving caller memory failed: %s", e)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="caller-memory", daemon=True
+            )
+            self._thread.start()
+
+    def close(self, timeout=5.0):
+        if self._thread is not None:
+            self._stopping.set()
+            self._wakeup.set()
+            self._thread.join(timeout)
+            self._thread = None
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            log.warning("saving caller memory failed: %s", e)
@@ -0,0 +1,216 @@
+import os
+import resource
+import time
+from bisect import bisect_left
+
+# Minimal Prometheus instrumentation for the relay hot path. Instruments are
+# plain counters and fixed-bucket histograms updated from the event loop
+# thread, so recording a value is a dict lookup plus a bisect, no locks.
+# Values are per process. Under the supervisor each worker renders its own
+# with a worker label, and `merge` puts them together into one exposition;
+# sum by the other labels for node totals.
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)
+TOOL_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+BYTES_BUCKETS = (1 << 10, 4 << 10, 16 << 10, 64 << 10, 256 << 10, 1 << 20, 4 << 20)
+
+registry = []
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=(), callback=None):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.callback = callback
+        self.values = {}
+        registry.append(self)
+
+    def inc(self, amount=1, *labels):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        # Callback instruments read their value from elsewhere at scrape
+        # time, returning a number, or (labels, value) pairs when labelled.
+        if self.callback is None:
+            values = self.values.items()
+        elif not self.label_names:
+            values = (((), self.callback()),)
+        else:
+            values = self.callback()
+        for labels, value in values:
+            yield self.name, _labels(self.label_names, labels), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.label_names = labels
+        self.series = {}
+        registry.append(self)
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            # one slot per bucket plus +Inf, then the running sum
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                names = self.label_names + ("le",)
+                yield f"{self.name}_bucket", _labels(
+                    names, labels + (bound,)
+                ), cumulative
+            yield f"{self.name}_count", _labels(self.label_names, labels), cumulative
+            yield f"{self.name}_sum", _labels(self.label_names, labels), series[-1]
+
+
+def render(worker=None):
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            if worker is not None:
+                rest = "," + labels[1:] if labels else "}"
+                labels = f'{{worker="{worker}"{rest}'
+            lines.append(f"{name}{labels} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def merge(texts):
+    """One exposition from several `render` outputs, each family once."""
+    families = {}
+    for text in texts:
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# HELP "):
+                help_line = line
+                family = None
+            elif line.startswith("# TYPE "):
+                family = families.setdefault(line.split(" ", 3)[2], [help_line, line])
+            elif line and family is not None:
+                family.append(line)
+    return "\n".join(line for family in families.values() for line in family) + "\n"
+
+
+def _cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _resident_bytes():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+_started = time.monotonic()
+
+first_audio_latency = Histogram(
+    "vaani_first_audio_latency_seconds",
+    "Time from the caller's last audio chunk to the first model audio byte of a turn",
+    LATENCY_BUCKETS,
+)
+tool_duration = Histogram(
+    "vaani_tool_call_duration_seconds",
+    "Tool call duration including executor queueing",
+    TOOL_BUCKETS,
+    labels=("tool",),
+)
+tool_calls = Counter(
+    "vaani_tool_calls_total", "Tool calls by outcome", labels=("tool", "status")
+)
+turn_queue_bytes = Histogram(
+    "vaani_turn_queued_audio_bytes",
+    "Model audio buffered in the session queue at the end of a turn",
+    BYTES_BUCKETS,
+)
+audio_bytes = Counter(
+    "vaani_audio_bytes_total",
+    "PCM bytes relayed, in = caller to model, out = model to caller",
+    labels=("direction",),
+)
+audio_frames = Counter(
+    "vaani_audio_frames_total",
+    "Audio messages sent after frame batching, in = to the model, out = to the caller",
+    labels=("direction",),
+)
+vad_suppressed_bytes = Counter(
+    "vaani_vad_suppressed_bytes_total",
+    "Caller silence the voice activity gate kept from the model",
+)
+session_pool = Counter(
+    "vaani_session_pool_acquire_total",
+    "Live sessions handed out warm from the pool (hit) or opened on demand (miss)",
+    labels=("result",),
+)
+session_setup = Histogram(
+    "vaani_session_setup_seconds",
+    "Time from accepting a call to having a live Gemini session",
+    LATENCY_BUCKETS,
+)
+upstream_reconnects = Counter(
+    "vaani_upstream_reconnects_total",
+    "Live sessions resumed after the upstream connection was lost",
+    labels=("result",),
+)
+turns = Counter("vaani_turns_total", "Completed model turns")
+interruptions = Counter("vaani_interruptions_total", "Turns cut short by barge-in")
+sessions = Counter("vaani_sessions_total", "Sessions by outcome", labels=("status",))
+tokens = Counter(
+    "vaani_tokens_total", "Tokens reported in usage_metadata", labels=("kind",)
+)
+loop_lag = Histogram(
+    "vaani_loop_lag_seconds",
+    "How late the event loop ran a timer, sampled every LOOP_LAG_INTERVAL",
+    LAG_BUCKETS,
+)
+loop_stalls = Counter(
+    "vaani_loop_stalls_total",
+    "Times the event loop was blocked past LOOP_STALL_THRESHOLD",
+)
+usage_limits = Counter(
+    "vaani_usage_limits_total",
+    "Calls that reached a usage limit, and calls refused over an assistant's window",
+    labels=("limit",),
+)
+cpu_seconds = Gauge(
+    "process_cpu_seconds_total", "User and system CPU time", callback=_cpu_seconds
+)
+resident_bytes = Gauge(
+    "process_resident_memory_bytes", "Resident set size", callback=_resident_bytes
+)
+uptime = Gauge(
+    "vaani_uptime_seconds",
+    "Seconds since the process started",
+    callback=lambda: time.monotonic() - _started,
+)
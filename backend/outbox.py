@@ -0,0 +1,240 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlitestore import SQLiteStore
+
+log = logging.getLogger(__name__)
+
+# Row states. A claimed row is SENDING until its delivery is recorded; if the
+# process dies first the claim expires and the row is picked up again.
+PENDING = "pending"
+SENDING = "sending"
+DELIVERED = "delivered"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    reference TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    last_error TEXT,
+    slot TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+"""
+# Added after the first release, so older files get the column here.
+SLOT_SCHEMA = """
+CREATE INDEX IF NOT EXISTS outbox_slot ON outbox (slot, created_at);
+"""
+
+
+class PermanentError(Exception):
+    """A delivery failure retrying will not fix, e.g. a rejected payload."""
+
+
+class SlotFull(Exception):
+    """The slot a row was queued for has no room left."""
+
+
+def idempotency_key(*parts):
+    normalised = "|".join(" ".join(str(part or "").lower().split()) for part in parts)
+    return hashlib.sha256(normalised.encode()).hexdigest()[:32]
+
+
+class Outbox(SQLiteStore):
+    """Durable write-behind queue in SQLite, delivered by a background thread.
+
+    `enqueue` returns as soon as the row is committed, so the caller never
+    waits on the remote side. Rows are keyed by an idempotency key: enqueueing
+    the same key again returns the existing row instead of adding another.
+    The delivery thread claims due rows in batches, hands them to `deliver`
+    on a small thread pool and records the outcomes in one transaction,
+    retrying failures with exponential backoff up to `max_attempts`.
+
+    Tool threads append while deliveries are read and several worker
+    processes can share one file; claims are taken in a write transaction
+    so each row goes to one process.
+
+    Rows may name a `slot` with limited room, e.g. a collection hour. Rows
+    not FAILED count against it, so the room is shared by every process on
+    the file and comes back when a delivery fails for good.
+    """
+
+    schema = SCHEMA
+    synchronous = "FULL"
+
+    def __init__(
+        self,
+        path,
+        deliver,
+        workers=4,
+        batch_size=20,
+        max_attempts=8,
+        claim_timeout=60.0,
+        poll_interval=1.0,
+    ):
+        super().__init__(path)
+        self.deliver = deliver
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.claim_timeout = claim_timeout
+        self.poll_interval = poll_interval
+        self.counts = defaultdict(int)
+        # Rows not yet delivered, refreshed by the delivery thread so reading
+        # it never touches the database.
+        self.backlog = 0
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pool = None
+
+    def _migrate(self, db):
+        columns = {row[1] for row in db.execute("PRAGMA table_info(outbox)")}
+        if "slot" not in columns:
+            db.execute("ALTER TABLE outbox ADD COLUMN slot TEXT")
+        db.executescript(SLOT_SCHEMA)
+
+    def enqueue(self, key, payload, reference=None, slot=None, room=None, since=0.0):
+        """Store `payload` once per `key`, returns (reference, status, created).
+
+        With a `slot`, raises SlotFull when `room` rows created since `since`
+        already hold it; the count and the insert are one transaction.
+        """
+        reference = reference or key[:8].upper()
+        now = time.time()
+        with self._lock, self._transaction():
+            existing = self.db.execute(
+                "SELECT reference, status FROM outbox WHERE idempotency_key = ?",
+                (key,),
+            ).fetchone()
+            if existing is not None:
+                self.counts["duplicate"] += 1
+                return (*existing, False)
+            if slot is not None and room is not None:
+                if self._held(slot, slot, since).get(slot, 0) >= room:
+                    self.counts["slot_full"] += 1
+                    raise SlotFull(slot)
+            self.db.execute(
+                "INSERT INTO outbox (idempotency_key, reference, payload, status,"
+                " next_attempt_at, created_at, slot) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, reference, json.dumps(payload), PENDING, now, now, slot),
+            )
+            self.counts["queued"] += 1
+        self._wakeup.set()
+        return reference, PENDING, True
+
+    def _held(self, first, last, since):
+        return dict(
+            self.db.execute(
+                "SELECT slot, COUNT(*) FROM outbox WHERE slot BETWEEN ? AND ?"
+                " AND created_at >= ? AND status != ? GROUP BY slot",
+                (first, last, since, FAILED),
+            ).fetchall()
+        )
+
+    def held(self, prefix, since=0.0):
+        """Rows holding each slot starting with `prefix`, created since `since`."""
+        with self._lock:
+            return self._held(prefix, prefix + "\uffff", since)
+
+    def get(self, key):
+        """(reference, status) of the row stored under `key`, or None."""
+        with self._lock:
+            return self.db.execute(
+                "SELECT reference, status FROM outbox WHERE idempotency_key = ?",
+                (key,),
+            ).fetchone()
+
+    def _claim(self):
+        now = time.time()
+        with self._lock, self._transaction():
+            rows = self.db.execute(
+                "SELECT id, idempotency_key, payload, attempts FROM outbox"
+                " WHERE status IN (?, ?) AND next_attempt_at <= ?"
+                " ORDER BY next_attempt_at LIMIT ?",
+                (PENDING, SENDING, now, self.batch_size),
+            ).fetchall()
+            self.db.executemany(
+                "UPDATE outbox SET status = ?, attempts = attempts + 1,"
+                " next_attempt_at = ? WHERE id = ?",
+                [(SENDING, now + self.claim_timeout, row[0]) for row in rows],
+            )
+            self.backlog = self.db.execute(
+                "SELECT COUNT(*) FROM outbox WHERE status IN (?, ?)",
+                (PENDING, SENDING),
+            ).fetchone()[0]
+        return rows
+
+    def _deliver_batch(self, rows):
+        futures = [
+            (row, self._pool.submit(self.deliver, json.loads(row[2]), row[1]))
+            for row in rows
+        ]
+        updates = []
+        for (row_id, key, _, attempts), future in futures:
+            attempts += 1
+            try:
+                future.result()
+                updates.append((DELIVERED, None, time.time(), row_id))
+                outcome = "delivered"
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"[:500]
+                if isinstance(e, PermanentError) or attempts >= self.max_attempts:
+                    log.error(
+                        "gave up on %s after %d attempts: %s", key, attempts, error
+                    )
+                    updates.append((FAILED, error, time.time(), row_id))
+                    outcome = "failed"
+                else:
+                    retry_at = time.time() + min(300.0, 2.0**attempts)
+                    updates.append((PENDING, error, retry_at, row_id))
+                    outcome = "retry"
+            with self._lock:
+                self.counts[outcome] += 1
+        with self._lock, self._transaction():
+            self.db.executemany(
+                "UPDATE outbox SET status = ?, last_error = ?, next_attempt_at = ?"
+                " WHERE id = ?",
+                updates,
+            )
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                rows = self._claim()
+                if rows:
+                    self._deliver_batch(rows)
+                    continue
+            except sqlite3.Error as e:
+                log.warning("delivery failed: %s", e)
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def start(self):
+        if self._thread is None:
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="outbox")
+            self._thread = threading.Thread(
+                target=self._run, name="outbox", daemon=True
+            )
+            self._thread.start()
+
+    def close(self, timeout=5.0):
+        # Undelivered rows stay in the database for the next start.
+        if self._thread is not None:
+            self._stopping.set()
+            self._wakeup.set()
+            self._thread.join(timeout)
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._thread = None
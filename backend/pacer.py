@@ -0,0 +1,44 @@
+import asyncio
+import time
+
+
+class PlaybackPacer:
+    """Paces outbound audio against a monotonic clock.
+
+    The pacer tracks where the client's playhead should be (the time the
+    current stream started plus the duration of everything sent since) and
+    only lets the sender run `lead` seconds ahead of it. Because the schedule
+    is anchored to the clock rather than to per-chunk sleeps, time spent in
+    `websocket.send` is absorbed and there is no cumulative drift on long
+    answers. `reset()` forgets the schedule, e.g. after a barge-in.
+    """
+
+    def __init__(self, bytes_per_second, lead=0.2):
+        self.bytes_per_second = bytes_per_second
+        self.lead = lead
+        self.started_at = None
+        self.sent_seconds = 0.0
+
+    def buffered(self):
+        """Seconds of audio the client holds beyond its playhead."""
+        if self.started_at is None:
+            return 0.0
+        return max(0.0, self.started_at + self.sent_seconds - time.monotonic())
+
+    async def pace(self, nbytes):
+        """Account for `nbytes` just sent and wait until it is time for more."""
+        now = time.monotonic()
+        if self.started_at is None or now > self.started_at + self.sent_seconds:
+            # First chunk, or the client ran dry: restart the schedule from
+            # now instead of bursting to catch up on the gap.
+            self.started_at = now
+            self.sent_seconds = 0.0
+        self.sent_seconds += nbytes / self.bytes_per_second
+
+        ahead = self.started_at + self.sent_seconds - now
+        if ahead > self.lead:
+            await asyncio.sleep(ahead - self.lead)
+
+    def reset(self):
+        self.started_at = None
+        self.sent_seconds = 0.0
@@ -1,4 +1,4 @@
-from google.genai import types
+import functools
 
 
 prompts = {
@@ -34,14 +34,20 @@ prompts = {
         - Include subtle disfluencies (false starts, mild corrections) when appropriate
 
         You have the following tools available to you:
-        - get_health_packages: This function/tool returns the popular health packages
-        - get_test_details: This function will return all the available tests
+        - get_health_packages: This function/tool returns the popular health packages, optionally matching a query or budget
+        - get_test_details: This function searches the available tests by name, other names of the test and price range
         - book_appointment: This function will book the appointments for clients
+        - check_availability: This function returns the free collection slots at a lab location for a date, or the next days with free slots
 
         Rules:
         - Whenever you're asked about the health packages avaialble you MUST use the get_health_packages tool. 
-        - Whenever you're asked about any test details, you MUST use the get_test_details tool.
+        - Whenever you're asked about any test details, you MUST use the get_test_details tool, pass what the patient said about the test as the query.
+        - If the patient asks for tests within a budget, pass the budget as max_price.
+        - Before booking, use check_availability for the lab the patient visits, or the lab nearest their address for home collection, and offer only the slots it returns.
         - Whenever you're asked to book appointment you MUST use book_appointment tool.
+        - If book_appointment returns an error, explain it to the patient and offer the available_slots it returns instead.
+        - book_appointment returns a booking reference, read it out to the patient and tell them the booking is requested and they will get a confirmation once the lab accepts it. Never book the same slot twice.
+        - If you are given notes from earlier calls, greet the patient by name and use the notes for context. The notes hold no phone number or address, ask for those as usual.
 
         # Goal
 
@@ -92,57 +98,132 @@ prompts = {
         - Pragmatic clients: Lead with implementation ease and immediate benefits (\"We can have this running in your environment within days, not months\").
     """
 }
-tool_config = {
-    "yoda_diagnostics": types.Tool(
-        function_declarations=[
-            types.FunctionDeclaration(
-                name="get_health_packages",
-                description="This function/tool returns the popular health packages",
-            ),
-            types.FunctionDeclaration(
-                name="get_test_details",
-                description="This function/tool returns the details of all the tests avaialble",
-            ),
-            types.FunctionDeclaration(
-                name="book_appointment",
-                description="This function will book the appointments for clients",
-                parameters=types.Schema(
-                    type=types.Type.OBJECT,
-                    properties={
-                        "isSampleCollectionAtHome": types.Schema(
-                            type=types.Type.BOOLEAN,
-                            description="If patient opts in for home sample collection set this to true, if pateint says in lab collection then set this to false",
-                        ),
-                        "name": types.Schema(
-                            type=types.Type.STRING,
-                            description="Pateints name",
-                        ),
-                        "phone": types.Schema(
-                            type=types.Type.NUMBER,
-                            description="Pateints phone number requireed by the person to communicate when they visit home for sample collection",
-                        ),
-                        "address": types.Schema(
-                            type=types.Type.STRING,
-                            description="If isSampleCollectionAtHome is true or in other words user wants to collect the sample from their home then we need to get user address",
-                        ),
-                        "testName": types.Schema(
-                            type=types.Type.STRING,
-                            description="Test name for which sample is supposed to be collected",
-                        ),
-                        "date": types.Schema(
-                            type=types.Type.STRING,
-                            description="Date (DD-MMY-YYYY format) when the sample collection is supposed to happen e.g 1-06-2025",
-                        ),
-                        "time": types.Schema(
-                            type=types.Type.STRING,
-                            description="Time slot when the sample collection should happen e.g 2pm, 10am, remember collection can happen only between 8am to 6pm, you need to tell pateint that details",
-                        ),
-                    },
+
+
+# The Tool objects, and the google.genai import they need, are only built
+# when tool_config is first used.
+@functools.cache
+def _tool_config():
+    from google.genai import types
+
+    return {
+        "yoda_diagnostics": types.Tool(
+            function_declarations=[
+                types.FunctionDeclaration(
+                    name="get_health_packages",
+                    description="This function/tool returns the popular health packages, best matches first",
+                    parameters=types.Schema(
+                        type=types.Type.OBJECT,
+                        properties={
+                            "query": types.Schema(
+                                type=types.Type.STRING,
+                                description="What the patient is looking for e.g. full body checkup, diabetes, senior citizen, leave empty to list the popular packages",
+                            ),
+                            "max_price": types.Schema(
+                                type=types.Type.NUMBER,
+                                description="Highest package price in rupees the patient is willing to pay",
+                            ),
+                            "limit": types.Schema(
+                                type=types.Type.INTEGER,
+                                description="How many packages to return, defaults to 5",
+                            ),
+                        },
+                    ),
                 ),
-            ),
-        ]
-    )
-}
+                types.FunctionDeclaration(
+                    name="get_test_details",
+                    description="This function/tool searches the tests avaialble and returns the best matches with their price",
+                    parameters=types.Schema(
+                        type=types.Type.OBJECT,
+                        properties={
+                            "query": types.Schema(
+                                type=types.Type.STRING,
+                                description="Test name or what the patient called it e.g. thyroid, CBC, sugar test, vitamin D",
+                            ),
+                            "min_price": types.Schema(
+                                type=types.Type.NUMBER,
+                                description="Lowest test price in rupees",
+                            ),
+                            "max_price": types.Schema(
+                                type=types.Type.NUMBER,
+                                description="Highest test price in rupees",
+                            ),
+                            "limit": types.Schema(
+                                type=types.Type.INTEGER,
+                                description="How many tests to return, defaults to 5",
+                            ),
+                        },
+                    ),
+                ),
+                types.FunctionDeclaration(
+                    name="book_appointment",
+                    description="This function requests the appointment for clients and returns a booking reference, the lab confirms it shortly after",
+                    parameters=types.Schema(
+                        type=types.Type.OBJECT,
+                        properties={
+                            "isSampleCollectionAtHome": types.Schema(
+                                type=types.Type.BOOLEAN,
+                                description="If patient opts in for home sample collection set this to true, if pateint says in lab collection then set this to false",
+                            ),
+                            "name": types.Schema(
+                                type=types.Type.STRING,
+                                description="Pateints name",
+                            ),
+                            "phone": types.Schema(
+                                type=types.Type.NUMBER,
+                                description="Pateints phone number requireed by the person to communicate when they visit home for sample collection",
+                            ),
+                            "address": types.Schema(
+                                type=types.Type.STRING,
+                                description="If isSampleCollectionAtHome is true or in other words user wants to collect the sample from their home then we need to get user address",
+                            ),
+                            "testName": types.Schema(
+                                type=types.Type.STRING,
+                                description="Test name for which sample is supposed to be collected",
+                            ),
+                            "date": types.Schema(
+                                type=types.Type.STRING,
+                                description="Date (DD-MMY-YYYY format) when the sample collection is supposed to happen e.g 1-06-2025",
+                            ),
+                            "time": types.Schema(
+                                type=types.Type.STRING,
+                                description="Time slot when the sample collection should happen e.g 2pm, 10am, remember collection can happen only between 8am to 6pm, you need to tell pateint that details",
+                            ),
+                            "location": types.Schema(
+                                type=types.Type.STRING,
+                                description="Lab location from the list of YODA locations e.g. kukatpally, the lab visited for in lab collection or the one nearest the patient for home collection",
+                            ),
+                        },
+                        required=["location"],
+                    ),
+                ),
+                types.FunctionDeclaration(
+                    name="check_availability",
+                    description="This function returns the free hourly collection slots at a YODA lab location",
+                    parameters=types.Schema(
+                        type=types.Type.OBJECT,
+                        properties={
+                            "location": types.Schema(
+                                type=types.Type.STRING,
+                                description="Lab location from the list of YODA locations e.g. kukatpally",
+                            ),
+                            "date": types.Schema(
+                                type=types.Type.STRING,
+                                description="Date (DD-MM-YYYY format) or today / tomorrow, leave empty to get the next days with free slots",
+                            ),
+                        },
+                        required=["location"],
+                    ),
+                ),
+            ]
+        )
+    }
+
+
+def __getattr__(name):
+    if name == "tool_config":
+        return _tool_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_prompt(name):
@@ -150,4 +231,4 @@ def get_prompt(name):
 
 
 def get_tool_config(name):
-    return tool_config[name]
+    return _tool_config()[name]
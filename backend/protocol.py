@@ -0,0 +1,72 @@
+import base64
+import json
+from urllib.parse import parse_qs, urlsplit
+
+from telephony import TwilioProtocol
+
+# Wire formats for the browser WebSocket.
+#
+# json   (legacy) every audio chunk is base64 PCM inside a JSON text frame:
+#        in:  {"realtime_input": {"media_chunks": [{"mime_type": "audio/pcm", "data": "..."}]}}
+#        out: {"audio": "..."}
+# binary raw 16-bit little-endian PCM travels as binary frames (16 kHz in,
+#        24 kHz out), control and activity messages stay JSON text frames.
+#        Clients opt in with `?protocol=binary` on the connect URL and the
+#        server acknowledges with {"setup_complete": {"protocol": "binary"}}.
+# twilio phone calls connecting on /twilio[/<assistant>], see telephony.TwilioProtocol.
+JSON = "json"
+BINARY = "binary"
+TWILIO_PATH = "/twilio"
+
+
+def negotiate(path):
+    url = urlsplit(path or "")
+    # /twilio or /twilio/<assistant>
+    if (url.path.rstrip("/") + "/").startswith(TWILIO_PATH + "/"):
+        return TwilioProtocol()
+    query = parse_qs(url.query)
+    if query.get("protocol", [JSON])[0] == BINARY:
+        return BinaryProtocol()
+    return JsonProtocol()
+
+
+class JsonProtocol:
+    name = JSON
+
+    def parse(self, message):
+        """Split one inbound frame into (pcm_chunks, control_message)."""
+        # Raw PCM binary frames are understood in either mode, only the
+        # outbound encoding is negotiated.
+        if isinstance(message, (bytes, bytearray, memoryview)):
+            return [message], None
+
+        data = json.loads(message)
+        chunks = []
+        if "realtime_input" in data:
+            for chunk in data["realtime_input"]["media_chunks"]:
+                if chunk["mime_type"] == "audio/pcm":
+                    chunks.append(base64.b64decode(chunk["data"]))
+            return chunks, None
+        return chunks, data
+
+    def encode_audio(self, pcm):
+        return json.dumps({"audio": base64.b64encode(pcm).decode("utf-8")})
+
+    def control(self, payload):
+        return json.dumps(payload)
+
+    def interrupted(self):
+        return json.dumps({"interrupted": True})
+
+    def handshake(self):
+        return None
+
+
+class BinaryProtocol(JsonProtocol):
+    name = BINARY
+
+    def encode_audio(self, pcm):
+        return bytes(pcm)
+
+    def handshake(self):
+        return json.dumps({"setup_complete": {"protocol": BINARY}})
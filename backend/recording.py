@@ -0,0 +1,325 @@
+import json
+import logging
+import os
+import queue
+import shutil
+import struct
+import threading
+import time
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+log = logging.getLogger(__name__)
+
+# Call recording, off by default. RECORD_CALLS=all records every call,
+# RECORD_CALLS=opt_in only calls that connect with `?record=1`. Each call
+# gets a directory under RECORDING_DIR:
+#
+#   caller-000.wav    caller audio as received, 16 kHz mono
+#   model-000.wav     model audio as generated, 24 kHz mono
+#   events.jsonl      replies, model text, tool calls, interruptions, ...
+#   meta.json         session, assistant, duration, outcome
+#
+# Every event carries the seconds since the call started and how many bytes
+# of each stream had been recorded by then, which is enough to line the call
+# up again, e.g. `loadtest.py --replay <dir>`.
+#
+# The relay only hands chunks to a bounded queue; a writer thread does the
+# file work. Audio goes to WAV segments preallocated at RECORDING_SEGMENT_BYTES
+# and rotated when full. A call stops recording audio past
+# RECORDING_MAX_CALL_BYTES, and the oldest calls are deleted once the
+# directory holds more than RECORDING_MAX_TOTAL_BYTES. When the writer falls
+# behind by RECORDING_QUEUE_SIZE chunks, further chunks are dropped and
+# counted rather than held in memory.
+RECORD_CALLS = os.getenv("RECORD_CALLS", "off")
+RECORDING_DIR = os.getenv("RECORDING_DIR", "recordings")
+RECORDING_SEGMENT_BYTES = int(os.getenv("RECORDING_SEGMENT_BYTES", str(8 << 20)))
+RECORDING_MAX_CALL_BYTES = int(os.getenv("RECORDING_MAX_CALL_BYTES", str(128 << 20)))
+RECORDING_MAX_TOTAL_BYTES = int(os.getenv("RECORDING_MAX_TOTAL_BYTES", str(10 << 30)))
+RECORDING_QUEUE_SIZE = int(os.getenv("RECORDING_QUEUE_SIZE", "20000"))
+
+OFF = "off"
+OPT_IN = "opt_in"
+ALL = "all"
+
+CALLER = "caller"
+MODEL = "model"
+RATES = {CALLER: 16000, MODEL: 24000}
+_EVENT = "event"
+_CLOSE = "close"
+
+_WAV_HEADER = struct.Struct("<4sI4s4sIHHIIHH4sI")
+
+
+def _wav_header(rate, data_bytes):
+    # 16-bit mono PCM
+    fmt = (1, 1, rate, rate * 2, 2, 16)
+    return _WAV_HEADER.pack(
+        b"RIFF", 36 + data_bytes, b"WAVE", b"fmt ", 16, *fmt, b"data", data_bytes
+    )
+
+
+def wanted(path, mode=RECORD_CALLS):
+    """Whether a call connecting on `path` should be recorded."""
+    if mode == ALL:
+        return True
+    if mode == OPT_IN:
+        return parse_qs(urlsplit(path or "").query).get("record", [""])[0] == "1"
+    return False
+
+
+class _Segment:
+    """One WAV file, its space reserved up front and the header patched at close."""
+
+    def __init__(self, path, rate, size):
+        self.rate = rate
+        self.written = 0
+        self.file = open(path, "wb", buffering=1 << 16)
+        try:
+            os.posix_fallocate(self.file.fileno(), 0, _WAV_HEADER.size + size)
+        except (AttributeError, OSError):
+            pass  # not supported here, the file just grows
+        self.file.write(_wav_header(rate, 0))
+
+    def write(self, data):
+        self.file.write(data)
+        self.written += len(data)
+
+    def close(self):
+        self.file.seek(0)
+        self.file.write(_wav_header(self.rate, self.written))
+        self.file.truncate(_WAV_HEADER.size + self.written)
+        self.file.close()
+
+
+class _Stream:
+    def __init__(self, directory, name, segment_bytes):
+        self.directory = directory
+        self.name = name
+        self.segment_bytes = segment_bytes
+        self.segment = None
+        self.segments = 0
+        self.bytes = 0
+
+    def write(self, data):
+        while data:
+            if self.segment is None or self.segment.written >= self.segment_bytes:
+                self.close()
+                path = self.directory / f"{self.name}-{self.segments:03d}.wav"
+                self.segment = _Segment(path, RATES[self.name], self.segment_bytes)
+                self.segments += 1
+            room = self.segment_bytes - self.segment.written
+            self.segment.write(data[:room])
+            self.bytes += min(room, len(data))
+            data = data[room:]
+
+    def close(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+
+def _size(directory):
+    return sum(f.stat().st_size for f in directory.iterdir() if f.is_file())
+
+
+class Recording:
+    """One call being recorded. The methods only queue, they never block."""
+
+    def __init__(self, recorder, directory, meta):
+        self.recorder = recorder
+        self.directory = directory
+        self.meta = meta
+        self.started = time.monotonic()
+        self.dropped = 0
+        # Owned by the writer thread.
+        self.streams = None
+        self.events = None
+        self.truncated = False
+        self.failed = False
+        self.done = False
+
+    def caller_audio(self, chunk):
+        self.recorder.put(self, CALLER, chunk)
+
+    def model_audio(self, chunk):
+        self.recorder.put(self, MODEL, chunk)
+
+    def event(self, name, /, **fields):
+        fields["t"] = round(time.monotonic() - self.started, 3)
+        fields["event"] = name
+        self.recorder.put(self, _EVENT, fields)
+
+    def close(self, **fields):
+        self.event("end", **fields)
+        fields["duration"] = round(time.monotonic() - self.started, 3)
+        self.recorder.put(self, _CLOSE, fields)
+
+    # Writer thread side.
+
+    def _open(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        segment_bytes = self.recorder.segment_bytes
+        self.streams = {
+            name: _Stream(self.directory, name, segment_bytes) for name in RATES
+        }
+        self.events = open(self.directory / "events.jsonl", "w", buffering=1 << 16)
+        (self.directory / "meta.json").write_text(json.dumps(self.meta))
+
+    def _write(self, kind, payload):
+        if self.done:
+            return
+        if self.streams is None:
+            self._open()
+        if kind == _EVENT:
+            for name, stream in self.streams.items():
+                payload[f"{name}_bytes"] = stream.bytes
+            self.events.write(json.dumps(payload, default=str) + "\n")
+        elif kind == _CLOSE:
+            self._close(**payload)
+        elif self.truncated:
+            return
+        elif self.recorded_bytes() + len(payload) > self.recorder.max_call_bytes:
+            self.truncated = True
+            elapsed = round(time.monotonic() - self.started, 3)
+            self._write(_EVENT, {"t": elapsed, "event": "truncated"})
+        else:
+            self.streams[kind].write(payload)
+            self.recorder.bytes_written += len(payload)
+
+    def recorded_bytes(self):
+        return sum(stream.bytes for stream in self.streams.values())
+
+    def _close(self, **fields):
+        self.done = True
+        if self.streams is None:
+            return
+        for stream in self.streams.values():
+            stream.close()
+        self.events.close()
+        self.meta.update(
+            fields,
+            bytes=self.recorded_bytes(),
+            truncated=self.truncated,
+            dropped_chunks=self.dropped,
+        )
+        (self.directory / "meta.json").write_text(json.dumps(self.meta))
+        self.streams = None
+
+
+class Recorder:
+    """Writes every open Recording from a single background thread.
+
+    Audio chunks and events are queued up to `queue_size` outstanding items,
+    past that they are dropped and counted; closing a recording is always
+    queued so its files are finished.
+    """
+
+    def __init__(
+        self,
+        directory,
+        segment_bytes=RECORDING_SEGMENT_BYTES,
+        max_call_bytes=RECORDING_MAX_CALL_BYTES,
+        max_total_bytes=RECORDING_MAX_TOTAL_BYTES,
+        queue_size=RECORDING_QUEUE_SIZE,
+    ):
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.max_call_bytes = max_call_bytes
+        self.max_total_bytes = max_total_bytes
+        self.queue_size = queue_size
+        self.dropped = 0
+        self.bytes_written = 0
+        # Items put and items taken each have a single writer, so their
+        # difference is the backlog without a lock on the relay's path.
+        self._put = 0
+        self._taken = 0
+        self._queue = queue.SimpleQueue()
+        self._active = set()
+        self._total = None
+        self._thread = None
+
+    def open(self, session_id, **meta):
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{session_id}"
+        meta.update(session=session_id, started=time.time(), rates=RATES)
+        recording = Recording(self, self.directory / name, meta)
+        self.start()
+        return recording
+
+    def put(self, recording, kind, payload):
+        if kind != _CLOSE and self._put - self._taken >= self.queue_size:
+            self.dropped += 1
+            recording.dropped += 1
+            return
+        self._put += 1
+        self._queue.put((recording, kind, payload))
+
+    def backlog(self):
+        return self._put - self._taken
+
+    def _run(self):
+        while (item := self._queue.get()) is not None:
+            recording, kind, payload = item
+            self._taken += 1
+            if recording.failed:
+                continue
+            try:
+                self._active.add(recording)
+                recording._write(kind, payload)
+                if kind == _CLOSE:
+                    self._active.discard(recording)
+                    self._prune(recording)
+            except Exception as e:
+                log.warning("recording %s failed: %s", recording.directory, e)
+                recording.failed = True
+                self._active.discard(recording)
+                self._discard(recording)
+
+    def _discard(self, recording):
+        try:
+            recording._close()
+        except OSError:
+            pass
+
+    def _prune(self, recording):
+        # The total is measured once, then kept up to date as calls end.
+        # Calls still open are left out until they end, their segments are
+        # preallocated and would count at full size.
+        in_use = {recording.directory for recording in self._active}
+        if self._total is None:
+            self._total = sum(
+                _size(path)
+                for path in self.directory.iterdir()
+                if path.is_dir() and path not in in_use
+            )
+        else:
+            self._total += _size(recording.directory)
+        if self._total <= self.max_total_bytes:
+            return
+        # Oldest calls first; directory names start with the time they began.
+        for path in sorted(self.directory.iterdir()):
+            if self._total <= self.max_total_bytes:
+                break
+            if path in in_use or not path.is_dir():
+                continue
+            self._total -= _size(path)
+            shutil.rmtree(path, ignore_errors=True)
+            log.info("deleted old recording %s", path.name)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="recorder", daemon=True
+            )
+            self._thread.start()
+
+    def close(self, timeout=5.0):
+        """Finish queued writes; recordings still open are closed as they are."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            if not self._thread.is_alive():
+                for recording in list(self._active):
+                    self._discard(recording)
+                self._active.clear()
+            self._thread = None
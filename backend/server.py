@@ -1,235 +1,1081 @@
+import startup  # first, so the imports below are timed
+
 import asyncio
-import base64
+import contextlib
+import diagnostics
 import json
 import os
-import traceback
-from google import genai
-from google.genai import types
-from tools import get_tool
+import logging
+import sys
+import time
+import tool_output
+from urllib.parse import parse_qs, urlencode, urlsplit, urlunsplit
+import vad
+import functools
 import http
+import metrics
+import protocol
+from audio_queue import AudioQueue, QueueOverflow
+from pacer import PlaybackPacer
 import signal
-from prompts import get_prompt, get_tool_config
+import supervisor
+import callcontext
+import logs
+import memory
+import recording
+import usage
 import websockets
+from websockets.exceptions import ConnectionClosed
+from websockets.frames import CloseCode
+from admission import Admission
+
+startup.mark("imports")
 
 # MODEL = "gemini-2.5-flash-preview-native-audio-dialog"
 # MODEL = "gemini-2.0-flash-exp"
 MODEL = "gemini-2.0-flash-live-001"
 API_KEY = os.getenv("GOOGLE_API_KEY")
-ASSISTANT_NAME = "yoda_diagnostics"
-SYSTEM_PROMPT = get_prompt(ASSISTANT_NAME)
-TOOL_CONFIG = get_tool_config(ASSISTANT_NAME)
+# Serve calls from the local Live API stand-in, for load tests and offline runs.
+GEMINI_FAKE = os.getenv("GEMINI_FAKE") == "1"
+INPUT_MIME_TYPE = "audio/pcm;rate=16000"
+INPUT_BYTES_PER_SECOND = 16000 * 1 * 2
+# Model audio is 24 kHz, mono, 16-bit PCM.
+OUTPUT_BYTES_PER_SECOND = 24000 * 1 * 2
+# Small chunks are coalesced into frames of up to AUDIO_IN_FRAME_MS before
+# they go to Gemini and AUDIO_OUT_FRAME_MS before they go to the client,
+# waiting at most *_FRAME_HOLD_MS for a frame to fill. Model audio is only
+# held while the client has more than that buffered, so batching never
+# delays the start of a reply. A frame size of 0 sends chunks as they come.
+AUDIO_IN_FRAME_MS = int(os.getenv("AUDIO_IN_FRAME_MS", "40"))
+AUDIO_IN_FRAME_HOLD_MS = int(os.getenv("AUDIO_IN_FRAME_HOLD_MS", "20"))
+AUDIO_OUT_FRAME_MS = int(os.getenv("AUDIO_OUT_FRAME_MS", "100"))
+AUDIO_OUT_FRAME_HOLD_MS = int(os.getenv("AUDIO_OUT_FRAME_HOLD_MS", "20"))
+PLAYBACK_LEAD_MS = int(os.getenv("PLAYBACK_LEAD_MS", "200"))
+# Per-session byte limits for buffered audio: model speech waiting to be
+# paced out to the client (1 MiB is ~20 s at 24 kHz), and caller audio
+# waiting to be sent to Gemini (160 KiB is ~5 s at 16 kHz, enough to cover
+# resuming a dropped upstream session).
+MODEL_AUDIO_QUEUE_BYTES = int(os.getenv("MODEL_AUDIO_QUEUE_BYTES", str(1 << 20)))
+MODEL_AUDIO_QUEUE_POLICY = os.getenv("MODEL_AUDIO_QUEUE_POLICY", "drop_oldest")
+CLIENT_AUDIO_QUEUE_BYTES = int(os.getenv("CLIENT_AUDIO_QUEUE_BYTES", str(160 << 10)))
+CLIENT_AUDIO_QUEUE_POLICY = os.getenv("CLIENT_AUDIO_QUEUE_POLICY", "drop_oldest")
+# Optional voice activity gate on caller audio: silence past the hangover is
+# not sent to Gemini (VAD_MODE=gate) or only one chunk in VAD_THIN_EVERY is
+# (VAD_MODE=thin). Turning it off does not make numpy optional, the phone
+# audio transcoder (telephony.py) needs it on every call.
+VAD_ENABLED = os.getenv("VAD_ENABLED") == "1"
+VAD_THRESHOLD_DB = float(os.getenv("VAD_THRESHOLD_DB", "-45"))
+VAD_HANGOVER_MS = int(os.getenv("VAD_HANGOVER_MS", "800"))
+VAD_PREROLL_MS = int(os.getenv("VAD_PREROLL_MS", "300"))
+VAD_MODE = os.getenv("VAD_MODE", vad.GATE)
+VAD_THIN_EVERY = int(os.getenv("VAD_THIN_EVERY", "4"))
+WORKERS = int(os.getenv("WORKERS", "1"))
+# Admission control and shutdown: calls over MAX_SESSIONS wait up to
+# SESSION_QUEUE_TIMEOUT seconds in a queue of SESSION_QUEUE_SIZE, the rest
+# are rejected. On SIGTERM in-flight calls get DRAIN_TIMEOUT seconds.
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "100"))
+SESSION_QUEUE_SIZE = int(os.getenv("SESSION_QUEUE_SIZE", "10"))
+SESSION_QUEUE_TIMEOUT = float(os.getenv("SESSION_QUEUE_TIMEOUT", "2"))
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "120"))
+# Live sessions kept connected ahead of demand, 0 connects per call.
+SESSION_POOL_SIZE = int(os.getenv("SESSION_POOL_SIZE", "0"))
+SESSION_POOL_MAX_IDLE = float(os.getenv("SESSION_POOL_MAX_IDLE", "120"))
+# Assistants the pool keeps sessions ready for, comma separated, by default
+# the default assistant.
+SESSION_POOL_ASSISTANTS = [
+    name for name in os.getenv("SESSION_POOL_ASSISTANTS", "").split(",") if name
+]
+WARM_TOOL_CACHE = os.getenv("WARM_TOOL_CACHE", "1") == "1"
+# Long calls: once the context reaches COMPRESSION_TRIGGER_TOKENS Gemini drops
+# the oldest turns down to COMPRESSION_TARGET_TOKENS instead of ending the
+# session. With SESSION_RESUMPTION a lost or recycled upstream connection is
+# reopened from the latest resumption handle, up to RESUME_ATTEMPTS times.
+CONTEXT_COMPRESSION = os.getenv("CONTEXT_COMPRESSION", "1") == "1"
+COMPRESSION_TRIGGER_TOKENS = int(os.getenv("COMPRESSION_TRIGGER_TOKENS", "25600"))
+COMPRESSION_TARGET_TOKENS = int(os.getenv("COMPRESSION_TARGET_TOKENS", "12800"))
+SESSION_RESUMPTION = os.getenv("SESSION_RESUMPTION", "1") == "1"
+RESUME_ATTEMPTS = int(os.getenv("RESUME_ATTEMPTS", "3"))
 
-client = genai.Client(
-    api_key=API_KEY,
-    http_options={"api_version": "v1alpha"},
-)
+logs.setup()
+log = logging.getLogger("server")
+
+# The Gemini SDK, its client, the assistants and the tools take most of the
+# startup time, so init() loads them once the port is bound and /healthz
+# answers; until then /readyz reports NOT READY and calls are turned away.
+types = None
+client = None
+CONFIG = None
+session_pool = None
+registry = None
+assistants = None
+tools = None
+tool_executor = None
+run_tool = None
+
+
+def live_config():
+    # Settings shared by every assistant, the registry fills in the prompt and
+    # tools (and optionally the voice) per assistant.
+    return types.LiveConnectConfig(
+        response_modalities=[
+            "AUDIO",
+        ],
+        # enable_affective_dialog=True, // only available for gemini-2.5-flash-preview-native-audio-dialog
+        speech_config=types.SpeechConfig(
+            voice_config=types.VoiceConfig(
+                prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name="Puck")
+            )
+        ),
+        context_window_compression=(
+            types.ContextWindowCompressionConfig(
+                trigger_tokens=COMPRESSION_TRIGGER_TOKENS,
+                sliding_window=types.SlidingWindow(
+                    target_tokens=COMPRESSION_TARGET_TOKENS
+                ),
+            )
+            if CONTEXT_COMPRESSION
+            else None
+        ),
+        session_resumption=(
+            types.SessionResumptionConfig() if SESSION_RESUMPTION else None
+        ),
+        # realtime_input_config=types.RealtimeInputConfig(
+        #     turn_coverage="TURN_INCLUDES_ALL_INPUT"
+        # ),
+    )
+
+
+def assistant_changed(name, assistant):
+    if assistant is None:
+        session_pool.unregister(name)
+    else:
+        warm = name in (SESSION_POOL_ASSISTANTS or [assistants.DEFAULT_ASSISTANT])
+        session_pool.register(name, assistant.model, assistant.config, warm)
 
-my_loop = asyncio.new_event_loop()
-CONFIG = types.LiveConnectConfig(
-    response_modalities=[
-        "AUDIO",
-    ],
-    # enable_affective_dialog=True, // only available for gemini-2.5-flash-preview-native-audio-dialog
-    speech_config=types.SpeechConfig(
-        voice_config=types.VoiceConfig(
-            prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name="Puck")
+
+def init():
+    """Load the SDK, client, assistants and tools, once per process."""
+    global types, client, CONFIG, session_pool, registry
+    global assistants, tools, tool_executor, run_tool
+    if registry is not None:
+        return
+    with startup.phase("init"):
+        from google.genai import types
+
+        import assistants
+        import tool_executor
+        import tools
+        from session_pool import SessionPool
+        from tool_executor import run_tool
+
+        if GEMINI_FAKE:
+            import fake_live
+
+            client = fake_live.FakeClient()
+        else:
+            from google import genai
+
+            client = genai.Client(
+                api_key=API_KEY,
+                http_options={"api_version": "v1alpha"},
+            )
+        CONFIG = live_config()
+        session_pool = SessionPool(
+            client.aio.live.connect, SESSION_POOL_SIZE, SESSION_POOL_MAX_IDLE
         )
-    ),
-    # context_window_compression=types.ContextWindowCompressionConfig(
-    #     trigger_tokens=25600,
-    #     sliding_window=types.SlidingWindow(target_tokens=12800),
-    # ),
-    # realtime_input_config=types.RealtimeInputConfig(
-    #     turn_coverage="TURN_INCLUDES_ALL_INPUT"
-    # ),
-    system_instruction=SYSTEM_PROMPT,
-    tools=[TOOL_CONFIG],
+        registry = assistants.Registry(
+            CONFIG, MODEL, assistants.ASSISTANTS_DIR, on_change=assistant_changed
+        )
+
+
+recorder = recording.Recorder(recording.RECORDING_DIR)
+loop_monitor = diagnostics.LoopMonitor(
+    diagnostics.LOOP_LAG_INTERVAL,
+    diagnostics.LOOP_STALL_THRESHOLD,
+    diagnostics.LOOP_STALLS_KEPT,
 )
+usage_store = usage.UsageStore(
+    usage.USAGE_PATH,
+    usage.USAGE_FLUSH_INTERVAL,
+    usage.USAGE_WINDOW,
+    usage.USAGE_RETENTION_DAYS,
+)
+caller_memory = memory.CallerStore(
+    memory.CALLER_MEMORY_PATH,
+    memory.CALLER_MEMORY_FLUSH_INTERVAL,
+    memory.CALLER_MEMORY_BOOKINGS,
+    memory.CALLER_MEMORY_RETENTION_DAYS,
+)
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class UpstreamLost(Exception):
+    """The Gemini side of the call failed; may be resumable."""
+
+
+class UsageLimitReached(Exception):
+    """The call used up its budget and is being ended."""
 
 
 class AudioLoop:
-    def __init__(self, websocket):
+    def __init__(self, websocket, assistant, call, recording=None):
         self.websocket = websocket
+        self.assistant = assistant
+        self.call = call
+        # Tees caller and model audio plus call events to the recorder.
+        self.recording = recording
+        self.protocol = protocol.negotiate(websocket.request.path)
         self.audio_in_queue = None
         self.out_queue = None
         self.session = None
+        self.pacer = PlaybackPacer(
+            OUTPUT_BYTES_PER_SECOND, lead=PLAYBACK_LEAD_MS / 1000
+        )
+        self.status = "completed"
+        # Frame buffers, allocated once per call and reused for every frame.
+        self.in_frame = bytearray(INPUT_BYTES_PER_SECOND * AUDIO_IN_FRAME_MS // 1000)
+        self.out_frame = bytearray(OUTPUT_BYTES_PER_SECOND * AUDIO_OUT_FRAME_MS // 1000)
+        self.vad = None
+        if VAD_ENABLED:
+            self.vad = vad.EnergyGate(
+                threshold_db=VAD_THRESHOLD_DB,
+                hangover_ms=VAD_HANGOVER_MS,
+                preroll_ms=VAD_PREROLL_MS,
+                mode=VAD_MODE,
+                thin_every=VAD_THIN_EVERY,
+            )
+        # per-turn latency trace
+        self.turn = 0
+        self.last_audio_in_at = None
+        self.first_audio_pending = True
+        self.transcript = []
+        self.resume_handle = None
+        # Caller audio sent since the latest handle, replayed on resume so
+        # speech in flight when the upstream dropped is not lost.
+        self.replay = None
+        self.go_away = False
+        self.usage = usage.SessionUsage(assistant.budget)
+        self.usage_changed = asyncio.Event()
+        self.wrapping_up = False
+
+    def queue_stats(self):
+        # Peak and dropped bytes of each queue, e.g. model_audio_peak_bytes.
+        return {
+            f"{queue.name}_{key}": value
+            for queue in (self.audio_in_queue, self.out_queue)
+            if queue is not None
+            for key, value in queue.stats().items()
+        }
+
+    async def send_control(self, payload):
+        # Activity, error and other JSON messages; phone streams drop them.
+        if message := self.protocol.control(payload):
+            await self.websocket.send(message)
+
+    def notify(self, payload):
+        # Fire-and-forget variant of send_control for the activity feed, so a
+        # slow client never holds up a tool round-trip.
+        spawn(self._notify(payload))
+
+    async def _notify(self, payload):
+        with contextlib.suppress(ConnectionClosed):
+            await self.send_control(payload)
+
+    async def call_tool(self, fc):
+        log.info("tool call", extra={"tool": fc.name})
+        self.notify(
+            {
+                "assistant_activity": f"TOOL called - {fc.name}",
+            }
+        )
+        if self.recording is not None:
+            self.recording.event("tool_call", tool=fc.name, args=fc.args)
+        resp = await run_tool(self.assistant.functions, fc.name, fc.args)
+        summary = tool_output.summarize(fc.name, resp)
+        result = tool_output.compact(fc.name, resp)
+        if self.recording is not None:
+            self.recording.event("tool_response", tool=fc.name, result=result)
+        self.notify(
+            {
+                "assistant_activity": f"TOOL response - {summary}\n\n\n",
+            }
+        )
+        return types.FunctionResponse(
+            id=fc.id,
+            name=fc.name,
+            response={"result": result},
+            will_continue=False,
+        )
 
     async def handle_tool_call(self, tool_call):
-        function_responses = []
-        for fc in tool_call.function_calls:
-            print("TOOL Used - ", fc.name)
-            await self.websocket.send(
-                json.dumps(
-                    {
-                        "assistant_activity": f"TOOL called - {fc.name}",
-                    }
-                )
-            )
-            func_generator = get_tool(ASSISTANT_NAME, fc.name)
-            resp = func_generator(**fc.args)
-            await self.websocket.send(
-                json.dumps(
-                    {
-                        "assistant_activity": f"TOOL response - {resp}\n\n\n",
-                    }
-                )
-            )
-            function_response = types.FunctionResponse(
-                id=fc.id,
-                name=fc.name,
-                response={"result": resp},
-                will_continue=False,
-            )
-            function_responses.append(function_response)
-        await self.session.send_tool_response(function_responses=function_responses)
+        # Independent function calls in one tool_call run concurrently on the
+        # tool executor, the response order still matches the request order.
+        function_responses = await asyncio.gather(
+            *(self.call_tool(fc) for fc in tool_call.function_calls)
+        )
+        await self.session.send_tool_response(
+            function_responses=list(function_responses)
+        )
 
     async def listen_audio_from_websocket(self):
         try:
             async for message in self.websocket:
                 try:
-                    data = json.loads(message)
-                    if "realtime_input" in data:
-                        for chunk in data["realtime_input"]["media_chunks"]:
-                            if chunk["mime_type"] == "audio/pcm":
-                                await self.out_queue.put(
-                                    {"data": chunk["data"], "mime_type": "audio/pcm"}
-                                )
+                    chunks, control = self.protocol.parse(message)
+                    for chunk in chunks:
+                        metrics.audio_bytes.inc(len(chunk), "in")
+                        self.forward_audio(chunk)
+                    if control and control.get("event") == "start":
+                        self.identify_caller(control["start"])
 
+                except QueueOverflow:
+                    raise
                 except Exception as e:
-                    print(f"Error sending to Gemini: {e}")
-            print("Client connection closed (send)")
+                    log.warning("bad client message: %s", e)
+            log.info("client closed the connection")
+        except QueueOverflow:
+            raise
         except Exception as e:
-            print(f"Error sending to Gemini: {e}")
-        finally:
-            print("send_to_gemini closed")
+            log.warning("client connection failed: %s", e)
+        # Without a caller there is nothing left to relay, end the session
+        # instead of keeping the Gemini connection open until it times out.
+        raise ClientDisconnected
 
-    async def send_realtime_audio_to_gemini(self):
+    def identify_caller(self, start):
+        # A stream Twilio signed names the caller in its `From` custom
+        # parameter, which only arrives with the start message.
+        caller = self.call.memory
+        if caller is not None and caller.identify(start.get("customParameters", {})):
+            spawn(self.recall_caller(asyncio.to_thread(caller_memory.recall, caller)))
+
+    async def recall_caller(self, lookup):
+        """Give the model what earlier calls learned about the caller."""
         try:
-            while True:
-                msg = await self.out_queue.get()
-                await self.session.send_realtime_input(audio=msg)
-        except Exception as e:
-            print("Exception while sending audio to gemini - ", e)
-            await self.websocket.send(
-                json.dumps(
-                    {
-                        "model_error": f"{e}",
-                    }
+            summary = await lookup
+            if summary:
+                await self.session.send_client_content(
+                    turns=types.Content(role="user", parts=[types.Part(text=summary)]),
+                    turn_complete=False,
                 )
-            )
+                log.info("caller recalled")
+        except Exception as e:
+            log.warning("could not recall the caller: %s", e)
+
+    def forward_audio(self, chunk):
+        if self.recording is not None:
+            self.recording.caller_audio(chunk)
+        if self.vad is None:
+            self.out_queue.put_nowait(chunk)
+            self.last_audio_in_at = time.monotonic()
+            return
+
+        forward, speech = self.vad.process(chunk)
+        if speech:
+            # with the gate on, turn latency is measured from the caller's
+            # last speech rather than the last (silent) chunk
+            self.last_audio_in_at = time.monotonic()
+        for piece in forward:
+            self.out_queue.put_nowait(piece)
+
+    async def send_realtime_audio_to_gemini(self):
+        hold = AUDIO_IN_FRAME_HOLD_MS / 1000
+        while True:
+            chunk = await self.out_queue.get()
+            chunk = await self.out_queue.coalesce(chunk, self.in_frame, hold)
+            if chunk is None:
+                continue
+            # bytes() copies a coalesced frame out of the reused buffer, the
+            # SDK and the replay queue keep it; whole chunks pass unchanged.
+            chunk = bytes(chunk)
+            try:
+                if chunk is vad.STREAM_END or not chunk:
+                    await self.session.send_realtime_input(audio_stream_end=True)
+                else:
+                    await self.session.send_realtime_input(
+                        audio=types.Blob(data=chunk, mime_type=INPUT_MIME_TYPE)
+                    )
+            except Exception as e:
+                log.warning("sending audio to Gemini failed: %s", e)
+                # Replayed on the resumed session.
+                self.out_queue.requeue(chunk)
+                raise UpstreamLost(e) from e
+            metrics.audio_frames.inc(1, "in")
+            if self.replay is not None:
+                self.replay.put_nowait(chunk)
 
     async def receive_audio_from_gemini(self):
         "Background task to reads from the websocket and write pcm chunks to the output queue"
         while True:
-            turn = self.session.receive()
-            async for response in turn:
+            async for response in self.upstream_turn():
                 if (
                     response.server_content
                     and response.server_content.interrupted is True
                 ):
-                    print("Interruption detected")
+                    log.info("interrupted")
+                    metrics.interruptions.inc()
+                    if self.recording is not None:
+                        self.recording.event("interrupted")
+                    await self.flush_playback()
                 if response.usage_metadata:
-                    usage = response.usage_metadata
-                    print("output token usage : ", usage.total_token_count, " tokens")
+                    self.record_usage(response.usage_metadata)
                 if data := response.data:
+                    if self.first_audio_pending:
+                        self.trace_first_audio()
                     self.audio_in_queue.put_nowait(data)
+                    if self.recording is not None:
+                        self.recording.model_audio(data)
                     continue
                 if text := response.text:
-                    print(text, end="")
+                    self.transcript.append(text)
 
                 if tool_call := response.tool_call:
                     await self.handle_tool_call(tool_call)
 
-            # If you interrupt the model, it sends a turn_complete.
-            # For interruptions to work, we need to stop playback.
-            # So empty out the audio queue because it may have loaded
-            # much more audio than has played yet.
-            while not self.audio_in_queue.empty():
-                self.audio_in_queue.get_nowait()
+                if update := response.session_resumption_update:
+                    if update.resumable and update.new_handle:
+                        self.resume_handle = update.new_handle
+                        self.replay.clear()
+                if response.go_away:
+                    # Gemini is about to close the connection, move over once
+                    # this turn is done rather than cutting the reply off.
+                    log.info("go_away", extra={"time_left": response.go_away.time_left})
+                    self.go_away = True
 
-    async def send_audio_to_client(self):
+            text = "".join(self.transcript)
+            self.transcript.clear()
+            if text:
+                # Model text is the transcript of the turn, one record per turn.
+                log.debug("model text", extra={"text": text})
+            if self.recording is not None:
+                self.recording.event("turn_complete", turn=self.turn, text=text)
+            self.turn += 1
+            self.call.turn = self.turn
+            self.first_audio_pending = True
+            metrics.turns.inc()
+            metrics.turn_queue_bytes.observe(self.audio_in_queue.buffered_bytes)
+            if self.go_away:
+                raise UpstreamLost("go_away")
+
+    async def upstream_turn(self):
+        """`session.receive()` with upstream failures raised as UpstreamLost.
+
+        The SDK reports a closed Live connection as an APIError, kept apart
+        here from errors on the caller's websocket.
+        """
+        turn = aiter(self.session.receive())
         while True:
-            bytestream = await self.audio_in_queue.get()
-            base64_audio = base64.b64encode(bytestream).decode("utf-8")
-            await self.websocket.send(
-                json.dumps(
-                    {
-                        "audio": base64_audio,
-                    }
+            try:
+                response = await anext(turn)
+            except StopAsyncIteration:
+                return
+            except Exception as e:
+                raise UpstreamLost(e) from e
+            yield response
+
+    async def relay_upstream(self, lease):
+        """Run the two Gemini-facing tasks, resuming the session if it drops."""
+        while True:
+            self.session = lease.session
+            self.go_away = False
+            try:
+                async with asyncio.TaskGroup() as tg:
+                    tg.create_task(self.send_realtime_audio_to_gemini())
+                    tg.create_task(self.receive_audio_from_gemini())
+            except* UpstreamLost as group:
+                reason = group.exceptions[0]
+            finally:
+                await lease.close()
+            lease = await self.resume(reason)
+
+    async def resume(self, reason):
+        if not self.resume_handle:
+            raise UpstreamLost(f"{reason}, no resumption handle")
+        log.warning("upstream session lost, resuming: %s", reason)
+        for attempt in range(RESUME_ATTEMPTS):
+            try:
+                lease = await session_pool.resume(
+                    self.assistant.model, self.assistant.config, self.resume_handle
                 )
-            )
+            except Exception as e:
+                log.warning("resume attempt %d failed: %s", attempt + 1, e)
+                await asyncio.sleep(0.5 * 2**attempt)
+                continue
+            metrics.upstream_reconnects.inc(1, "ok")
+            if self.recording is not None:
+                self.recording.event("resumed", reason=str(reason))
+            unheard = []
+            while not self.replay.empty():
+                unheard.append(self.replay.get_nowait())
+            for chunk in reversed(unheard):
+                self.out_queue.requeue(chunk)
+            return lease
+        metrics.upstream_reconnects.inc(1, "failed")
+        raise UpstreamLost(f"{reason}, resume failed")
+
+    def trace_first_audio(self):
+        self.first_audio_pending = False
+        if self.recording is not None:
+            self.recording.event("reply", turn=self.turn)
+        if self.last_audio_in_at is None:
+            return  # the model spoke first, nothing to measure against
+        latency = time.monotonic() - self.last_audio_in_at
+        metrics.first_audio_latency.observe(latency)
+        log.debug("first audio", extra={"latency_ms": round(latency * 1000)})
+
+    def record_usage(self, metadata):
+        counts = (
+            metadata.prompt_token_count,
+            metadata.response_token_count,
+            metadata.total_token_count,
+        )
+        for kind, count in zip(("prompt", "response", "total"), counts):
+            if count:
+                metrics.tokens.inc(count, kind)
+        usage_store.add(self.assistant.name, *counts)
+        if self.usage.add(*counts):
+            self.usage_changed.set()
+        log.debug("usage", extra={"total_tokens": self.usage.total_tokens})
+
+    async def enforce_budget(self):
+        """Wrap the call up at its soft limit and end it at the hard one."""
+        while True:
+            with contextlib.suppress(TimeoutError):
+                async with asyncio.timeout(self.usage.next_deadline()):
+                    await self.usage_changed.wait()
+            self.usage_changed.clear()
+            self.usage.check()
+            if self.usage.state == usage.HARD:
+                break
+            if self.usage.state == usage.SOFT and not self.wrapping_up:
+                self.wrapping_up = True
+                self.limit_reached()
+                await self.wrap_up()
+        self.limit_reached()
+        # Let the reply already on its way finish playing before hanging up.
+        with contextlib.suppress(TimeoutError):
+            async with asyncio.timeout(usage.USAGE_END_GRACE):
+                while self.audio_in_queue.buffered_bytes or self.pacer.buffered() > 0:
+                    await asyncio.sleep(0.1)
+        with contextlib.suppress(ConnectionClosed):
+            await self.send_control({"session_ended": "usage limit reached"})
+        raise UsageLimitReached(self.usage.reason)
+
+    def limit_reached(self):
+        limit = f"{self.usage.state}_{self.usage.reason}"
+        metrics.usage_limits.inc(1, limit)
+        log.info("usage limit reached", extra={"limit": limit, **self.usage.totals()})
+        if self.recording is not None:
+            self.recording.event("usage_limit", limit=limit)
 
-            """
-                Simulate real-time playback duration
-                Replace these with actual values
+    async def wrap_up(self):
+        try:
+            await self.session.send_client_content(
+                turns=types.Content(
+                    role="user", parts=[types.Part(text=usage.WRAP_UP_PROMPT)]
+                ),
+                turn_complete=False,
+            )
+        except Exception as e:
+            log.warning("could not ask the model to wrap up: %s", e)
 
-                This is very IMPORTANT becuase websocket.send is async 
-                so while True consumes the queue very very fast and all the voice is 
-                sent to client, so talk to interrupt doesn't work hence the below code
-            """
-            sample_rate = 24000  # e.g. 16 kHz
-            channels = 1  # mono
-            bytes_per_sample = 2  # 16-bit PCM => 2 bytes
+    async def flush_playback(self):
+        # The caller barged in: drop everything the model said that has not
+        # been sent yet and tell the client to drop what it has buffered.
+        self.audio_in_queue.clear()
+        self.pacer.reset()
+        if message := self.protocol.interrupted():
+            await self.websocket.send(message)
 
-            duration_seconds = len(bytestream) / (
-                sample_rate * channels * bytes_per_sample
+    async def send_audio_to_client(self):
+        max_hold = AUDIO_OUT_FRAME_HOLD_MS / 1000
+        while True:
+            bytestream = await self.audio_in_queue.get()
+            hold = max_hold if self.pacer.buffered() > max_hold else 0
+            bytestream = await self.audio_in_queue.coalesce(
+                bytestream, self.out_frame, hold
             )
+            if bytestream is None:
+                continue
+            message = self.protocol.encode_audio(bytestream)
+            if message is None:
+                continue
+            await self.websocket.send(message)
+            metrics.audio_bytes.inc(len(bytestream), "out")
+            metrics.audio_frames.inc(1, "out")
 
-            await asyncio.sleep(duration_seconds)
+            # websocket.send returns as soon as the frame is written, so
+            # without pacing the whole answer would be pushed to the client
+            # at once and barge-in could not cut it short. The pacer keeps
+            # the client only PLAYBACK_LEAD_MS ahead of its playhead.
+            await self.pacer.pace(len(bytestream))
 
     async def run(self):
-        print("Please start speaking... start by saying hello...!")
+        accepted_at = time.monotonic()
         try:
-            async with (
-                client.aio.live.connect(model=MODEL, config=CONFIG) as session,
-                asyncio.TaskGroup() as tg,
-            ):
-                self.session = session
-
-                self.audio_in_queue = asyncio.Queue()
-                self.out_queue = asyncio.Queue(maxsize=5)
+            self.audio_in_queue = AudioQueue(
+                MODEL_AUDIO_QUEUE_BYTES, MODEL_AUDIO_QUEUE_POLICY, "model_audio"
+            )
+            self.out_queue = AudioQueue(
+                CLIENT_AUDIO_QUEUE_BYTES, CLIENT_AUDIO_QUEUE_POLICY, "client_audio"
+            )
+            if SESSION_RESUMPTION:
+                self.replay = AudioQueue(CLIENT_AUDIO_QUEUE_BYTES, name="replay")
+            lookup = None
+            if self.call.memory is not None and self.call.memory.known():
+                # Looked up while the Live session is acquired.
+                lookup = asyncio.ensure_future(
+                    asyncio.to_thread(caller_memory.recall, self.call.memory)
+                )
+            try:
+                lease = await session_pool.acquire(self.assistant.name)
+            except Exception as e:
+                if lookup is not None:
+                    lookup.cancel()
+                self.status = "error"
+                with contextlib.suppress(ConnectionClosed):
+                    await self.send_control({"model_error": f"{e}"})
+                log.error("could not open a live session", exc_info=e)
+                return
+            metrics.session_setup.observe(time.monotonic() - accepted_at)
+            try:
+                if handshake := self.protocol.handshake():
+                    await self.websocket.send(handshake)
+            except BaseException:
+                if lookup is not None:
+                    lookup.cancel()
+                await lease.close()
+                raise
 
-                tg.create_task(self.send_realtime_audio_to_gemini())
+            # relay_upstream owns the lease from here on.
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(self.relay_upstream(lease))
+                if lookup is not None:
+                    tg.create_task(self.recall_caller(lookup))
                 tg.create_task(self.listen_audio_from_websocket())
-                tg.create_task(self.receive_audio_from_gemini())
                 tg.create_task(self.send_audio_to_client())
+                tg.create_task(self.enforce_budget())
         except asyncio.CancelledError:
             pass
         except ExceptionGroup as EG:  # noqa: F821
-            await self.websocket.send(json.dumps({"model_error": f"{EG}"}))
-            traceback.print_exception(EG)
+            _, errors = EG.split(
+                (ClientDisconnected, ConnectionClosed, UsageLimitReached)
+            )
+            if errors is None and EG.subgroup(UsageLimitReached) is not None:
+                self.status = "limited"
+            if errors is not None:
+                self.status = "error"
+                with contextlib.suppress(ConnectionClosed):
+                    await self.send_control({"model_error": f"{errors}"})
+                log.error("session failed", exc_info=errors)
+        finally:
+            for queue in (self.audio_in_queue, self.out_queue, self.replay):
+                if queue is not None:
+                    queue.clear()
+            if self.vad is not None:
+                metrics.vad_suppressed_bytes.inc(self.vad.suppressed_bytes)
+
+
+admission = Admission(MAX_SESSIONS, SESSION_QUEUE_SIZE, SESSION_QUEUE_TIMEOUT)
 
 
 async def gemini_session_handler(websocket):
-    print("New client connected - ", websocket.id)
-    loop = AudioLoop(websocket)
-    await loop.run()
+    call = callcontext.CallInfo(str(websocket.id))
+    callcontext.current.set(call)
+    if registry is None:
+        log.info("rejected client, still starting up")
+        await websocket.close(CloseCode.TRY_AGAIN_LATER, "starting up")
+        metrics.sessions.inc(1, "rejected")
+        return
+    try:
+        assistant = registry.resolve(websocket.request.path)
+    except assistants.UnknownAssistant as e:
+        log.info("rejected client, unknown assistant %s", e)
+        await websocket.close(CloseCode.POLICY_VIOLATION, "unknown assistant")
+        metrics.sessions.inc(1, "rejected")
+        return
+    if usage_store.over_window(assistant.name, assistant.budget):
+        log.info("rejected client, assistant over its usage window")
+        await websocket.close(CloseCode.TRY_AGAIN_LATER, "usage limit reached")
+        metrics.sessions.inc(1, "rejected")
+        metrics.usage_limits.inc(1, "window")
+        return
+    if not await admission.acquire():
+        log.info("rejected client, server at capacity")
+        await websocket.close(CloseCode.TRY_AGAIN_LATER, "server busy")
+        metrics.sessions.inc(1, "rejected")
+        return
+
+    call.assistant = assistant.name
+    if memory.CALLER_MEMORY:
+        call.memory = memory.CallerMemory.from_request(websocket.request)
+    log.info("client connected", extra={"path": websocket.request.path})
+    supervisor.add_sessions(1)
+    record = None
+    if recording.wanted(websocket.request.path):
+        record = recorder.open(call.session_id, assistant=assistant.name)
+    loop = AudioLoop(websocket, assistant, call, record)
+    try:
+        await loop.run()
+    finally:
+        supervisor.add_sessions(-1)
+        admission.release()
+        metrics.sessions.inc(1, loop.status)
+        totals = loop.usage.totals()
+        usage_store.call_ended(assistant.name, totals["call_seconds"])
+        log.info(
+            "session ended",
+            extra={
+                "status": loop.status,
+                "turns": loop.turn,
+                **totals,
+                **loop.queue_stats(),
+            },
+        )
+        if record is not None:
+            record.close(status=loop.status, turns=loop.turn, **totals)
+        if call.memory is not None:
+            caller_memory.save(call.memory)
+
+
+def node_summary(node):
+    return (
+        f"workers={node['ready']}/{node['workers']} available={node['available']}"
+        f" sessions={node['sessions']} restarts={node['restarts']}\n"
+    )
+
+
+def liveness(connection):
+    node = supervisor.aggregate(MAX_SESSIONS)
+    if node is None:
+        return connection.respond(http.HTTPStatus.OK, "OK\n")
+    if node["supervisor_alive"]:
+        return connection.respond(http.HTTPStatus.OK, "OK " + node_summary(node))
+    return connection.respond(
+        http.HTTPStatus.SERVICE_UNAVAILABLE, "DOWN " + node_summary(node)
+    )
+
+
+def readiness(connection):
+    node = supervisor.aggregate(MAX_SESSIONS)
+    if registry is None:
+        return connection.respond(
+            http.HTTPStatus.SERVICE_UNAVAILABLE, "NOT READY initialising\n"
+        )
+    if node is None:
+        ready = admission.ready()
+        body = (
+            f"sessions={admission.active}/{MAX_SESSIONS}"
+            f" waiting={admission.waiting} draining={admission.draining}\n"
+        )
+    else:
+        ready = (
+            node["supervisor_alive"]
+            and node["available"] > 0
+            and not node["node_draining"]
+        )
+        body = node_summary(node)
+    if ready:
+        return connection.respond(http.HTTPStatus.OK, "READY " + body)
+    return connection.respond(http.HTTPStatus.SERVICE_UNAVAILABLE, "NOT READY " + body)
+
+
+metrics.Gauge(
+    "vaani_active_sessions", "Sessions in progress", callback=lambda: admission.active
+)
+metrics.Gauge(
+    "vaani_session_pool_idle",
+    "Warm live sessions waiting in the pool",
+    callback=lambda: session_pool.idle_count() if session_pool is not None else 0,
+)
+metrics.Gauge(
+    "vaani_waiting_sessions",
+    "Callers in the admission wait queue",
+    callback=lambda: admission.waiting,
+)
+metrics.Gauge(
+    "vaani_queue_buffered_bytes",
+    "Audio bytes buffered across all sessions",
+    labels=("queue",),
+    callback=lambda: (((n,), v) for n, v in AudioQueue.buffered_by_name.items()),
+)
+metrics.Counter(
+    "vaani_queue_dropped_bytes_total",
+    "Audio bytes dropped by queue overflow policies",
+    labels=("queue",),
+    callback=lambda: (((n,), v) for n, v in AudioQueue.dropped_by_name.items()),
+)
+
+metrics.Counter(
+    "vaani_log_records_dropped_total",
+    "Log records not written, rate limited or with the log queue full",
+    labels=("reason",),
+    callback=lambda: (((k,), v) for k, v in list(logs.dropped.items())),
+)
+metrics.Counter(
+    "vaani_bookings_total",
+    "Booking requests by outbox outcome",
+    labels=("result",),
+    callback=lambda: (
+        ((k,), v) for k, v in list(tools.booking_outbox.counts.items() if tools else ())
+    ),
+)
+metrics.Gauge(
+    "vaani_booking_outbox_backlog",
+    "Bookings waiting for delivery, as of the last outbox poll",
+    callback=lambda: tools.booking_outbox.backlog if tools else 0,
+)
+metrics.Counter(
+    "vaani_recorded_bytes_total",
+    "Call audio bytes written to recordings",
+    callback=lambda: recorder.bytes_written,
+)
+metrics.Counter(
+    "vaani_recording_dropped_total",
+    "Recording chunks and events dropped with the writer behind",
+    callback=lambda: recorder.dropped,
+)
+
+
+metrics.Counter(
+    "vaani_caller_memory_total",
+    "Caller memory lookups by outcome, and calls saved",
+    labels=("result",),
+    callback=lambda: (((k,), v) for k, v in list(caller_memory.counts.items())),
+)
+metrics.Gauge(
+    "vaani_usage_window_tokens",
+    "Tokens used per assistant over the usage window, across workers",
+    labels=("assistant",),
+    callback=lambda: (((k,), v) for k, v in list(usage_store.window_tokens.items())),
+)
+metrics.Gauge(
+    "vaani_startup_seconds",
+    "Seconds each startup phase took, ready is the total",
+    labels=("phase",),
+    callback=lambda: (((k,), v) for k, v in list(startup.phases.items())),
+)
+
+
+def metrics_response(connection, text):
+    response = connection.respond(http.HTTPStatus.OK, text)
+    response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return response
+
+
+async def node_metrics(connection):
+    # Every worker's metrics, labelled by worker; one that does not answer
+    # (e.g. restarting) is left out of this scrape.
+    async def worker_metrics(index):
+        if index == supervisor.worker_index:
+            return metrics.render(worker=index)
+        try:
+            status, body = await supervisor.fetch(index, "/metrics")
+        except (OSError, TimeoutError, ValueError, IndexError) as e:
+            log.warning("no metrics from worker %d: %s", index, e)
+            return ""
+        return body if status == http.HTTPStatus.OK else ""
+
+    texts = await asyncio.gather(
+        *(worker_metrics(index) for index in range(supervisor.shared.workers))
+    )
+    return metrics_response(connection, metrics.merge(texts))
+
+
+async def worker_debug(connection, request):
+    # /debug/...?worker=N, answered by worker N's admin listener.
+    url = urlsplit(request.path)
+    query = parse_qs(url.query)
+    try:
+        index = int(query.pop("worker")[0])
+        if not 0 <= index < supervisor.shared.workers:
+            raise ValueError(index)
+    except (KeyError, ValueError):
+        return connection.respond(
+            http.HTTPStatus.BAD_REQUEST,
+            f"Pass ?worker=N, N from 0 to {supervisor.shared.workers - 1}\n",
+        )
+    path = urlunsplit(url._replace(query=urlencode(query, doseq=True)))
+    headers = []
+    if "Authorization" in request.headers:
+        headers.append(("Authorization", request.headers["Authorization"]))
+    try:
+        status, body = await supervisor.fetch(
+            index, path, headers, timeout=diagnostics.PROFILE_MAX_SECONDS + 1
+        )
+    except (OSError, TimeoutError, ValueError, IndexError) as e:
+        log.warning("no answer from worker %d: %s", index, e)
+        return connection.respond(
+            http.HTTPStatus.BAD_GATEWAY, f"Worker {index} did not answer\n"
+        )
+    return connection.respond(http.HTTPStatus(status), body)
+
+
+def admin_request(connection, request):
+    # This worker's own metrics and diagnostics, see supervisor.py.
+    if request.path == "/metrics":
+        return metrics_response(
+            connection, metrics.render(worker=supervisor.worker_index)
+        )
+    if request.path.startswith("/debug/"):
+        return diagnostics.handle(connection, request, loop_monitor)
+    return connection.respond(http.HTTPStatus.NOT_FOUND, "Not found\n")
+
+
+async def refuse(websocket):
+    await websocket.close(CloseCode.POLICY_VIOLATION, "admin port")
+
+
+def busy(connection):
+    response = connection.respond(
+        http.HTTPStatus.SERVICE_UNAVAILABLE, "Server busy, retry shortly\n"
+    )
+    response.headers["Retry-After"] = "1"
+    return response
 
 
 def health_check(connection, request):
     if request.path == "/healthz":
-        return connection.respond(http.HTTPStatus.OK, "OK\n")
+        return liveness(connection)
 
     if request.path == "/health":
-        print("health invoked")
-        return connection.respond(http.HTTPStatus.OK, "OK\n")
+        log.debug("health invoked")
+        return liveness(connection)
+
+    if request.path == "/readyz":
+        return readiness(connection)
 
+    if request.path == "/metrics":
+        if supervisor.shared is not None:
+            return node_metrics(connection)
+        return metrics_response(connection, metrics.render())
 
-async def main() -> None:
+    if request.path.startswith("/debug/"):
+        if supervisor.shared is not None:
+            return worker_debug(connection, request)
+        return diagnostics.handle(connection, request, loop_monitor)
+
+    if registry is None:
+        return busy(connection)
+
+    try:
+        registry.resolve(request.path)
+    except assistants.UnknownAssistant:
+        return connection.respond(http.HTTPStatus.NOT_FOUND, "Unknown assistant\n")
+
+    # Turn callers away before the WebSocket upgrade when there is no room,
+    # a plain 503 is cheaper for both sides than a doomed session.
+    if not admission.accepting() or supervisor.node_draining():
+        admission.rejected += 1
+        return busy(connection)
+
+
+# Strong references to fire-and-forget tasks so they are not garbage
+# collected half way through.
+background_tasks = set()
+
+
+def spawn(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+async def warm_tool_cache():
     try:
-        async with websockets.serve(
-            gemini_session_handler, "0.0.0.0", 9082, process_request=health_check
-        ) as server:
-            print("Running websocket server on 0.0.0.0:9082...")
+        await asyncio.to_thread(tools.warm_up)
+        log.info("tool cache warmed up")
+    except Exception as e:
+        log.warning("tool cache warm-up failed: %s", e)
+
+
+async def drain(server):
+    # Stop admitting calls but keep the listener up so /healthz and /readyz
+    # keep answering, then give in-flight calls up to DRAIN_TIMEOUT to end.
+    # Under the supervisor the listener goes at once: the other workers
+    # sharing the port take the new calls.
+    supervisor.set_state(supervisor.DRAINING)
+    admission.start_drain()
+    if supervisor.shared is not None:
+        server.server.close()
+    log.info("draining %d sessions, up to %ss", admission.active, DRAIN_TIMEOUT)
+    if not await admission.wait_idle(DRAIN_TIMEOUT):
+        log.warning("drain deadline reached, closing %d sessions", admission.active)
+    server.close()
+
+
+async def main(reuse_port=False, report=False) -> None:
+    logs.setup()
+    try:
+        with startup.phase("bind"):
+            server = await websockets.serve(
+                gemini_session_handler,
+                "0.0.0.0",
+                9082,
+                process_request=health_check,
+                reuse_port=reuse_port,
+            )
+        admin = None
+        if supervisor.shared is not None:
+            admin = await websockets.serve(
+                refuse,
+                supervisor.WORKER_ADMIN_HOST,
+                supervisor.admin_port(),
+                process_request=admin_request,
+            )
+        async with server:
+            log.info("running websocket server on 0.0.0.0:9082 (pid %d)", os.getpid())
+            spawn(loop_monitor.run())
+            # Health checks are answered while this runs; a no-op for
+            # workers, the supervisor initialised before forking them.
+            await asyncio.to_thread(init)
+            supervisor.set_state(supervisor.READY)
+            log.info("startup", extra=startup.ready())
+            if report:
+                # Only the timings: no services, so no files are created.
+                print(json.dumps(startup.phases))
+                server.close()
+                tool_executor.shutdown()
+                return
+            if WARM_TOOL_CACHE:
+                spawn(warm_tool_cache())
+            session_pool.start()
+            tools.booking_outbox.start()
+            usage_store.start()
+            if memory.CALLER_MEMORY:
+                caller_memory.start()
+            if registry.directory is not None:
+                spawn(registry.watch())
             loop = asyncio.get_running_loop()
-            loop.add_signal_handler(signal.SIGTERM, server.close)
+            loop.add_signal_handler(signal.SIGTERM, lambda: spawn(drain(server)))
             await server.wait_closed()
-    except Exception as e:
-        print(f"WebSocket server error: {e}")
+            if admin is not None:
+                admin.close()
+            await session_pool.close()
+            tools.booking_outbox.close()
+            recorder.close()
+            usage_store.close()
+            if memory.CALLER_MEMORY:
+                caller_memory.close()
+            tool_executor.shutdown()
+    except Exception:
+        log.exception("websocket server error")
 
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
-    except Exception as e:
-        print(f"Server failed to start: {e}")
+        if "--startup-report" in sys.argv[1:]:
+            asyncio.run(main(report=True))
+        elif WORKERS > 1:
+            # Loaded once here, the workers share it through fork.
+            init()
+            supervisor.Supervisor(
+                WORKERS, functools.partial(main, reuse_port=True)
+            ).run()
+        else:
+            asyncio.run(main())
+    except Exception:
+        log.exception("server failed to start")
@@ -0,0 +1,167 @@
+import asyncio
+import contextlib
+import logging
+import time
+from collections import deque
+
+from google.genai import types
+from websockets.protocol import State
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+
+class Lease:
+    """A live session handed to one call; `close()` ends it."""
+
+    def __init__(self, session, stack, pooled, config=None):
+        self.session = session
+        self.stack = stack
+        self.pooled = pooled
+        self.config = config
+        self.created_at = time.monotonic()
+
+    def healthy(self):
+        # genai sessions wrap a websockets connection, anything other than
+        # OPEN means the upstream side went away while the session sat idle.
+        ws = getattr(self.session, "_ws", None)
+        return ws is None or getattr(ws, "state", State.OPEN) is State.OPEN
+
+    async def close(self):
+        with contextlib.suppress(Exception):
+            await self.stack.aclose()
+
+
+class SessionPool:
+    """Keeps `size` Gemini Live sessions connected ahead of demand.
+
+    Opening a live session costs a TLS handshake plus the setup exchange,
+    which callers otherwise hear as dead air. The pool holds sessions per
+    assistant config, hands one out on connect and opens a replacement in
+    the background. Idle sessions older than `max_idle` or whose socket has
+    closed are discarded, as are sessions opened with a config that has
+    since been re-registered. Only keys registered with `warm=True` are kept
+    filled. With `size=0` every acquire connects directly.
+    """
+
+    def __init__(self, connect, size=0, max_idle=120.0, check_interval=1.0):
+        self.connect = connect
+        self.size = size
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+        self.configs = {}
+        self.warm = set()
+        self.idle = {}
+        self.opening = {}
+        self.failures = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def register(self, key, model, config, warm=True):
+        self.configs[key] = (model, config)
+        if warm:
+            self.warm.add(key)
+        self.idle.setdefault(key, deque())
+        self.opening.setdefault(key, 0)
+        self._wakeup.set()
+
+    def unregister(self, key):
+        self.configs.pop(key, None)
+        self.warm.discard(key)
+        self._wakeup.set()
+
+    def _usable(self, key, lease, now):
+        return (
+            lease.healthy()
+            and now - lease.created_at < self.max_idle
+            and key in self.configs
+            and lease.config is self.configs[key][1]
+        )
+
+    async def _open(self, model, config, pooled):
+        stack = contextlib.AsyncExitStack()
+        try:
+            session = await stack.enter_async_context(
+                self.connect(model=model, config=config)
+            )
+        except BaseException:
+            await stack.aclose()
+            raise
+        return Lease(session, stack, pooled, config)
+
+    async def acquire(self, key):
+        idle = self.idle.get(key)
+        while idle:
+            lease = idle.popleft()
+            self._wakeup.set()
+            if self._usable(key, lease, time.monotonic()):
+                metrics.session_pool.inc(1, "hit")
+                return lease
+            await lease.close()
+        metrics.session_pool.inc(1, "miss")
+        model, config = self.configs[key]
+        return await self._open(model, config, pooled=False)
+
+    async def resume(self, model, config, handle):
+        """Reconnect to the server-side session behind a resumption handle.
+
+        Never served from the pool: the handle names one conversation, and
+        the call keeps the config it started with.
+        """
+        config = config.model_copy(
+            update={"session_resumption": types.SessionResumptionConfig(handle=handle)}
+        )
+        return await self._open(model, config, pooled=False)
+
+    async def _fill(self, key):
+        self.opening[key] += 1
+        try:
+            model, config = self.configs[key]
+            lease = await self._open(model, config, pooled=True)
+        except Exception as e:
+            self.failures += 1
+            log.warning("could not open a session for %s: %s", key, e)
+            await asyncio.sleep(min(30.0, 2.0**self.failures))
+            return
+        finally:
+            self.opening[key] -= 1
+        self.failures = 0
+        self.idle[key].append(lease)
+
+    async def _evict(self):
+        now = time.monotonic()
+        for key, idle in self.idle.items():
+            for lease in list(idle):
+                if not self._usable(key, lease, now):
+                    idle.remove(lease)
+                    await lease.close()
+
+    async def run(self):
+        fills = set()
+        while True:
+            await self._evict()
+            for key in self.warm:
+                missing = self.size - len(self.idle[key]) - self.opening[key]
+                for _ in range(max(0, missing)):
+                    task = asyncio.create_task(self._fill(key))
+                    fills.add(task)
+                    task.add_done_callback(fills.discard)
+            self._wakeup.clear()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), self.check_interval)
+
+    def start(self):
+        if self.size > 0 and self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for idle in self.idle.values():
+            while idle:
+                await idle.popleft().close()
+
+    def idle_count(self):
+        return sum(len(idle) for idle in self.idle.values())
@@ -0,0 +1,50 @@
+import contextlib
+import sqlite3
+import threading
+
+
+class SQLiteStore:
+    """Base for the stores kept in a SQLite file: outbox, usage, callers.
+
+    The file is opened on first use, so importing a module that creates a
+    store creates no files. It runs in WAL mode, so reads do not wait on the
+    writer and several worker processes can share it; `_transaction` takes
+    the write lock up front with BEGIN IMMEDIATE. The connection is shared by
+    the threads of a process, hold `_lock` while using it.
+    """
+
+    schema = ""
+    # PRAGMA synchronous for the connection, None keeps SQLite's default.
+    synchronous = None
+
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+        self._lock = threading.Lock()
+
+    @property
+    def db(self):
+        if self._db is None:
+            db = sqlite3.connect(
+                self.path, timeout=10, isolation_level=None, check_same_thread=False
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            if self.synchronous:
+                db.execute(f"PRAGMA synchronous={self.synchronous}")
+            db.executescript(self.schema)
+            self._migrate(db)
+            self._db = db
+        return self._db
+
+    def _migrate(self, db):
+        """Bring files made by older releases up to the current schema."""
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
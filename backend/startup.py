@@ -0,0 +1,63 @@
+import os
+import time
+
+# Cold start timing. server.py records how long each startup phase took and
+# logs them once the worker is ready; they are also exported as
+# vaani_startup_seconds{phase}, and `python server.py --startup-report`
+# prints them as JSON and exits, to compare releases.
+#
+#   interpreter   process start until server.py starts importing
+#   imports       modules needed to accept connections
+#   bind          opening the listening socket
+#   init          Gemini client, assistants and tools, after the bind
+#   ready         process start until calls are accepted
+
+_imported_at = time.monotonic()
+
+
+def _process_age():
+    """Seconds since this process started, or None where /proc is missing."""
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22, counted after the parenthesised command name.
+            started = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return max(0.0, uptime - started / os.sysconf("SC_CLK_TCK"))
+
+
+_age_at_import = _process_age()
+phases = {}
+if _age_at_import is not None:
+    phases["interpreter"] = round(_age_at_import, 3)
+
+
+def since_start():
+    """Seconds since the process started, as near as can be told."""
+    return (_age_at_import or 0.0) + time.monotonic() - _imported_at
+
+
+def mark(name):
+    """Record `name` as the time since server.py started importing."""
+    phases[name] = round(time.monotonic() - _imported_at, 3)
+
+
+class phase:
+    """Times the enclosed block as `name`."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        phases[self.name] = round(time.monotonic() - self.started, 3)
+
+
+def ready():
+    phases["ready"] = round(since_start(), 3)
+    return dict(phases)
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+log = logging.getLogger(__name__)
+
+# Supervisor mode: the parent process forks WORKERS copies of the server,
+# each binding the same port with SO_REUSEPORT so the kernel spreads new
+# connections across them. The parent restarts workers that die and, on
+# SIGTERM, marks the node draining and signals every worker at once: they
+# all stop admitting calls together and drain in parallel, and whatever is
+# still running after WORKER_STOP_TIMEOUT, for the node as a whole, is
+# killed. Workers publish their state into shared memory, which lets any of
+# them answer /healthz for the whole node.
+# Keep WORKER_STOP_TIMEOUT above the workers' DRAIN_TIMEOUT so calls get to
+# finish before the worker is killed.
+#
+# Metrics and the /debug routes describe one process, so each worker also
+# listens on WORKER_ADMIN_HOST, port WORKER_ADMIN_PORT + its index, for
+# those alone. /metrics on the shared port gathers every worker's from
+# there, and /debug/...?worker=N is passed on to worker N.
+WORKER_STOP_TIMEOUT = float(os.getenv("WORKER_STOP_TIMEOUT", "150"))
+WORKER_ADMIN_HOST = os.getenv("WORKER_ADMIN_HOST", "127.0.0.1")
+WORKER_ADMIN_PORT = int(os.getenv("WORKER_ADMIN_PORT", "9100"))
+HEARTBEAT_INTERVAL = 0.5
+HEARTBEAT_STALE = 5.0
+MAX_RESTART_BACKOFF = 30.0
+
+STARTING, READY, DRAINING, STOPPED = 0, 1, 2, 3
+
+_ctx = multiprocessing.get_context("fork")
+
+# Set in worker processes only, None when running a single process.
+shared = None
+worker_index = None
+
+
+class SharedState:
+    def __init__(self, workers):
+        self.workers = workers
+        self.states = _ctx.Array("i", [STOPPED] * workers)
+        self.sessions = _ctx.Array("i", workers)
+        self.restarts = _ctx.Value("i", 0)
+        self.heartbeat = _ctx.Value("d", time.time())
+        # Set by the supervisor when the node shuts down, before any worker
+        # has handled its signal.
+        self.draining = _ctx.Value("b", False)
+
+
+def set_state(state):
+    if shared is not None:
+        shared.states[worker_index] = state
+
+
+def add_sessions(delta):
+    if shared is not None:
+        with shared.sessions.get_lock():
+            shared.sessions[worker_index] += delta
+
+
+def node_draining():
+    return shared is not None and bool(shared.draining.value)
+
+
+def admin_port(index=None):
+    return WORKER_ADMIN_PORT + (worker_index if index is None else index)
+
+
+async def fetch(index, path, headers=(), timeout=5.0):
+    """GET `path` from worker `index`'s admin port, returns (status, body)."""
+    async with asyncio.timeout(timeout):
+        reader, writer = await asyncio.open_connection(
+            WORKER_ADMIN_HOST, admin_port(index)
+        )
+        try:
+            lines = [f"GET {path} HTTP/1.1", f"Host: {WORKER_ADMIN_HOST}"]
+            lines += [f"{name}: {value}" for name, value in headers]
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+            await writer.drain()
+            # The server closes the connection after a plain HTTP response.
+            response = await reader.read()
+        finally:
+            writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    return int(head.split(b" ", 2)[1]), body.decode()
+
+
+def aggregate(max_sessions):
+    """Node-wide view for health checks, None outside supervisor mode."""
+    if shared is None:
+        return None
+    states = list(shared.states)
+    sessions = list(shared.sessions)
+    return {
+        "workers": shared.workers,
+        "ready": states.count(READY),
+        "available": sum(
+            1
+            for state, active in zip(states, sessions)
+            if state == READY and active < max_sessions
+        ),
+        "draining": states.count(DRAINING),
+        "node_draining": bool(shared.draining.value),
+        "sessions": sum(sessions),
+        "restarts": shared.restarts.value,
+        "supervisor_alive": time.time() - shared.heartbeat.value < HEARTBEAT_STALE,
+    }
+
+
+def _worker_entry(main, state, index):
+    global shared, worker_index
+    shared, worker_index = state, index
+    # Ctrl-C reaches the whole process group; let the supervisor decide
+    # the shutdown order instead of every worker dying at once.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    set_state(STARTING)
+    try:
+        asyncio.run(main())
+    finally:
+        shared.sessions[index] = 0
+        set_state(STOPPED)
+
+
+class Supervisor:
+    def __init__(self, workers, main):
+        self.main = main
+        self.state = SharedState(workers)
+        self.procs = [None] * workers
+        self.started_at = [0.0] * workers
+        self.backoff = [0.0] * workers
+        self.stopping = False
+
+    def spawn(self, index):
+        proc = _ctx.Process(
+            target=_worker_entry,
+            args=(self.main, self.state, index),
+            name=f"vaani-worker-{index}",
+        )
+        proc.start()
+        self.procs[index] = proc
+        self.started_at[index] = time.monotonic()
+        log.info("started worker %d (pid %d)", index, proc.pid)
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def reap(self):
+        now = time.monotonic()
+        for index, proc in enumerate(self.procs):
+            if proc is None or proc.is_alive():
+                continue
+            if self.started_at[index] > now:
+                continue  # waiting out the restart backoff
+            log.warning(
+                "worker %d (pid %d) exited with %s", index, proc.pid, proc.exitcode
+            )
+            proc.join()
+            self.state.states[index] = STOPPED
+            self.state.sessions[index] = 0
+
+            # Back off workers that crash right after starting so a broken
+            # deploy does not turn into a fork loop.
+            if now - self.started_at[index] < MAX_RESTART_BACKOFF:
+                self.backoff[index] = min(
+                    max(self.backoff[index] * 2, 1.0), MAX_RESTART_BACKOFF
+                )
+            else:
+                self.backoff[index] = 0.0
+            self.procs[index] = None
+            self.started_at[index] = now + self.backoff[index]
+
+        for index, proc in enumerate(self.procs):
+            if proc is None and self.started_at[index] <= now:
+                with self.state.restarts.get_lock():
+                    self.state.restarts.value += 1
+                self.spawn(index)
+
+    def stop_all(self, timeout=WORKER_STOP_TIMEOUT):
+        # No worker admits a call from here on, so none is started only to
+        # be cut off when its worker is stopped later; they drain together
+        # under one deadline.
+        self.state.draining.value = True
+        alive = [
+            (index, proc)
+            for index, proc in enumerate(self.procs)
+            if proc is not None and proc.is_alive()
+        ]
+        for index, proc in alive:
+            log.info("stopping worker %d (pid %d)", index, proc.pid)
+            proc.terminate()
+        deadline = time.monotonic() + timeout
+        for index, proc in alive:
+            proc.join(max(0.0, deadline - time.monotonic()))
+        for index, proc in alive:
+            if proc.is_alive():
+                log.warning("worker %d did not stop in time, killing it", index)
+                proc.kill()
+                proc.join()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for index in range(len(self.procs)):
+            self.spawn(index)
+        while not self.stopping:
+            self.state.heartbeat.value = time.time()
+            self.reap()
+            time.sleep(HEARTBEAT_INTERVAL)
+        self.stop_all()
+        log.info("all workers stopped")
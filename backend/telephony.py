@@ -0,0 +1,136 @@
+import base64
+import json
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Twilio Media Streams adapter. Phone audio is 8 kHz G.711 mu-law in 20 ms
+# frames, the model wants 16 kHz PCM in and produces 24 kHz PCM out, so both
+# directions are transcoded here. Everything is table lookups and one
+# strided dot product per frame, no per-sample Python.
+
+PHONE_RATE = 8000
+INPUT_RATE = 16000
+OUTPUT_RATE = 24000
+
+
+def _ulaw_decode_table():
+    u = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (u >> 4) & 0x07
+    mantissa = u & 0x0F
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return np.where(u & 0x80, -magnitude, magnitude).astype(np.int16)
+
+
+def _ulaw_encode_table():
+    # Follows the reference G.711 encoder (14-bit magnitude, biased, segment
+    # search), indexed by the int16 sample reinterpreted as uint16.
+    x = np.arange(65536, dtype=np.int32)
+    x = np.where(x >= 32768, x - 65536, x) >> 2
+    mask = np.where(x < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(x), 8159) + 0x21
+    segment_ends = np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF])
+    segment = np.searchsorted(segment_ends, magnitude)
+    ulaw = (np.minimum(segment, 7) << 4) | ((magnitude >> (segment + 1)) & 0x0F)
+    ulaw = np.where(segment >= 8, 0x7F, ulaw)
+    return (ulaw ^ mask).astype(np.uint8)
+
+
+ULAW_DECODE = _ulaw_decode_table()
+ULAW_ENCODE = _ulaw_encode_table()
+
+
+def ulaw_decode(data):
+    return ULAW_DECODE[np.frombuffer(data, dtype=np.uint8)]
+
+
+def ulaw_encode(samples):
+    return ULAW_ENCODE[samples.view(np.uint16)].tobytes()
+
+
+class Resampler:
+    """Streaming rational resampler (up/down) with a Kaiser windowed sinc.
+
+    State is carried between calls so frame boundaries are seamless, and
+    only the output samples that survive decimation are computed.
+    """
+
+    def __init__(self, up, down, taps_per_phase=16):
+        self.up = up
+        self.down = down
+        taps = taps_per_phase * max(up, down) | 1
+        cutoff = 0.5 / max(up, down)
+        t = np.arange(taps) - (taps - 1) / 2
+        h = 2 * cutoff * np.sinc(2 * cutoff * t) * np.kaiser(taps, 8.0)
+        self.kernel = (h * (up / h.sum()))[::-1].astype(np.float32)
+        self.history = np.zeros(taps - 1, dtype=np.float32)
+        self.phase = 0
+
+    def process(self, samples):
+        if self.up > 1:
+            stuffed = np.zeros(len(samples) * self.up, dtype=np.float32)
+            stuffed[:: self.up] = samples
+        else:
+            stuffed = samples.astype(np.float32)
+        buffer = np.concatenate((self.history, stuffed))
+        windows = sliding_window_view(buffer, len(self.kernel))[self.phase :: self.down]
+        out = windows @ self.kernel
+        self.history = buffer[len(buffer) - len(self.history) :]
+        self.phase = (self.phase - len(stuffed)) % self.down
+        return np.clip(np.rint(out), -32768, 32767).astype(np.int16)
+
+
+class TwilioProtocol:
+    """Twilio-style media stream on the same WebSocket server (/twilio).
+
+    in:  {"event": "start", "start": {"streamSid": ...}}
+         {"event": "media", "media": {"payload": <base64 mu-law 8 kHz>}}
+         {"event": "stop"}
+    out: {"event": "media", "streamSid": ..., "media": {"payload": ...}}
+         {"event": "clear", "streamSid": ...} to cut playback on barge-in
+    """
+
+    name = "twilio"
+
+    def __init__(self):
+        self.stream_sid = None
+        self.start = {}
+        self.upsampler = Resampler(INPUT_RATE // PHONE_RATE, 1)
+        self.downsampler = Resampler(1, OUTPUT_RATE // PHONE_RATE)
+
+    def parse(self, message):
+        data = json.loads(message)
+        event = data.get("event")
+        if event == "media":
+            if data["media"].get("track", "inbound") != "inbound":
+                return [], None
+            phone = ulaw_decode(base64.b64decode(data["media"]["payload"]))
+            return [self.upsampler.process(phone).tobytes()], None
+        if event == "start":
+            self.start = data["start"]
+            self.stream_sid = data["start"].get("streamSid") or data.get("streamSid")
+        return [], data
+
+    def encode_audio(self, pcm):
+        if self.stream_sid is None:
+            return None  # nowhere to play it before the stream has started
+        phone = self.downsampler.process(np.frombuffer(pcm, dtype=np.int16))
+        payload = base64.b64encode(ulaw_encode(phone)).decode("ascii")
+        return json.dumps(
+            {
+                "event": "media",
+                "streamSid": self.stream_sid,
+                "media": {"payload": payload},
+            }
+        )
+
+    def control(self, payload):
+        return None  # activity and error messages are for browser clients
+
+    def interrupted(self):
+        if self.stream_sid is None:
+            return None
+        return json.dumps({"event": "clear", "streamSid": self.stream_sid})
+
+    def handshake(self):
+        return None
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The backend modules are flat files next to this directory.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,34 @@
+import asyncio
+import json
+
+from google.genai import types
+
+import assistants
+import tools
+from tool_executor import run_tool
+
+
+def test_calls_keep_tools_a_reload_removed(tmp_path, monkeypatch):
+    monkeypatch.setitem(
+        tools.implementations, "check_availability", lambda **args: {"ok": args}
+    )
+    clinic = tmp_path / "clinic.json"
+    clinic.write_text(json.dumps({"tools": ["check_availability"]}))
+    registry = assistants.Registry(types.LiveConnectConfig(), "model", tmp_path)
+    in_progress = registry.get("clinic")
+
+    # Rewritten without the tool, then removed altogether.
+    clinic.write_text(json.dumps({"tools": ["get_test_details"]}))
+    registry.reload()
+    assert registry.get("clinic").tool_names == ["get_test_details"]
+    clinic.unlink()
+    registry.reload()
+    assert "clinic" not in registry.assistants
+
+    result = asyncio.run(
+        run_tool(in_progress.functions, "check_availability", {"location": "x"})
+    )
+    assert result == {"ok": {"location": "x"}}
+    assert asyncio.run(run_tool(in_progress.functions, "get_test_details")) == {
+        "error": "get_test_details is not available"
+    }
@@ -0,0 +1,27 @@
+import metrics
+
+
+def test_merge_lists_each_family_once_with_every_workers_samples():
+    texts = []
+    for worker, calls in ((0, 2), (1, 5)):
+        counter = metrics.Counter("test_calls_total", "Calls", labels=("status",))
+        histogram = metrics.Histogram("test_seconds", "Seconds", (1.0,))
+        try:
+            counter.inc(calls, "ok")
+            histogram.observe(0.5)
+            texts.append(metrics.render(worker=worker))
+        finally:
+            metrics.registry.remove(counter)
+            metrics.registry.remove(histogram)
+
+    merged = metrics.merge(texts).splitlines()
+    assert merged.count("# TYPE test_calls_total counter") == 1
+    start = merged.index("# HELP test_calls_total Calls")
+    assert merged[start : start + 4] == [
+        "# HELP test_calls_total Calls",
+        "# TYPE test_calls_total counter",
+        'test_calls_total{worker="0",status="ok"} 2',
+        'test_calls_total{worker="1",status="ok"} 5',
+    ]
+    assert 'test_seconds_bucket{worker="1",le="1.0"} 1' in merged
+    assert 'test_seconds_count{worker="0"} 1' in merged
@@ -0,0 +1,160 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import outbox
+
+
+class StubDeliver:
+    """Stands in for the booking webhook: raises the queued errors in turn."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = []
+        self.delivered = threading.Event()
+
+    def __call__(self, payload, key):
+        self.calls.append((payload, key))
+        if self.errors:
+            raise self.errors.pop(0)
+        self.delivered.set()
+
+
+@pytest.fixture
+def make_outbox(tmp_path):
+    made = []
+
+    def make(deliver, **kwargs):
+        box = outbox.Outbox(str(tmp_path / "outbox.db"), deliver, **kwargs)
+        made.append(box)
+        return box
+
+    yield make
+    for box in made:
+        box.close()
+        if box._pool is not None:
+            box._pool.shutdown()
+
+
+def row(box, key):
+    return box.db.execute(
+        "SELECT status, attempts, next_attempt_at, last_error FROM outbox"
+        " WHERE idempotency_key = ?",
+        (key,),
+    ).fetchone()
+
+
+def deliver_due(box):
+    # One pass of the delivery thread, run here so the test sets the clock.
+    box._pool = box._pool or ThreadPoolExecutor(1)
+    rows = box._claim()
+    if rows:
+        box._deliver_batch(rows)
+    return len(rows)
+
+
+def test_enqueue_returns_the_existing_row_for_a_repeated_key(make_outbox):
+    box = make_outbox(StubDeliver())
+    key = outbox.idempotency_key("Kondapur", "20-10-2026", "10am", "9876543210")
+    assert box.enqueue(key, {"n": 1}) == (key[:8].upper(), outbox.PENDING, True)
+    again = outbox.idempotency_key(" kondapur ", "20-10-2026", "10AM", "9876543210")
+    assert again == key
+    assert box.enqueue(again, {"n": 2}, reference="OTHER") == (
+        key[:8].upper(),
+        outbox.PENDING,
+        False,
+    )
+    assert box.db.execute("SELECT COUNT(*), payload FROM outbox").fetchone() == (
+        1,
+        '{"n": 1}',
+    )
+    assert box.counts["queued"] == 1 and box.counts["duplicate"] == 1
+
+
+def test_failed_deliveries_retry_with_backoff(make_outbox):
+    deliver = StubDeliver(ConnectionError("refused"), TimeoutError("slow"))
+    box = make_outbox(deliver)
+    box.enqueue("k", {"name": "x"})
+
+    for attempts, error in ((1, "ConnectionError: refused"), (2, "TimeoutError: slow")):
+        before = time.time()
+        assert deliver_due(box) == 1
+        status, tries, next_attempt_at, last_error = row(box, "k")
+        assert (status, tries, last_error) == (outbox.PENDING, attempts, error)
+        backoff = next_attempt_at - before
+        assert 2.0**attempts <= backoff < 2.0**attempts + 1
+        # Not due again until the backoff has passed.
+        assert deliver_due(box) == 0
+        box.db.execute("UPDATE outbox SET next_attempt_at = 0")
+
+    assert deliver_due(box) == 1
+    assert row(box, "k")[:2] == (outbox.DELIVERED, 3)
+    assert deliver.calls == [({"name": "x"}, "k")] * 3
+    assert box.counts["retry"] == 2 and box.counts["delivered"] == 1
+
+
+def test_gives_up_after_max_attempts(make_outbox):
+    box = make_outbox(StubDeliver(*[ConnectionError("refused")] * 3), max_attempts=3)
+    box.enqueue("k", {})
+    for _ in range(3):
+        deliver_due(box)
+        box.db.execute("UPDATE outbox SET next_attempt_at = 0")
+    assert row(box, "k")[:2] == (outbox.FAILED, 3)
+    assert deliver_due(box) == 0
+
+
+def test_permanent_error_is_not_retried(make_outbox):
+    deliver = StubDeliver(outbox.PermanentError("rejected"))
+    box = make_outbox(deliver)
+    box.enqueue("k", {})
+    assert deliver_due(box) == 1
+    status, attempts, _, last_error = row(box, "k")
+    assert (status, attempts) == (outbox.FAILED, 1)
+    assert last_error == "PermanentError: rejected"
+    box.db.execute("UPDATE outbox SET next_attempt_at = 0")
+    assert deliver_due(box) == 0
+    assert len(deliver.calls) == 1 and box.counts["failed"] == 1
+
+
+def test_expired_claims_are_delivered_again(make_outbox):
+    box = make_outbox(StubDeliver(), claim_timeout=60)
+    box.enqueue("k", {})
+    # Claimed by a process that died before recording the delivery.
+    box._claim()
+    assert row(box, "k")[0] == outbox.SENDING
+    assert deliver_due(box) == 0
+    box.db.execute("UPDATE outbox SET next_attempt_at = 0")
+    assert deliver_due(box) == 1
+    assert row(box, "k")[:2] == (outbox.DELIVERED, 2)
+
+
+def test_delivery_thread_sends_new_rows(make_outbox):
+    deliver = StubDeliver()
+    box = make_outbox(deliver, poll_interval=0.05)
+    box.start()
+    box.enqueue("k", {"name": "x"})
+    assert deliver.delivered.wait(5)
+    for _ in range(100):
+        if row(box, "k")[0] == outbox.DELIVERED:
+            break
+        time.sleep(0.05)
+    assert row(box, "k")[0] == outbox.DELIVERED
+
+
+def test_slot_room_is_shared_and_freed_by_failure(make_outbox):
+    first = make_outbox(StubDeliver())
+    second = make_outbox(StubDeliver())  # another worker on the same file
+    first.enqueue("a", {}, slot="kondapur|2026-10-20|10", room=2)
+    second.enqueue("b", {}, slot="kondapur|2026-10-20|10", room=2)
+    with pytest.raises(outbox.SlotFull):
+        first.enqueue("c", {}, slot="kondapur|2026-10-20|10", room=2)
+    assert second.held("kondapur|") == {"kondapur|2026-10-20|10": 2}
+    # Rows from before the availability snapshot are already counted in it.
+    assert second.held("kondapur|", since=time.time() + 1) == {}
+
+    first.db.execute(
+        "UPDATE outbox SET status = ? WHERE idempotency_key = 'a'", (outbox.FAILED,)
+    )
+    assert first.enqueue("c", {}, slot="kondapur|2026-10-20|10", room=2)[2]
@@ -0,0 +1,130 @@
+import base64
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import telephony
+
+# Fixtures, 8 kHz mu-law in and 24 kHz model audio out, with the output the
+# transcoder gave for them when it was checked against audioop and an ideal
+# resampler. `PYTHONPATH=. python tests/test_telephony.py` rewrites them.
+FIXTURES = Path(__file__).parent / "fixtures"
+PHONE_IN = FIXTURES / "phone_in.ulaw"  # 1 s, 8 kHz mu-law
+PHONE_IN_EXPECTED = FIXTURES / "phone_in_16k.pcm"  # 16 kHz s16le
+MODEL_OUT = FIXTURES / "model_out_24k.pcm"  # 0.5 s, 24 kHz s16le
+MODEL_OUT_EXPECTED = FIXTURES / "model_out.ulaw"  # 8 kHz mu-law
+
+FRAME = 160  # 20 ms of 8 kHz mu-law, as Twilio sends it
+
+
+def voice_like(rate, seconds, seed):
+    # Harmonics on a wandering pitch under a syllable envelope, plus noise.
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(rate * seconds)) / rate
+    pitch = 140 + 30 * np.sin(2 * np.pi * 3 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 12) if k * 340 < rate / 2)
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t) ** 2
+    signal = 6000 * voice * envelope + rng.normal(0, 300, len(t))
+    return np.clip(signal, -32768, 32767).astype(np.int16)
+
+
+def twilio_media(payload):
+    return json.dumps(
+        {"event": "media", "media": {"payload": base64.b64encode(payload).decode()}}
+    )
+
+
+def inbound(ulaw, frame=FRAME):
+    twilio = telephony.TwilioProtocol()
+    pcm = b""
+    for i in range(0, len(ulaw), frame):
+        chunks, _ = twilio.parse(twilio_media(ulaw[i : i + frame]))
+        pcm += b"".join(chunks)
+    return pcm
+
+
+def outbound(pcm, frame_bytes=4800):
+    twilio = telephony.TwilioProtocol()
+    twilio.parse(json.dumps({"event": "start", "start": {"streamSid": "MZ1"}}))
+    ulaw = b""
+    for i in range(0, len(pcm), frame_bytes):
+        message = json.loads(twilio.encode_audio(pcm[i : i + frame_bytes]))
+        ulaw += base64.b64decode(message["media"]["payload"])
+    return ulaw
+
+
+def test_inbound_matches_fixture():
+    assert inbound(PHONE_IN.read_bytes()) == PHONE_IN_EXPECTED.read_bytes()
+
+
+def test_outbound_matches_fixture():
+    assert outbound(MODEL_OUT.read_bytes()) == MODEL_OUT_EXPECTED.read_bytes()
+
+
+@pytest.mark.parametrize("frame", [1, 7, 160, 333, 8000])
+def test_inbound_state_carries_across_frames(frame):
+    # However the stream is cut into frames, the output is the same.
+    assert inbound(PHONE_IN.read_bytes(), frame) == PHONE_IN_EXPECTED.read_bytes()
+
+
+@pytest.mark.parametrize("frame_bytes", [6, 960, 4800, 7002])
+def test_outbound_state_carries_across_frames(frame_bytes):
+    assert outbound(MODEL_OUT.read_bytes(), frame_bytes) == (
+        MODEL_OUT_EXPECTED.read_bytes()
+    )
+
+
+def test_ulaw_matches_audioop():
+    audioop = pytest.importorskip("audioop")
+    everything = bytes(range(256))
+    assert telephony.ulaw_decode(everything).tobytes() == audioop.ulaw2lin(
+        everything, 2
+    )
+    samples = np.arange(-32768, 32768, dtype=np.int16)
+    assert telephony.ulaw_encode(samples) == audioop.lin2ulaw(samples.tobytes(), 2)
+
+
+@pytest.mark.parametrize(
+    "up, down, rate_in, tone",
+    [(2, 1, 8000, 1000), (1, 3, 24000, 1000), (1, 3, 24000, 3000)],
+)
+def test_resampler_keeps_in_band_tones(up, down, rate_in, tone):
+    rate_out = rate_in * up // down
+    t = np.arange(rate_in) / rate_in
+    resampler = telephony.Resampler(up, down)
+    out = np.concatenate(
+        [
+            resampler.process(chunk)
+            for chunk in np.array_split(
+                (10000 * np.sin(2 * np.pi * tone * t)).astype(np.int16), 50
+            )
+        ]
+    )
+    # Compared with the ideal tone past the filter's delay.
+    delay = (len(resampler.kernel) - 1) / 2 / up / rate_in
+    t_out = np.arange(len(out)) / rate_out - delay
+    ideal = 10000 * np.sin(2 * np.pi * tone * t_out)
+    settled = slice(len(out) // 10, None)
+    error = out[settled] - ideal[settled]
+    assert np.sqrt(np.mean(error**2)) < 10000 * 0.01
+
+
+def test_resampler_rejects_tones_above_the_output_band():
+    t = np.arange(24000) / 24000
+    out = telephony.Resampler(1, 3).process(
+        (10000 * np.sin(2 * np.pi * 6000 * t)).astype(np.int16)
+    )
+    assert np.abs(out[400:]).max() < 100
+
+
+if __name__ == "__main__":
+    FIXTURES.mkdir(exist_ok=True)
+    phone = telephony.ulaw_encode(voice_like(8000, 1.0, seed=1))
+    PHONE_IN.write_bytes(phone)
+    PHONE_IN_EXPECTED.write_bytes(inbound(phone))
+    model = voice_like(24000, 0.5, seed=2).tobytes()
+    MODEL_OUT.write_bytes(model)
+    MODEL_OUT_EXPECTED.write_bytes(outbound(model))
@@ -0,0 +1,38 @@
+import pytest
+
+import tool_output
+
+
+def catalogue(count):
+    return {
+        "total_matches": count,
+        "results": [
+            {
+                "name": f"Complete Blood Count panel {i}",
+                "price": 499 + i,
+                "description": "Measures red cells, white cells and platelets. " * 6,
+                "sampleType": "blood",
+                "_id": f"id{i}",
+            }
+            for i in range(count)
+        ],
+    }
+
+
+@pytest.mark.parametrize("budget", [100, 200, 400, 700, 2048])
+def test_compact_keeps_results_a_dict_within_budget(budget):
+    out = tool_output.compact("get_test_details", catalogue(40), budget)
+    assert isinstance(out, dict)
+    assert tool_output._size(out) <= budget
+    assert out["truncated"] is True
+    assert out["total_matches"] == 40
+
+
+def test_compact_leaves_results_that_fit_alone():
+    out = tool_output.compact("get_test_details", catalogue(2), 4096)
+    assert "truncated" not in out
+    assert [entry["name"] for entry in out["results"]] == [
+        "Complete Blood Count panel 0",
+        "Complete Blood Count panel 1",
+    ]
+    assert "_id" not in out["results"][0]
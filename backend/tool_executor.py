@@ -0,0 +1,65 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+# Tools are plain blocking functions (they use `requests`), so they run on a
+# bounded thread pool and the event loop keeps relaying audio for every other
+# session while a tool call is in flight.
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", "16"))
+DEFAULT_TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "8"))
+
+tool_timeouts = {
+    "get_health_packages": 10.0,
+    "get_test_details": 20.0,
+    "book_appointment": 15.0,
+    "check_availability": 10.0,
+}
+
+_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+
+
+def get_tool_timeout(tool_name):
+    return tool_timeouts.get(tool_name, DEFAULT_TOOL_TIMEOUT)
+
+
+async def run_tool(functions, tool_name, args=None):
+    """Run `tool_name` from `functions`, the calling assistant's tools."""
+    func = functions.get(tool_name)
+    if func is None:
+        # The model asked for a tool this assistant does not have.
+        metrics.tool_calls.inc(1, tool_name, "unknown")
+        return {"error": f"{tool_name} is not available"}
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    status = "cancelled"
+    # The tool sees the calling session's context vars, e.g. its session id.
+    call = functools.partial(contextvars.copy_context().run, func, **(args or {}))
+    future = loop.run_in_executor(_executor, call)
+    try:
+        result = await asyncio.wait_for(future, timeout=get_tool_timeout(tool_name))
+        status = "ok"
+        return result
+    except asyncio.TimeoutError:
+        # The worker thread cannot be interrupted, but the HTTP calls inside
+        # the tools carry their own timeouts so it frees up shortly after.
+        status = "timeout"
+        return {"error": f"{tool_name} timed out, please try again"}
+    except Exception as e:
+        log.warning("tool %s failed: %s", tool_name, e)
+        status = "error"
+        return {"error": f"{tool_name} failed - {e}"}
+    finally:
+        metrics.tool_duration.observe(time.monotonic() - started, tool_name)
+        metrics.tool_calls.inc(1, tool_name, status)
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,119 @@
+import json
+import os
+
+# Shapes tool results before they go back to Gemini. Every byte of a tool
+# response is read by the model on the next turn and stays in the session
+# context, so results are projected to the fields the agent talks about,
+# long strings are cut and the whole response is held to a byte budget
+# (~4 bytes per token).
+TOOL_RESPONSE_MAX_BYTES = int(os.getenv("TOOL_RESPONSE_MAX_BYTES", "2048"))
+MAX_STRING_CHARS = 200
+MAX_LIST_ITEMS = 10
+SHORT_DESCRIPTION_CHARS = 80
+
+DROP_KEYS = {"locations", "_id", "__v", "createdAt", "updatedAt", "image", "images"}
+
+CATALOG_FIELDS = (
+    "name",
+    "price",
+    "also_known_as",
+    "description",
+    "sampleType",
+    "reportingTime",
+    "tat",
+    "preparation",
+    "testCount",
+)
+
+# tool name -> fields kept on each entry of result["results"]
+projections = {
+    "get_health_packages": CATALOG_FIELDS,
+    "get_test_details": CATALOG_FIELDS,
+}
+
+
+def _size(value):
+    return len(
+        json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+    )
+
+
+def _truncate(text, limit):
+    if len(text) <= limit:
+        return text
+    return text[: limit - 3].rstrip() + "..."
+
+
+def prune(value):
+    if isinstance(value, dict):
+        return {
+            key: prune(item)
+            for key, item in value.items()
+            if key not in DROP_KEYS and item is not None
+        }
+    if isinstance(value, (list, tuple)):
+        return [prune(item) for item in value[:MAX_LIST_ITEMS]]
+    if isinstance(value, str):
+        return _truncate(value, MAX_STRING_CHARS)
+    return value
+
+
+def project(tool_name, result):
+    fields = projections.get(tool_name)
+    if fields and isinstance(result, dict) and isinstance(result.get("results"), list):
+        result = dict(
+            result,
+            results=[
+                {field: entry[field] for field in fields if field in entry}
+                for entry in result["results"]
+            ],
+        )
+    return prune(result)
+
+
+def _shrink_results(result, budget):
+    # Cheapest losses first: shorter descriptions, then only name and price,
+    # then fewer results. The flag is set first so its bytes are counted.
+    result["truncated"] = True
+    entries = result["results"]
+    for entry in entries:
+        if "description" in entry:
+            entry["description"] = _truncate(
+                entry["description"], SHORT_DESCRIPTION_CHARS
+            )
+    if _size(result) <= budget:
+        return result
+
+    result["results"] = entries = [
+        {key: entry[key] for key in ("name", "price") if key in entry}
+        for entry in entries
+    ]
+    while entries and _size(result) > budget:
+        entries.pop()
+    return result
+
+
+def compact(tool_name, result, budget=TOOL_RESPONSE_MAX_BYTES):
+    """Project `result` for `tool_name` and fit it into `budget` bytes."""
+    result = project(tool_name, result)
+    if _size(result) <= budget:
+        return result
+    if isinstance(result, dict) and isinstance(result.get("results"), list):
+        result = _shrink_results(result, budget)
+        if _size(result) <= budget:
+            return result
+    # Nothing structured left to drop, hand over a clipped rendering.
+    text = result if isinstance(result, str) else json.dumps(result, default=str)
+    return _truncate(text, budget)
+
+
+def summarize(tool_name, result):
+    """One line for the caller-facing activity feed."""
+    if isinstance(result, dict):
+        if "error" in result:
+            return f"{tool_name}: {_truncate(str(result['error']), 120)}"
+        if isinstance(result.get("results"), list):
+            names = ", ".join(entry.get("name", "?") for entry in result["results"][:3])
+            total = result.get("total_matches", len(result["results"]))
+            return f"{tool_name}: {len(result['results'])} of {total} - {names}"
+    return f"{tool_name}: {_truncate(str(result), 120)}"
@@ -1,43 +1,315 @@
+import logging
+import os
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
 
+import callcontext
+from availability import (
+    AvailabilityIndex,
+    InvalidSlot,
+    Snapshot,
+    format_date,
+    format_hour,
+    normalise_location,
+    parse_hour,
+    slot_id,
+    slot_prefix,
+)
+from cache import TTLCache
+from catalog import Catalog
+from outbox import (
+    DELIVERED,
+    FAILED,
+    Outbox,
+    PermanentError,
+    SlotFull,
+    idempotency_key,
+)
 
-def get_health_packages():
-    url = "https://api.yodadiagnostics.com/tests/popular/health-packages"
-    response = requests.get(url)
-    response = response.json()
+log = logging.getLogger(__name__)
+
+API_URL = "https://api.yodadiagnostics.com"
+HTTP_TIMEOUT = float(os.getenv("TOOL_HTTP_TIMEOUT", "6"))
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", "300"))
+CATALOG_STALE_TTL = float(os.getenv("CATALOG_STALE_TTL", "3600"))
+TEST_PAGE_SIZE = 100
+MAX_TEST_PAGES = 50
+# Only the best few matches go back to the model.
+SEARCH_LIMIT = 5
+MAX_SEARCH_LIMIT = 10
+# Bookings go to a local outbox and are POSTed to BOOKING_API_URL in the
+# background with an Idempotency-Key header. Without a URL they are only
+# logged, as before.
+BOOKING_API_URL = os.getenv("BOOKING_API_URL")
+BOOKING_OUTBOX_PATH = os.getenv("BOOKING_OUTBOX_PATH", "booking_outbox.db")
+BOOKING_WORKERS = int(os.getenv("BOOKING_WORKERS", "4"))
+BOOKING_MAX_ATTEMPTS = int(os.getenv("BOOKING_MAX_ATTEMPTS", "8"))
+# Collection slot capacity is loaded in bulk from AVAILABILITY_URL, a JSON
+# list of {"location", "date": "YYYY-MM-DD", "hour", "capacity", "booked"},
+# and refreshed every AVAILABILITY_TTL seconds. Without a URL every slot
+# holds SLOT_CAPACITY bookings. Bookings in the outbox since the last fetch
+# count against a slot until their delivery fails, across every worker
+# sharing BOOKING_OUTBOX_PATH.
+AVAILABILITY_URL = os.getenv("AVAILABILITY_URL")
+AVAILABILITY_TTL = float(os.getenv("AVAILABILITY_TTL", "60"))
+AVAILABILITY_STALE_TTL = float(os.getenv("AVAILABILITY_STALE_TTL", "600"))
+SLOT_CAPACITY = int(os.getenv("SLOT_CAPACITY", "4"))
+BOOKING_HORIZON_DAYS = int(os.getenv("BOOKING_HORIZON_DAYS", "14"))
+LAB_LOCATIONS = (
+    "ameerpet",
+    "visakhapatnam",
+    "begumpet",
+    "bhagathnagar",
+    "gachibowli",
+    "jubilee-hills",
+    "jillelaguda",
+    "karimnagar",
+    "kondapur",
+    "kukatpally",
+    "ngos-colony",
+    "nizampet",
+    "panjagutta",
+    "shivam-road",
+    "tarnaka",
+    "vasanth-nagar",
+    "guntur",
+    "tirupati",
+)
 
-    packages = []
-    for pkg in response["data"]:
-        pkg.pop("locations", None)
-        packages.append(pkg)
-    return packages
+# One pooled session shared by the tool worker threads, so calls reuse
+# keep-alive connections to the Yoda API instead of a fresh TLS handshake each.
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
 
+# The catalog is the same for every caller and changes rarely, so all
+# sessions in the process share one indexed copy of it, rebuilt in the
+# background once it goes stale.
+catalog_cache = TTLCache(ttl=CATALOG_TTL, stale_ttl=CATALOG_STALE_TTL)
+availability_cache = TTLCache(ttl=AVAILABILITY_TTL, stale_ttl=AVAILABILITY_STALE_TTL)
+availability_index = AvailabilityIndex(LAB_LOCATIONS, BOOKING_HORIZON_DAYS)
 
-def get_test_details():
-    url = "https://api.yodadiagnostics.com/tests/paginate/individual/10/1"
-    response = requests.get(url)
+
+def fetch_health_packages():
+    url = f"{API_URL}/tests/popular/health-packages"
+    response = http_session.get(url, timeout=HTTP_TIMEOUT)
     response = response.json()
+    return Catalog(response["data"])
 
-    tests = []
-    for test in response["data"]["docs"]:
-        test.pop("locations", None)
-        tests.append(test)
-    return tests
 
+def fetch_test_catalog():
+    # Walk every page once per refresh, so searches see the whole catalog
+    # rather than the first page.
+    docs = []
+    for page in range(1, MAX_TEST_PAGES + 1):
+        url = f"{API_URL}/tests/paginate/individual/{TEST_PAGE_SIZE}/{page}"
+        response = http_session.get(url, timeout=HTTP_TIMEOUT)
+        data = response.json()["data"]
+        docs.extend(data["docs"])
 
-def book_appointment(**kwargs):
-    print("BOOK APPOINTMENT: ", kwargs)
-    return "Booking successful - " + f"{kwargs}"
+        if "hasNextPage" in data:
+            more = data["hasNextPage"]
+        elif "totalPages" in data:
+            more = page < data["totalPages"]
+        else:
+            more = len(data["docs"]) == TEST_PAGE_SIZE
+        if not more or not data["docs"]:
+            break
+    return Catalog(docs)
 
 
-function_map = {
-    "yoda_diagnostics": {
-        "get_health_packages": get_health_packages,
-        "get_test_details": get_test_details,
-        "book_appointment": book_appointment,
+def fetch_availability():
+    if not AVAILABILITY_URL:
+        return Snapshot(default_capacity=SLOT_CAPACITY)
+    # Bookings held locally after this moment may be missing from the reply.
+    fetched_at = time.time()
+    response = http_session.get(AVAILABILITY_URL, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    slots = response.json()
+    if isinstance(slots, dict):
+        slots = slots["data"]
+    capacity, booked = {}, {}
+    for slot in slots:
+        key = (normalise_location(slot["location"]), slot["date"], int(slot["hour"]))
+        capacity[key] = int(slot["capacity"])
+        booked[key] = int(slot.get("booked", 0))
+    return Snapshot(capacity, booked, fetched_at=fetched_at)
+
+
+def _slots():
+    return availability_cache.get("slots", fetch_availability)
+
+
+def _held(snapshot, lab):
+    return booking_outbox.held(slot_prefix(lab), since=snapshot.fetched_at)
+
+
+def _limit(limit):
+    return max(1, min(int(limit or SEARCH_LIMIT), MAX_SEARCH_LIMIT))
+
+
+def get_health_packages(query=None, max_price=None, limit=None):
+    packages = catalog_cache.get("health_packages", fetch_health_packages)
+    return packages.search(query, max_price=max_price, limit=_limit(limit))
+
+
+def get_test_details(query=None, min_price=None, max_price=None, limit=None):
+    tests = catalog_cache.get("test_catalog", fetch_test_catalog)
+    return tests.search(query, min_price, max_price, limit=_limit(limit))
+
+
+def check_availability(location=None, date=None):
+    try:
+        lab = availability_index.location(location)
+        day = availability_index.day(date) if date else None
+    except InvalidSlot as e:
+        return {"error": str(e)}
+    snapshot = _slots()
+    held = _held(snapshot, lab)
+    if day is None:
+        return {
+            "location": lab,
+            "days": [
+                {
+                    "date": format_date(day),
+                    "available_slots": list(map(format_hour, hours)),
+                }
+                for day, hours in availability_index.upcoming(snapshot, lab, held)
+            ],
+        }
+    hours = availability_index.free_hours(snapshot, lab, day, held)
+    result = {
+        "location": lab,
+        "date": format_date(day),
+        "available_slots": list(map(format_hour, hours)),
+    }
+    if not hours:
+        result["next_available"] = [
+            {"date": format_date(day), "available_slots": list(map(format_hour, hours))}
+            for day, hours in availability_index.upcoming(snapshot, lab, held, days=1)
+        ]
+    return result
+
+
+def warm_up():
+    catalog_cache.get("health_packages", fetch_health_packages)
+    catalog_cache.get("test_catalog", fetch_test_catalog)
+    availability_cache.get("slots", fetch_availability)
+
+
+def deliver_booking(booking, key):
+    if not BOOKING_API_URL:
+        log.info("book appointment", extra={"booking": booking})
+        return
+    response = http_session.post(
+        BOOKING_API_URL,
+        json=booking,
+        headers={"Idempotency-Key": key},
+        timeout=HTTP_TIMEOUT,
+    )
+    # Client errors other than timeouts and rate limits will fail again.
+    if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+        raise PermanentError(f"{response.status_code} {response.text[:200]}")
+    response.raise_for_status()
+
+
+booking_outbox = Outbox(
+    BOOKING_OUTBOX_PATH,
+    deliver_booking,
+    workers=BOOKING_WORKERS,
+    max_attempts=BOOKING_MAX_ATTEMPTS,
+)
+
+
+def _already_requested(reference, status):
+    return {
+        "status": {DELIVERED: "confirmed", FAILED: "failed"}.get(status, "requested"),
+        "reference": reference,
+        "message": "This booking was already requested, do not book it again",
     }
+
+
+def book_appointment(location=None, **kwargs):
+    # Slots are validated and counted against the outbox before queueing, so
+    # a full or closed slot is answered straight away instead of after the
+    # booking API rejects it.
+    try:
+        day = availability_index.day(kwargs.get("date"))
+        hour = parse_hour(kwargs.get("time"))
+        availability_index.check_hour(day, hour)
+        lab = availability_index.location(location)
+    except InvalidSlot as e:
+        return {"error": str(e)}
+
+    # The same patient, test and slot within one call is the same booking,
+    # however many times the model retries the tool call.
+    key = idempotency_key(
+        callcontext.session_id(),
+        kwargs.get("phone"),
+        kwargs.get("testName"),
+        day.isoformat(),
+        hour,
+    )
+    if existing := booking_outbox.get(key):
+        return _already_requested(*existing)
+
+    booking = dict(kwargs, location=lab, slotDate=day.isoformat(), slotHour=hour)
+    snapshot = _slots()
+    try:
+        reference, status, created = booking_outbox.enqueue(
+            key,
+            booking,
+            slot=slot_id(lab, day.isoformat(), hour),
+            room=snapshot.free((lab, day.isoformat(), hour)),
+            since=snapshot.fetched_at,
+        )
+    except SlotFull:
+        hours = availability_index.free_hours(snapshot, lab, day, _held(snapshot, lab))
+        return {
+            "error": f"{format_hour(hour)} on {format_date(day)} at {lab} is fully booked",
+            "available_slots": list(map(format_hour, hours)),
+        }
+    if not created:
+        return _already_requested(reference, status)
+    call = callcontext.current.get()
+    if call is not None and call.memory is not None:
+        call.memory.booked(reference, booking)
+    return {
+        "status": "requested",
+        "reference": reference,
+        "message": "Booking request received, the patient gets a confirmation once the lab accepts it",
+    }
+
+
+# Every tool an assistant may be given, by declaration name.
+implementations = {
+    "get_health_packages": get_health_packages,
+    "get_test_details": get_test_details,
+    "book_appointment": book_appointment,
+    "check_availability": check_availability,
 }
 
+function_map = {
+    "yoda_diagnostics": dict(implementations),
+}
+
+
+def functions(tool_names):
+    """The implementations of `tool_names`, by name."""
+    missing = [name for name in tool_names if name not in implementations]
+    if missing:
+        raise KeyError(f"no implementation for tools {missing}")
+    return {name: implementations[name] for name in tool_names}
+
+
+def register(assistant_name, tool_names):
+    function_map[assistant_name] = functions(tool_names)
+
+
+def unregister(assistant_name):
+    function_map.pop(assistant_name, None)
+
 
 def get_tool(assistant_name, tool_name):
     return function_map[assistant_name][tool_name]
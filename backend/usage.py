@@ -0,0 +1,277 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from sqlitestore import SQLiteStore
+
+log = logging.getLogger(__name__)
+
+# Usage accounting and budgets. Every call keeps a running total of the
+# tokens Gemini reports in usage_metadata (each turn is billed for the whole
+# context, so the per-turn totals add up) and of how long it has run.
+#
+#   soft limit   the model is told to wrap the call up, once
+#   hard limit   the call ends after the current reply has played out
+#
+# Limits are USAGE_* below, 0 turns a limit off; an assistant file can set
+# its own with a "budget" object using the same names in lower case without
+# the prefix, e.g. {"budget": {"hard_tokens": 200000}}.
+#
+# Per assistant, usage is also added up per minute in memory and flushed to
+# USAGE_PATH every USAGE_FLUSH_INTERVAL seconds. The flush reads back every
+# worker's usage over the last USAGE_WINDOW seconds; an assistant past its
+# window_tokens there takes no new calls until the window moves on.
+USAGE_SOFT_TOKENS = int(os.getenv("USAGE_SOFT_TOKENS", "0"))
+USAGE_HARD_TOKENS = int(os.getenv("USAGE_HARD_TOKENS", "0"))
+USAGE_SOFT_SECONDS = float(os.getenv("USAGE_SOFT_SECONDS", "0"))
+USAGE_HARD_SECONDS = float(os.getenv("USAGE_HARD_SECONDS", "0"))
+USAGE_WINDOW_TOKENS = int(os.getenv("USAGE_WINDOW_TOKENS", "0"))
+USAGE_WINDOW = float(os.getenv("USAGE_WINDOW", "3600"))
+USAGE_PATH = os.getenv("USAGE_PATH", "usage.db")
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "10"))
+# How long a call past its hard limit may take to finish the reply playing.
+USAGE_END_GRACE = float(os.getenv("USAGE_END_GRACE", "10"))
+# Per-minute rows older than this are deleted.
+USAGE_RETENTION_DAYS = float(os.getenv("USAGE_RETENTION_DAYS", "30"))
+
+SOFT = "soft"
+HARD = "hard"
+
+WRAP_UP_PROMPT = (
+    "Note from the system, not said by the caller: this call is close to its"
+    " time limit. Finish what the caller needs as briefly as you can, then"
+    " let them know the call will end shortly and say goodbye."
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    assistant TEXT NOT NULL,
+    minute INTEGER NOT NULL,
+    calls INTEGER NOT NULL DEFAULT 0,
+    call_seconds REAL NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    response_tokens INTEGER NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (assistant, minute)
+);
+"""
+_COLUMNS = ("calls", "call_seconds", "prompt_tokens", "response_tokens", "total_tokens")
+
+
+class Budget:
+    __slots__ = (
+        "soft_tokens",
+        "hard_tokens",
+        "soft_seconds",
+        "hard_seconds",
+        "window_tokens",
+    )
+
+    def __init__(
+        self,
+        soft_tokens=USAGE_SOFT_TOKENS,
+        hard_tokens=USAGE_HARD_TOKENS,
+        soft_seconds=USAGE_SOFT_SECONDS,
+        hard_seconds=USAGE_HARD_SECONDS,
+        window_tokens=USAGE_WINDOW_TOKENS,
+    ):
+        self.soft_tokens = soft_tokens
+        self.hard_tokens = hard_tokens
+        self.soft_seconds = soft_seconds
+        self.hard_seconds = hard_seconds
+        self.window_tokens = window_tokens
+
+    @classmethod
+    def from_spec(cls, spec, base=None):
+        """The limits in an assistant file's "budget", the rest from `base`."""
+        base = base or cls()
+        values = {name: getattr(base, name) for name in cls.__slots__}
+        unknown = set(spec or {}) - set(values)
+        if unknown:
+            raise KeyError(f"unknown budget limits {sorted(unknown)}")
+        values.update(spec or {})
+        return cls(**values)
+
+
+DEFAULT_BUDGET = Budget()
+
+
+class SessionUsage:
+    """Running totals for one call, checked against its budget."""
+
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        self.started = time.monotonic()
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+        self.total_tokens = 0
+        # The limit reached so far, None, SOFT or HARD, and which one.
+        self.state = None
+        self.reason = None
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def add(self, prompt_tokens, response_tokens, total_tokens):
+        self.prompt_tokens += prompt_tokens or 0
+        self.response_tokens += response_tokens or 0
+        self.total_tokens += total_tokens or 0
+        return self.check()
+
+    def check(self):
+        """SOFT or HARD when the call has just reached that limit, else None."""
+        budget = self.budget
+        elapsed = self.elapsed()
+        for state, reason, used, limit in (
+            (HARD, "tokens", self.total_tokens, budget.hard_tokens),
+            (HARD, "seconds", elapsed, budget.hard_seconds),
+            (SOFT, "tokens", self.total_tokens, budget.soft_tokens),
+            (SOFT, "seconds", elapsed, budget.soft_seconds),
+        ):
+            if limit and used >= limit:
+                if state == self.state or self.state == HARD:
+                    return None
+                self.state, self.reason = state, reason
+                return state
+        return None
+
+    def next_deadline(self):
+        """Seconds until the next time limit, None when none is left."""
+        budget = self.budget
+        limits = [budget.hard_seconds]
+        if self.state is None:
+            limits.append(budget.soft_seconds)
+        limits = [limit for limit in limits if limit]
+        if not limits or self.state == HARD:
+            return None
+        return max(0.0, min(limits) - self.elapsed())
+
+    def totals(self):
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "response_tokens": self.response_tokens,
+            "total_tokens": self.total_tokens,
+            "call_seconds": round(self.elapsed(), 3),
+        }
+
+
+class UsageStore(SQLiteStore):
+    """Per-assistant usage by minute, kept in memory and flushed to SQLite.
+
+    `add` runs on the event loop and only touches the in-memory buckets;
+    the flush thread writes them in one transaction and refreshes the
+    rolling window totals that `over_window` reads.
+    """
+
+    schema = SCHEMA
+
+    def __init__(self, path, flush_interval=10.0, window=3600.0, retention_days=30):
+        super().__init__(path)
+        self.flush_interval = flush_interval
+        self.window = window
+        self.retention_days = retention_days
+        # Every worker's usage over the window, as of the last flush.
+        self.window_tokens = {}
+        self._pending_lock = threading.Lock()
+        self._pending = {}
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pruned_at = 0.0
+
+    def _bucket(self, assistant):
+        key = (assistant, int(time.time() // 60))
+        bucket = self._pending.get(key)
+        if bucket is None:
+            bucket = self._pending[key] = dict.fromkeys(_COLUMNS, 0)
+        return bucket
+
+    def add(self, assistant, prompt_tokens, response_tokens, total_tokens):
+        with self._pending_lock:
+            bucket = self._bucket(assistant)
+            bucket["prompt_tokens"] += prompt_tokens or 0
+            bucket["response_tokens"] += response_tokens or 0
+            bucket["total_tokens"] += total_tokens or 0
+
+    def call_ended(self, assistant, seconds):
+        with self._pending_lock:
+            bucket = self._bucket(assistant)
+            bucket["calls"] += 1
+            bucket["call_seconds"] += seconds
+
+    def over_window(self, assistant, budget):
+        """Whether `assistant` has used up its window_tokens."""
+        if not budget.window_tokens:
+            return False
+        with self._pending_lock:
+            unflushed = sum(
+                bucket["total_tokens"]
+                for (name, _), bucket in self._pending.items()
+                if name == assistant
+            )
+        return self.window_tokens.get(assistant, 0) + unflushed >= budget.window_tokens
+
+    def flush(self):
+        with self._pending_lock:
+            batch, self._pending = self._pending, {}
+        now = time.time()
+        try:
+            with self._lock:
+                if batch:
+                    with self._transaction():
+                        self.db.executemany(
+                            f"INSERT INTO usage (assistant, minute, {', '.join(_COLUMNS)})"
+                            " VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (assistant, minute)"
+                            " DO UPDATE SET "
+                            + ", ".join(f"{c} = {c} + excluded.{c}" for c in _COLUMNS),
+                            [
+                                (name, minute, *(bucket[c] for c in _COLUMNS))
+                                for (name, minute), bucket in batch.items()
+                            ],
+                        )
+                if now - self._pruned_at > 3600:
+                    self.db.execute(
+                        "DELETE FROM usage WHERE minute < ?",
+                        (int((now - self.retention_days * 86400) // 60),),
+                    )
+                    self._pruned_at = now
+                self.window_tokens = dict(
+                    self.db.execute(
+                        "SELECT assistant, SUM(total_tokens) FROM usage"
+                        " WHERE minute >= ? GROUP BY assistant",
+                        (int((now - self.window) // 60),),
+                    ).fetchall()
+                )
+        except sqlite3.Error:
+            with self._pending_lock:
+                for key, bucket in batch.items():
+                    pending = self._pending.setdefault(key, dict.fromkeys(_COLUMNS, 0))
+                    for column in _COLUMNS:
+                        pending[column] += bucket[column]
+            raise
+
+    def _run(self):
+        # The first flush reads the window back before waiting.
+        while True:
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                log.warning("saving usage failed: %s", e)
+            if self._stopping.wait(self.flush_interval):
+                return
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="usage", daemon=True)
+            self._thread.start()
+
+    def close(self, timeout=5.0):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join(timeout)
+            self._thread = None
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            log.warning("saving usage failed: %s", e)
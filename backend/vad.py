@@ -0,0 +1,104 @@
+from collections import deque
+
+import numpy as np
+
+# Sentinel put on the upstream queue when the gate closes, so the sender can
+# tell Gemini the caller's audio stream has paused (audio_stream_end).
+STREAM_END = b""
+
+GATE = "gate"  # drop silence once the hangover has passed
+THIN = "thin"  # forward one silent chunk in every `thin_every`
+
+
+class EnergyGate:
+    """Energy based voice activity gate for 16-bit mono PCM.
+
+    Each chunk is cut into `frame_ms` frames and their energy is computed in
+    one vectorised pass. A frame is speech when it is above `threshold_db`
+    and `margin_db` above the running noise floor. Once speech is seen the
+    gate stays open for `hangover_ms` after the last speech frame, so the
+    model still hears the pause that ends the caller's turn. While closed,
+    the last `preroll_ms` of audio is held back and sent ahead of the next
+    onset so word beginnings are not clipped.
+    """
+
+    def __init__(
+        self,
+        sample_rate=16000,
+        frame_ms=20,
+        threshold_db=-45.0,
+        margin_db=10.0,
+        hangover_ms=800,
+        preroll_ms=300,
+        mode=GATE,
+        thin_every=4,
+    ):
+        self.frame_len = sample_rate * frame_ms // 1000
+        self.bytes_per_ms = sample_rate * 2 // 1000
+        self.threshold_db = threshold_db
+        self.margin_db = margin_db
+        self.hangover_bytes = hangover_ms * self.bytes_per_ms
+        self.preroll_bytes = preroll_ms * self.bytes_per_ms
+        self.mode = mode
+        self.thin_every = thin_every
+
+        self.noise_floor_db = -60.0
+        self.open = False
+        self.hangover_left = 0
+        self.preroll = deque()
+        self.preroll_size = 0
+        self.silent_chunks = 0
+        self.suppressed_bytes = 0
+
+    def is_speech(self, chunk):
+        samples = np.frombuffer(chunk, dtype=np.int16)
+        usable = len(samples) - len(samples) % self.frame_len
+        if usable:
+            frames = samples[:usable].reshape(-1, self.frame_len)
+        elif len(samples):
+            frames = samples.reshape(1, -1)
+        else:
+            return False
+
+        power = np.square(frames, dtype=np.float32).mean(axis=1)
+        db = 10.0 * np.log10(power / (32768.0 * 32768.0) + 1e-10)
+        threshold = max(self.threshold_db, self.noise_floor_db + self.margin_db)
+        voiced = db > threshold
+
+        quiet = db[~voiced]
+        if quiet.size:
+            # Track the background level slowly so a noisy line raises the
+            # bar without a single loud burst moving it.
+            self.noise_floor_db += 0.05 * (float(quiet.mean()) - self.noise_floor_db)
+        return bool(voiced.any())
+
+    def process(self, chunk):
+        """Return the chunks to forward upstream in place of `chunk`."""
+        if self.is_speech(chunk):
+            out = list(self.preroll) if not self.open else []
+            out.append(chunk)
+            self.preroll.clear()
+            self.preroll_size = 0
+            self.open = True
+            self.hangover_left = self.hangover_bytes
+            return out, True
+
+        if self.open:
+            self.hangover_left -= len(chunk)
+            if self.hangover_left > 0:
+                return [chunk], False
+            self.open = False
+            self.silent_chunks = 0
+            return [chunk, STREAM_END], False
+
+        self.silent_chunks += 1
+        if self.mode == THIN and self.silent_chunks % self.thin_every == 0:
+            return [chunk], False
+
+        self.preroll.append(chunk)
+        self.preroll_size += len(chunk)
+        while self.preroll_size - len(self.preroll[0]) >= self.preroll_bytes:
+            dropped = self.preroll.popleft()
+            self.preroll_size -= len(dropped)
+            self.suppressed_bytes += len(dropped)
+        return [], False